@@ -0,0 +1,154 @@
+"""
+Генератор синтетических каталогов для нагрузочных тестов.
+
+Дерево категорий задается глубиной и ветвлением (deep - длинная цепочка,
+wide - широкий корень, balanced - сбалансированное дерево), товары
+распределяются по листовым категориям. Каталог отдается телами /imports,
+после чего генератор выдает выгрузки с изменением цен (и изредка
+перемещением) случайных товаров.
+"""
+import random
+import uuid
+from itertools import chain
+from datetime import timedelta
+from typing import Iterator
+
+from market.api.utils import datetime_to_str, str_to_datetime
+
+SHAPES = {
+    'deep': {'depth': 1000, 'fanout': 1},
+    'wide': {'depth': 1, 'fanout': 1000},
+    'balanced': {'depth': 4, 'fanout': 8},
+}
+
+START_DATE = '2022-02-01T00:00:00.000Z'
+
+
+class CatalogGenerator:
+
+    def __init__(self, offers: int, depth: int, fanout: int, batch_size: int = 1000,
+                 start_date: str = START_DATE, seed: int | None = None):
+        """
+        :param offers: кол-во товаров
+        :param depth: глубина дерева категорий (без корня)
+        :param fanout: кол-во дочерних категорий у каждой категории
+        :param batch_size: кол-во элементов в одной выгрузке
+        :param start_date: дата первой выгрузки
+        :param seed: seed генератора случайных чисел
+        """
+
+        self.offers_count = offers
+        self.depth = depth
+        self.fanout = fanout
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+
+        self.first_date = str_to_datetime(start_date)
+        self.date = self.first_date
+
+        self.categories: list[str] = []
+        self.leaves: list[str] = []
+        # id товара: [номер, id родителя, цена] - компактнее словаря на миллионах товаров
+        self.offers: dict[str, list] = {}
+        self._offer_ides: list[str] = []
+
+    @classmethod
+    def from_shape(cls, shape: str, offers: int, **kwargs) -> 'CatalogGenerator':
+        return cls(offers, **{**SHAPES[shape], **kwargs})
+
+    def next_date(self) -> str:
+        """
+        :return: дата очередной выгрузки (каждая следующая на час позже)
+        """
+
+        self.date += timedelta(hours=1)
+        return datetime_to_str(self.date)
+
+    def make_import(self, items: list[dict]) -> dict:
+        return {'items': items, 'updateDate': self.next_date()}
+
+    def iter_categories(self) -> Iterator[dict]:
+        root_id = str(uuid.uuid4())
+        self.categories.append(root_id)
+        yield {'id': root_id, 'name': 'root', 'type': 'CATEGORY', 'parentId': None}
+
+        level = [root_id]
+        for depth in range(1, self.depth + 1):
+            next_level = []
+            for parent_id in level:
+                for index in range(self.fanout):
+                    category_id = str(uuid.uuid4())
+                    next_level.append(category_id)
+                    yield {'id': category_id, 'name': f'category {depth}.{index}', 'type': 'CATEGORY',
+                           'parentId': parent_id}
+            self.categories.extend(next_level)
+            level = next_level
+
+        self.leaves = level
+
+    def make_offer(self, offer_id: str) -> dict:
+        index, parent_id, price = self.offers[offer_id]
+        return {'id': offer_id, 'name': f'offer {index}', 'type': 'OFFER', 'parentId': parent_id, 'price': price}
+
+    def iter_offers(self) -> Iterator[dict]:
+        for index in range(self.offers_count):
+            offer_id = str(uuid.uuid4())
+            self.offers[offer_id] = [index, self.leaves[index % len(self.leaves)], self.random.randint(1, 100000)]
+            self._offer_ides.append(offer_id)
+            yield self.make_offer(offer_id)
+
+    def iter_catalog(self) -> Iterator[dict]:
+        """
+        :return: Iterator тел /imports: сначала категории (родители раньше детей), затем товары
+        """
+
+        batch = []
+        for shop_unit in chain(self.iter_categories(), self.iter_offers()):
+            batch.append(shop_unit)
+            if len(batch) == self.batch_size:
+                yield self.make_import(batch)
+                batch = []
+        if batch:
+            yield self.make_import(batch)
+
+    def churn(self, items: int = 100, max_change: float = 0.2, move_probability: float = 0.01) -> dict:
+        """
+        :param items: кол-во изменяемых товаров
+        :param max_change: максимальное относительное изменение цены
+        :param move_probability: вероятность перемещения товара в другую категорию
+        :return: тело /imports с новыми ценами случайных товаров
+        """
+
+        changed = {}
+        for _ in range(min(items, len(self.offers))):
+            offer_id = self.random_offer()
+            offer = self.offers[offer_id]
+            offer[2] = max(1, round(offer[2] * (1 + self.random.uniform(-max_change, max_change))))
+            if self.random.random() < move_probability:
+                offer[1] = self.random.choice(self.leaves)
+            changed[offer_id] = True
+        return self.make_import([self.make_offer(offer_id) for offer_id in changed])
+
+    def random_offer(self) -> str | None:
+        while self._offer_ides:
+            offer_id = self.random.choice(self._offer_ides)
+            if offer_id in self.offers:
+                return offer_id
+            self._offer_ides.remove(offer_id)
+        return None
+
+    def random_category(self) -> str:
+        return self.random.choice(self.categories)
+
+    def random_unit(self, category_probability: float = 0.5) -> str:
+        if self.random.random() < category_probability or not self.offers:
+            return self.random_category()
+        return self.random_offer()
+
+    def remove_offer(self, offer_id: str) -> None:
+        self.offers.pop(offer_id, None)
+
+
+__all__ = (
+    'CatalogGenerator', 'SHAPES',
+)
@@ -0,0 +1,160 @@
+"""
+Сравнение запросов к истории цен на трех раскладках таблицы history:
+plain - только уникальный индекс (shop_unit_id, update_date), indexed - плюс индекс
+по update_date, partitioned - секционирование по месяцам update_date (как в миграции c41d7e8a9b52).
+
+Синтетическая история за несколько лет пишется во временные таблицы в транзакции,
+которая откатывается, так что бд не меняется. Замеряются запрос /sales (окно 24 часа)
+и запрос /node/{id}/statistic (история одного элемента за месяц), для секционированной
+таблицы также выводится кол-во прочитанных секций (по EXPLAIN).
+
+python -m benchmarks.history --units 1000 --years 3 --queries 50
+"""
+import asyncio
+import json
+import random
+from datetime import timedelta
+from statistics import median
+from time import perf_counter
+
+from asyncpgsa import PG
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from market.api.utils import str_to_datetime
+from market.utils.argparse import positive_int
+from market.utils.pg import DataBaseData, DEFAULT_PG_URL
+
+LAYOUTS = ('plain', 'indexed', 'partitioned')
+START_DATE = '2022-02-01T00:00:00.000Z'
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('--units', type=positive_int, default=1000, help='Units with a price change every day')
+parser.add_argument('--years', type=positive_int, default=3, help='Years of history')
+parser.add_argument('--queries', type=positive_int, default=50, help='Queries per layout and query kind')
+parser.add_argument('--seed', type=int, default=None, help='Random seed')
+
+QUERIES = {
+    'sales': '''
+    SELECT DISTINCT shop_unit_id FROM {table}
+    WHERE update_date >= $1::timestamp - interval '1 day' AND update_date <= $1::timestamp''',
+    'statistic': '''
+    SELECT price, update_date FROM {table}
+    WHERE shop_unit_id = $1 AND update_date >= $2::timestamp AND update_date <= $2::timestamp + interval '1 month'
+    ORDER BY update_date''',
+}
+
+
+async def create_table(conn, layout: str, months: int) -> str:
+    """
+    :param conn: объект коннекта к бд (внутри транзакции)
+    :param layout: раскладка таблицы (plain/indexed/partitioned)
+    :param months: кол-во месяцев истории (для секций)
+    :return: имя созданной временной таблицы
+    """
+
+    table = f'history_bench_{layout}'
+    partition_by = ' PARTITION BY RANGE (update_date)' if layout == 'partitioned' else ''
+    await conn.execute(f'''
+    CREATE TEMPORARY TABLE {table} (
+        shop_unit_id varchar NOT NULL,
+        update_date timestamp NOT NULL,
+        price integer NOT NULL,
+        UNIQUE (shop_unit_id, update_date)
+    ){partition_by}''')
+
+    if layout != 'plain':
+        await conn.execute(f'CREATE INDEX ON {table} (update_date)')
+
+    if layout == 'partitioned':
+        month_start = str_to_datetime(START_DATE).replace(tzinfo=None)
+        for _ in range(months + 1):
+            month_end = (month_start + timedelta(days=32)).replace(day=1)
+            await conn.execute(
+                f"CREATE TEMPORARY TABLE {table}_{month_start:y%Ym%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{month_end.isoformat()}')"
+            )
+            month_start = month_end
+
+    return table
+
+
+async def fill_table(conn, table: str, units: int, days: int) -> int:
+    """
+    :return: кол-во записанных строк истории (по одному изменению цены каждого элемента в день)
+    """
+
+    await conn.execute(f'''
+    INSERT INTO {table} (shop_unit_id, update_date, price)
+    SELECT 'unit ' || unit, $1::timestamp + day * interval '1 day' + unit % 1440 * interval '1 minute',
+           (random() * 100000)::integer
+    FROM generate_series(0, $2 - 1) AS unit, generate_series(0, $3 - 1) AS day''',
+        str_to_datetime(START_DATE).replace(tzinfo=None), units, days
+    )
+    await conn.execute(f'ANALYZE {table}')
+    return units * days
+
+
+def count_scanned(plan: dict) -> int:
+    """
+    :param plan: узел плана EXPLAIN (FORMAT JSON)
+    :return: кол-во отсканированных таблиц (секций) в плане
+    """
+
+    return ('Relation Name' in plan) + sum(count_scanned(child) for child in plan.get('Plans', ()))
+
+
+async def run(args) -> None:
+    rand = random.Random(args.seed)
+    pg = PG()
+    await pg.init(**(await DataBaseData.get_from_url(str(DEFAULT_PG_URL.url))).__dict__)
+
+    days = args.years * 365
+    months = args.years * 12
+    start = str_to_datetime(START_DATE).replace(tzinfo=None)
+
+    # одни и те же параметры запросов для всех раскладок
+    params = {
+        'sales': [(start + timedelta(days=rand.randrange(1, days)),) for _ in range(args.queries)],
+        'statistic': [
+            (f'unit {rand.randrange(args.units)}', start + timedelta(days=rand.randrange(days - 31)))
+            for _ in range(args.queries)
+        ],
+    }
+
+    print(f'{"layout":<14}{"rows":>12}{"fill, s":>10}{"sales, ms":>12}{"scanned":>9}'
+          f'{"statistic, ms":>15}{"scanned":>9}')
+    async with pg.pool.acquire() as conn:
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            for layout in LAYOUTS:
+                table = await create_table(conn, layout, months)
+                started = perf_counter()
+                rows = await fill_table(conn, table, args.units, days)
+                fill_time = perf_counter() - started
+
+                line = f'{layout:<14}{rows:>12}{fill_time:>10.2f}'
+                for kind, query in QUERIES.items():
+                    query = query.format(table=table)
+                    timings = []
+                    for query_params in params[kind]:
+                        started = perf_counter()
+                        await conn.fetch(query, *query_params)
+                        timings.append(perf_counter() - started)
+
+                    plan = json.loads(await conn.fetchval(f'EXPLAIN (FORMAT JSON) {query}', *params[kind][0]))
+                    width = 12 if kind == 'sales' else 15
+                    line += f'{median(timings) * 1000:>{width}.3f}{count_scanned(plan[0]["Plan"]):>9}'
+                print(line)
+        finally:
+            await transaction.rollback()
+
+    await pg.pool.close()
+
+
+def main():
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Сравнение пропускной способности двух путей записи выгрузки в shop_units и relations:
+multi-VALUES запросы частями (--import-mode values) и бинарный COPY во временную
+таблицу с переносом одним запросом (--import-mode copy).
+
+Каждый прогон выполняется в транзакции, которая откатывается, так что бд не меняется.
+
+python -m benchmarks.ingest --items 100000 --repeats 3
+"""
+import asyncio
+import uuid
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+from aiomisc import chunk_list
+from asyncpgsa import PG
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from market.api.importer import IMPORT_MODES, ShopUnitsImporter
+from market.api.utils import STATEMENTS, str_to_datetime
+from market.utils.argparse import positive_int
+from market.utils.pg import DataBaseData, DEFAULT_PG_URL
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('--items', type=positive_int, default=100000, help='Items per import')
+parser.add_argument('--categories', type=positive_int, default=100, help='Categories per import')
+parser.add_argument('--repeats', type=positive_int, default=3, help='Runs per mode')
+
+
+def make_items(items: int, categories: int) -> list[dict]:
+    """
+    :param items: кол-во элементов выгрузки
+    :param categories: кол-во категорий среди них
+    :return: список элементов выгрузки в формате /imports
+
+    Функция генерации выгрузки: корень, под ним категории, под категориями товары
+    """
+
+    root_id = str(uuid.uuid4())
+    shop_units = [{'id': root_id, 'name': 'root', 'type': 'CATEGORY', 'parentId': None}]
+    category_ides = [str(uuid.uuid4()) for _ in range(categories)]
+    shop_units.extend(
+        {'id': category_id, 'name': 'category', 'type': 'CATEGORY', 'parentId': root_id}
+        for category_id in category_ides
+    )
+    shop_units.extend(
+        {
+            'id': str(uuid.uuid4()), 'name': f'offer {index}', 'type': 'OFFER',
+            'parentId': category_ides[index % categories], 'price': index
+        }
+        for index in range(items - categories - 1)
+    )
+    return shop_units
+
+
+async def ingest(conn, mode: str, shop_units: list[dict], date: datetime) -> None:
+    """
+    :param conn: объект коннекта к бд (внутри транзакции)
+    :param mode: путь записи (values/copy)
+    :param shop_units: элементы выгрузки
+    :param date: дата обновления
+    :return: None
+
+    Функция записи выгрузки тем же путем, что и ShopUnitsImporter.import_chunk (без проверок и пересчета веток)
+    """
+
+    shop_unit_rows = list(ShopUnitsImporter.make_shop_units_table_rows(shop_units, date))
+    if mode == 'copy':
+        await ShopUnitsImporter.copy_shop_units(conn, shop_unit_rows)
+        await STATEMENTS.execute(conn, 'merge_relations')
+        return
+
+    for chunk in chunk_list(shop_unit_rows, ShopUnitsImporter.MAX_CITIZENS_PER_INSERT):
+        await ShopUnitsImporter.insert_shop_units(conn, chunk)
+    relations_rows = ShopUnitsImporter.make_relations_table_rows(shop_units)
+    for chunk in chunk_list(relations_rows, ShopUnitsImporter.MAX_RELATIONS_PER_INSERT):
+        await ShopUnitsImporter.add_relatives(conn, chunk)
+
+
+async def run(args) -> None:
+    pg = PG()
+    await pg.init(**(await DataBaseData.get_from_url(str(DEFAULT_PG_URL.url))).__dict__)
+
+    shop_units = make_items(args.items, args.categories)
+    date = str_to_datetime('2022-02-01T12:00:00.000Z')
+
+    print(f'{"mode":<8}{"median, s":>12}{"rows/s":>14}')
+    for mode in IMPORT_MODES:
+        timings = []
+        for _ in range(args.repeats):
+            async with pg.pool.acquire() as conn:
+                transaction = conn.transaction()
+                await transaction.start()
+                try:
+                    started = perf_counter()
+                    await ingest(conn, mode, shop_units, date)
+                    timings.append(perf_counter() - started)
+                finally:
+                    await transaction.rollback()
+
+        elapsed = median(timings)
+        print(f'{mode:<8}{elapsed:>12.3f}{len(shop_units) / elapsed:>14.0f}')
+
+    await pg.pool.close()
+
+
+def main():
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
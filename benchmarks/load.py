@@ -0,0 +1,249 @@
+"""
+Нагрузочный тест: сгенерированный каталог загружается через /imports, затем
+несколько клиентов параллельно выполняют смесь запросов /imports (изменение цен),
+/nodes/{id}, /sales, /node/{id}/statistic и /delete/{id}.
+
+Если --api-url не задан, приложение запускается отдельным процессом
+(python -m market.api) с бд из .env / MARKET_PG_URL. Данные пишутся в бд,
+поэтому запускать стоит на отдельной базе; в конце каталог удаляется.
+
+Отчет (json) содержит пропускную способность, p50/p95/p99 времени ответа и
+кол-во запросов к бд на запрос (по GET /metrics сервера) для каждой операции.
+
+python -m benchmarks.load --shape balanced --offers 100000 --duration 60 --output report.json
+python -m benchmarks.report base.json report.json
+"""
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from benchmarks.catalog import CatalogGenerator, SHAPES
+from benchmarks.report import summarize
+from market.api.utils import datetime_to_str
+from market.utils.argparse import positive_int
+
+# операция: обработчик сервера в GET /metrics (метод и шаблон пути)
+ROUTES = {
+    'imports': 'POST /imports',
+    'nodes': 'GET /nodes/{shop_unit_id}',
+    'sales': 'GET /sales',
+    'statistic': 'GET /node/{shop_unit_id}/statistic',
+    'delete': 'DELETE /delete/{shop_unit_id}',
+}
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('--api-url', default=None, help='Running API to test; by default one is started locally')
+parser.add_argument('--api-port', type=positive_int, default=8081, help='Port for the locally started API')
+parser.add_argument('--shape', choices=SHAPES, default='balanced', help='Shape of the category tree')
+parser.add_argument('--depth', type=positive_int, default=None, help='Category tree depth (overrides --shape)')
+parser.add_argument('--fanout', type=positive_int, default=None, help='Child categories per category (overrides --shape)')
+parser.add_argument('--offers', type=positive_int, default=100000, help='Offers in the catalog')
+parser.add_argument('--batch-size', type=positive_int, default=1000, help='Items per catalog import')
+parser.add_argument('--churn-items', type=positive_int, default=100, help='Offers changed by one churn import')
+parser.add_argument(
+    '--mix', default='nodes=50,statistic=20,sales=10,imports=15,delete=5',
+    help='Operation weights of the mixed workload'
+)
+parser.add_argument('--concurrency', type=positive_int, default=16, help='Concurrent clients')
+parser.add_argument('--duration', type=positive_int, default=60, help='Mixed workload duration, seconds')
+parser.add_argument('--requests', type=positive_int, default=None, help='Stop after this many requests')
+parser.add_argument('--seed', type=int, default=None, help='Random seed')
+parser.add_argument('--no-cleanup', action='store_true', help='Keep the generated catalog in the database')
+parser.add_argument('--output', default=None, help='Report file (stdout by default)')
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for part in mix.split(','):
+        operation, _, weight = part.partition('=')
+        if operation.strip() not in ROUTES:
+            raise ValueError(f'Unknown operation {operation!r}, expected one of {", ".join(ROUTES)}')
+        weights[operation.strip()] = int(weight)
+    return weights
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadTest:
+
+    def __init__(self, session: ClientSession, api_url: str, generator: CatalogGenerator, args):
+        self.session = session
+        self.api_url = api_url.rstrip('/')
+        self.generator = generator
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, operation: str, method: str, path: str, body: dict | None = None) -> int:
+        """
+        :return: http статус ответа (0, если соединение не удалось)
+        """
+
+        start = perf_counter()
+        try:
+            async with self.session.request(method, self.api_url + path, json=body) as response:
+                await response.read()
+                status = response.status
+        except (ClientError, asyncio.TimeoutError):
+            status = 0
+
+        self.latencies[operation].append(perf_counter() - start)
+        if not 200 <= status < 300:
+            self.errors[operation] += 1
+        return status
+
+    async def metrics(self) -> dict:
+        async with self.session.get(self.api_url + '/metrics') as response:
+            return (await response.json())['requests']
+
+    async def seed(self) -> dict:
+        start = perf_counter()
+        for body in self.generator.iter_catalog():
+            await self.request('seed', 'POST', '/imports', body)
+        elapsed = perf_counter() - start
+
+        items = len(self.generator.categories) + len(self.generator.offers)
+        return {**summarize(self.latencies.pop('seed'), self.errors.pop('seed', 0), elapsed, None),
+                'items': items, 'itemsPerSecond': round(items / elapsed, 3)}
+
+    async def operation(self, operation: str) -> None:
+        generator = self.generator
+
+        if operation == 'imports':
+            await self.request(operation, 'POST', '/imports', generator.churn(self.args.churn_items))
+        elif operation == 'nodes':
+            await self.request(operation, 'GET', f'/nodes/{generator.random_unit()}')
+        elif operation == 'sales':
+            await self.request(operation, 'GET', f'/sales?date={datetime_to_str(generator.date)}')
+        elif operation == 'statistic':
+            await self.request(
+                operation, 'GET',
+                f'/node/{generator.random_unit()}/statistic'
+                f'?dateStart={datetime_to_str(generator.first_date)}&dateEnd={datetime_to_str(generator.date)}'
+            )
+        elif operation == 'delete':
+            offer_id = generator.random_offer()
+            if offer_id is None:
+                return
+            generator.remove_offer(offer_id)
+            await self.request(operation, 'DELETE', f'/delete/{offer_id}')
+
+    async def client(self, weights: dict[str, int], deadline: float, budget: list[int]) -> None:
+        operations, weights = list(weights), list(weights.values())
+        while perf_counter() < deadline and budget[0] != 0:
+            budget[0] -= 1
+            await self.operation(self.random.choices(operations, weights)[0])
+
+    async def mixed(self, weights: dict[str, int]) -> dict:
+        before = await self.metrics()
+
+        start = perf_counter()
+        budget = [self.args.requests or -1]
+        await asyncio.gather(*(
+            self.client(weights, start + self.args.duration, budget) for _ in range(self.args.concurrency)
+        ))
+        elapsed = perf_counter() - start
+
+        after = await self.metrics()
+
+        report = {}
+        for operation in weights:
+            route = ROUTES[operation]
+            count = after.get(route, {}).get('count', 0) - before.get(route, {}).get('count', 0)
+            queries = after.get(route, {}).get('queries', 0) - before.get(route, {}).get('queries', 0)
+            report[operation] = summarize(
+                self.latencies[operation], self.errors[operation], elapsed,
+                round(queries / count, 3) if count else None
+            )
+
+        all_latencies = [latency for operation in weights for latency in self.latencies[operation]]
+        report['total'] = summarize(all_latencies, sum(self.errors.values()), elapsed, None)
+        return report
+
+    async def cleanup(self) -> dict:
+        await self.request('cleanup', 'DELETE', f'/delete/{self.generator.categories[0]}')
+        return summarize(self.latencies.pop('cleanup'), self.errors.pop('cleanup', 0), 0, None)
+
+
+async def wait_for_api(session: ClientSession, api_url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'API exited with code {process.returncode}')
+        try:
+            async with session.get(api_url + '/metrics') as response:
+                if response.status == 200:
+                    return
+        except ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f'API did not start in {timeout} seconds')
+
+
+async def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    shape = {key: value for key, value in (('depth', args.depth), ('fanout', args.fanout)) if value}
+    generator = CatalogGenerator.from_shape(args.shape, args.offers, batch_size=args.batch_size, seed=args.seed, **shape)
+
+    process = None
+    api_url = args.api_url
+    if api_url is None:
+        api_url = f'http://127.0.0.1:{args.api_port}'
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'market.api', '--api-address', '127.0.0.1', '--api-port', str(args.api_port)],
+            env={**os.environ, 'MARKET_LOG_LEVEL': 'warning'},
+        )
+
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=None)) as session:
+            if process is not None:
+                await wait_for_api(session, api_url, process)
+
+            load_test = LoadTest(session, api_url, generator, args)
+            report = {
+                'meta': {
+                    'commit': git_commit(),
+                    'startedAt': datetime.utcnow().isoformat(),
+                    'args': vars(args),
+                },
+                'seed': await load_test.seed(),
+                'operations': await load_test.mixed(weights),
+            }
+            report['meta']['categories'] = len(generator.categories)
+            if not args.no_cleanup:
+                report['cleanup'] = await load_test.cleanup()
+            return report
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Отчет нагрузочного теста (benchmarks.load) и сравнение двух отчетов.
+
+python -m benchmarks.report base.json new.json
+"""
+import json
+from math import ceil
+
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+PERCENTILES = (50, 95, 99)
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('base', help='Report of the baseline run')
+parser.add_argument('new', help='Report of the run to compare')
+
+
+def percentile(values: list[float], percent: float) -> float | None:
+    """
+    :param values: отсортированные значения
+    :param percent: перцентиль (0-100)
+    :return: значение перцентиля (nearest-rank), либо None, если значений нет
+    """
+
+    if not values:
+        return None
+    return values[max(0, ceil(len(values) * percent / 100) - 1)]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float, queries_per_request: float | None) -> dict:
+    """
+    :param latencies: время ответа каждого запроса, в секундах
+    :param errors: кол-во ответов с ошибкой
+    :param elapsed: длительность прогона, в секундах
+    :param queries_per_request: среднее кол-во запросов к бд на запрос (по /metrics сервера)
+    :return: сводка по операции
+    """
+
+    latencies = sorted(latencies)
+    latency_ms = {f'p{percent}': percentile(latencies, percent) for percent in PERCENTILES}
+    latency_ms['max'] = latencies[-1] if latencies else None
+    latency_ms['mean'] = sum(latencies) / len(latencies) if latencies else None
+
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'latencyMs': {key: value and round(value * 1000, 3) for key, value in latency_ms.items()},
+        'queriesPerRequest': queries_per_request,
+    }
+
+
+def change(base: float | None, new: float | None) -> str:
+    if not base or new is None:
+        return ''
+    return f'{(new - base) / base * 100:+.1f}%'
+
+
+def compare(base: dict, new: dict) -> None:
+    print(f'{base["meta"].get("commit")} -> {new["meta"].get("commit")}')
+    print(f'{"operation":<12}{"metric":<20}{"base":>12}{"new":>12}{"change":>10}')
+
+    for operation in sorted(set(base['operations']) | set(new['operations'])):
+        base_stats, new_stats = base['operations'].get(operation, {}), new['operations'].get(operation, {})
+        metrics = [('throughput', base_stats.get('throughput'), new_stats.get('throughput'))]
+        metrics.extend(
+            (f'latency {key}, ms', base_stats.get('latencyMs', {}).get(key), new_stats.get('latencyMs', {}).get(key))
+            for key in (*(f'p{percent}' for percent in PERCENTILES), 'max')
+        )
+        metrics.append(('queries/request', base_stats.get('queriesPerRequest'), new_stats.get('queriesPerRequest')))
+        metrics.append(('errors', base_stats.get('errors'), new_stats.get('errors')))
+
+        for name, base_value, new_value in metrics:
+            print(f'{operation:<12}{name:<20}{str(base_value):>12}{str(new_value):>12}{change(base_value, new_value):>10}')
+
+
+def main():
+    args = parser.parse_args()
+    with open(args.base) as base, open(args.new) as new:
+        compare(json.load(base), json.load(new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Сравнение ответа /node/{id}/statistic за год плотной истории без прореживания
+и с ?bucket=hour|day|week: время запроса и сериализации, кол-во записей и размер JSON.
+
+История одного элемента (--points-per-day записей в день) пишется во временную
+таблицу history, которая на время транзакции перекрывает настоящую (pg_temp первой
+в search_path), запросы - те же, что у обработчика. Транзакция откатывается,
+так что бд не меняется.
+
+python -m benchmarks.statistic --days 365 --points-per-day 1440 --repeats 5
+"""
+import asyncio
+from datetime import timedelta
+from statistics import median
+from time import perf_counter
+
+from asyncpgsa import PG
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from market.api.payloads import dumps_bytes
+from market.api.utils import (
+    HISTORY_BUCKETS, history_bucket_to_answer, history_to_answer, STATEMENTS, str_to_datetime
+)
+from market.utils.argparse import positive_int
+from market.utils.pg import DataBaseData, DEFAULT_PG_URL
+
+START_DATE = '2022-02-01T00:00:00.000Z'
+SHOP_UNIT_ID = 'statistic benchmark'
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('--days', type=positive_int, default=365, help='Days of history')
+parser.add_argument('--points-per-day', type=positive_int, default=1440, help='History rows per day')
+parser.add_argument('--repeats', type=positive_int, default=5, help='Runs per mode')
+
+
+async def fill_history(conn, days: int, points_per_day: int) -> int:
+    """
+    :return: кол-во записанных строк истории (равномерно по дням, цена меняется по синусоиде)
+    """
+
+    await conn.execute('''
+    CREATE TEMPORARY TABLE history (
+        shop_unit_id varchar NOT NULL,
+        update_date timestamp NOT NULL,
+        price integer NOT NULL,
+        UNIQUE (shop_unit_id, update_date)
+    )''')
+    await conn.execute('''
+    INSERT INTO history (shop_unit_id, update_date, price)
+    SELECT $1, $2::timestamp + point * (interval '1 day' / $3::integer),
+        50000 + (10000 * sin(point / 100.0))::integer
+    FROM generate_series(0, $3::integer * $4::integer - 1) AS point''',
+        SHOP_UNIT_ID, str_to_datetime(START_DATE), points_per_day, days
+    )
+    await conn.execute('ANALYZE history')
+    return points_per_day * days
+
+
+async def fetch_stats(conn, bucket: str | None, date_start, date_end) -> bytes:
+    """
+    :return: сериализованный список stats (как в ответе обработчика)
+    """
+
+    if bucket is None:
+        records = await conn.fetch(STATEMENTS['get_history'].sql, SHOP_UNIT_ID, date_start, date_end)
+        return dumps_bytes([history_to_answer(record) for record in records])
+
+    records = await conn.fetch(STATEMENTS['get_history_buckets'].sql, SHOP_UNIT_ID, date_start, date_end, bucket)
+    return dumps_bytes([history_bucket_to_answer(record) for record in records])
+
+
+async def run(args) -> None:
+    pg = PG()
+    await pg.init(**(await DataBaseData.get_from_url(str(DEFAULT_PG_URL.url))).__dict__)
+
+    date_start = str_to_datetime(START_DATE)
+    date_end = date_start + timedelta(days=args.days)
+
+    async with pg.pool.acquire() as conn:
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            rows = await fill_history(conn, args.days, args.points_per_day)
+            print(f'history rows: {rows}')
+            print(f'{"bucket":<8}{"median, ms":>12}{"points":>10}{"json, KB":>12}')
+
+            for bucket in (None, *HISTORY_BUCKETS):
+                timings = []
+                for _ in range(args.repeats):
+                    started = perf_counter()
+                    body = await fetch_stats(conn, bucket, date_start, date_end)
+                    timings.append(perf_counter() - started)
+
+                points = body.count(b'"update_date"')
+                print(f'{bucket or "raw":<8}{median(timings) * 1000:>12.1f}{points:>10}{len(body) / 1024:>12.1f}')
+        finally:
+            await transaction.rollback()
+
+    await pg.pool.close()
+
+
+def main():
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
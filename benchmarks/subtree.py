@@ -0,0 +1,112 @@
+"""
+Сравнение запросов поддерева /nodes/{id} на длинной цепочке, широком и сбалансированном
+деревьях: get_subtree_rows (без сортировки, порядок обхода восстанавливает order_subtree)
+и get_subtree_stream (сортировка по пути от корня в postgres, им читает потоковая отдача).
+
+Деревья пишутся во временную таблицу shop_units, которая на время транзакции перекрывает
+настоящую (pg_temp первой в search_path), запросы - те же, что у обработчика. Транзакция
+откатывается, так что бд не меняется. Время - до получения последней строки, для get_subtree_rows -
+вместе с order_subtree.
+
+python -m benchmarks.subtree --nodes 100000 --depth 10000 --repeats 5
+"""
+import asyncio
+from statistics import median
+from time import perf_counter
+
+from asyncpgsa import PG
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from benchmarks.tree import balanced, deep, wide
+from market.api.utils import order_subtree, STATEMENTS, str_to_datetime
+from market.utils.argparse import positive_int
+from market.utils.pg import DataBaseData, DEFAULT_PG_URL
+
+DATE = '2022-02-01T00:00:00.000Z'
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('--nodes', type=positive_int, default=100000, help='Nodes in the wide and balanced trees')
+parser.add_argument('--depth', type=positive_int, default=10000, help='Length of the deep chain')
+parser.add_argument('--fanout', type=positive_int, default=10, help='Children per node in the balanced tree')
+parser.add_argument('--repeats', type=positive_int, default=5, help='Runs per query')
+
+
+async def fill_tree(conn, parents: list[int | None]) -> None:
+    """
+    Пишет дерево (элемент с индексом 0 - корень) во временную таблицу shop_units
+    """
+
+    await conn.execute('''
+    CREATE TEMPORARY TABLE IF NOT EXISTS shop_units (
+        shop_unit_id varchar PRIMARY KEY,
+        name varchar NOT NULL,
+        date timestamp NOT NULL,
+        parent_id varchar,
+        type varchar NOT NULL,
+        price integer,
+        sum_price bigint NOT NULL DEFAULT 0,
+        offer_count integer NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS shop_units_parent_id ON shop_units (parent_id);
+    TRUNCATE shop_units''')
+    await conn.execute('''
+    INSERT INTO shop_units (shop_unit_id, name, date, parent_id, type)
+    SELECT shop_unit_id, shop_unit_id, $1, parent_id, 'category'
+    FROM unnest($2::text[], $3::text[]) AS t(shop_unit_id, parent_id)''',
+        str_to_datetime(DATE), [str(index) for index in range(len(parents))],
+        [None if parent is None else str(parent) for parent in parents]
+    )
+    await conn.execute('ANALYZE shop_units')
+
+
+async def time_query(conn, repeats: int, sql: str, ordered: bool) -> float:
+    """
+    :param ordered: строки приходят уже в порядке обхода (иначе порядок восстанавливает order_subtree)
+    :return: медиана времени, с
+    """
+
+    timings = []
+    for _ in range(repeats):
+        started = perf_counter()
+        records = await conn.fetch(sql, '0')
+        if not ordered:
+            order_subtree('0', records)
+        timings.append(perf_counter() - started)
+    return median(timings)
+
+
+async def run(args) -> None:
+    pg = PG()
+    await pg.init(**(await DataBaseData.get_from_url(str(DEFAULT_PG_URL.url))).__dict__)
+
+    cases = [
+        (f'wide {args.nodes}', wide(args.nodes)),
+        (f'balanced {args.nodes} x{args.fanout}', balanced(args.nodes, args.fanout)),
+        (f'deep {args.depth}', deep(args.depth)),
+    ]
+    queries = [
+        ('get_subtree_rows', STATEMENTS['get_subtree_rows'].sql, False),
+        ('get_subtree_stream', STATEMENTS['get_subtree_stream'].sql, True),
+    ]
+
+    async with pg.pool.acquire() as conn:
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            print(f'{"tree":<28}' + ''.join(f'{name + ", ms":>24}' for name, _, _ in queries))
+            for name, parents in cases:
+                await fill_tree(conn, parents)
+                timings = [await time_query(conn, args.repeats, sql, ordered) for _, sql, ordered in queries]
+                print(f'{name:<28}' + ''.join(f'{timing * 1000:>24.1f}' for timing in timings))
+        finally:
+            await transaction.rollback()
+
+    await pg.pool.close()
+
+
+def main():
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Сравнение построения дерева ответа /nodes: прежний рекурсивный build_tree_json
+(поиск дочерних перебором таблицы связей), линейный build_tree (с сериализацией)
+и dumps_tree, который пишет JSON сразу из строк в порядке обхода (как их упорядочивает order_subtree).
+
+python -m benchmarks.tree --nodes 100000 --depth 10000
+"""
+import asyncio
+import sys
+from time import perf_counter
+
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from market.api.payloads import dumps_bytes, dumps_tree
+from market.api.utils import build_tree
+from market.utils.argparse import positive_int
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument('--nodes', type=positive_int, default=100000, help='Nodes in the wide and balanced trees')
+parser.add_argument('--depth', type=positive_int, default=10000, help='Length of the deep chain')
+parser.add_argument('--fanout', type=positive_int, default=10, help='Children per node in the balanced tree')
+parser.add_argument(
+    '--legacy-limit', type=positive_int, default=20000,
+    help='Skip the quadratic builder on trees larger than this'
+)
+
+
+async def build_tree_json(ans: dict, data: list[dict], records: dict[str, dict]) -> None:
+    """
+    Прежняя реализация (до build_tree), оставлена только для сравнения
+    """
+
+    while data:
+        any_children_in_data = True
+
+        for index, record in enumerate(data):
+            parent_id, children_id = record.get('relation_id'), record.get('children_id')
+            if parent_id != ans['shop_unit_id']:
+                continue
+
+            any_children_in_data = False
+            data.pop(index)
+
+            if ans.get('children') is None:
+                ans['children'] = []
+            ans['children'].append(records[children_id])
+
+            await build_tree_json(ans['children'][-1], data, records)
+
+        if any_children_in_data:
+            break
+
+
+def make_records(parents: list[int | None]) -> dict[str, dict]:
+    return {
+        str(index): {'shop_unit_id': str(index), 'parentId': None if parent is None else str(parent)}
+        for index, parent in enumerate(parents)
+    }
+
+
+def wide(nodes: int) -> list[int | None]:
+    return [None] + [0] * (nodes - 1)
+
+
+def balanced(nodes: int, fanout: int) -> list[int | None]:
+    return [None] + [(index - 1) // fanout for index in range(1, nodes)]
+
+
+def deep(nodes: int) -> list[int | None]:
+    return [None] + list(range(nodes - 1))
+
+
+def make_rows(parents: list[int | None]) -> list[tuple[int, dict]]:
+    """
+    :return: строки (глубина, элемент) в порядке обхода в глубину
+    """
+
+    children = [[] for _ in parents]
+    for index, parent in enumerate(parents):
+        if parent is not None:
+            children[parent].append(index)
+
+    rows, stack = [], [(0, 0)]
+    while stack:
+        index, depth = stack.pop()
+        parent = parents[index]
+        rows.append((depth, {'shop_unit_id': str(index), 'parentId': None if parent is None else str(parent)}))
+        stack.extend((child, depth + 1) for child in reversed(children[index]))
+    return rows
+
+
+def run_new(parents: list[int | None]) -> float | str:
+    records = make_records(parents)
+    start = perf_counter()
+    try:
+        dumps_bytes(build_tree('0', records))
+    except RecursionError:
+        # сериализация вложенного словаря рекурсивна
+        return f'RecursionError (limit {sys.getrecursionlimit()})'
+    return perf_counter() - start
+
+
+def run_rows(parents: list[int | None]) -> float:
+    rows = make_rows(parents)
+    start = perf_counter()
+    dumps_tree(rows)
+    return perf_counter() - start
+
+
+def run_legacy(parents: list[int | None]) -> float | str:
+    records = make_records(parents)
+    relations = [
+        {'relation_id': record['parentId'], 'children_id': shop_unit_id}
+        for shop_unit_id, record in records.items() if record['parentId'] is not None
+    ]
+    start = perf_counter()
+    try:
+        asyncio.run(build_tree_json(records['0'], relations, records))
+    except RecursionError:
+        return f'RecursionError (limit {sys.getrecursionlimit()})'
+    return perf_counter() - start
+
+
+def main():
+    args = parser.parse_args()
+
+    cases = [
+        (f'wide {args.nodes}', wide(args.nodes)),
+        (f'balanced {args.nodes} x{args.fanout}', balanced(args.nodes, args.fanout)),
+        (f'deep {args.depth}', deep(args.depth)),
+    ]
+    # рост прежней реализации на тех же формах меньшего размера
+    cases.extend(
+        (f'wide {nodes}', wide(nodes)) for nodes in (1000, 5000, args.legacy_limit) if nodes < args.nodes
+    )
+
+    print(f'{"tree":<28}{"dumps_tree, s":>16}{"build_tree + dumps, s":>32}{"build_tree_json, s":>40}')
+    for name, parents in cases:
+        rows = run_rows(parents)
+        new = run_new(parents)
+        new = f'{new:.3f}' if isinstance(new, float) else new
+        legacy = run_legacy(parents) if len(parents) <= args.legacy_limit else 'skipped (quadratic)'
+        legacy = f'{legacy:.3f}' if isinstance(legacy, float) else legacy
+        print(f'{name:<28}{rows:>16.3f}{new:>32}{legacy:>40}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,12 @@ import os
 import os.path
 from sys import argv, path
 
-from market.api.app import create_app, MAX_REQUEST_SIZE
-from market.utils.argparse import clear_environ, positive_int
+from market.api.app import create_app
+from market.api.importer import IMPORT_MODES
+from market.api.utils import HISTORY_MODES
+from market.utils.argparse import (
+    clear_environ, import_object, non_negative_float, non_negative_int, positive_float, positive_int
+)
 from market.utils.pg import DEFAULT_PG_URL
 
 from aiohttp.web import run_app
@@ -43,13 +47,81 @@ parser.add_argument(
 )
 
 parser.add_argument(
-    '--pg-pool-min-size', type=int, default=0,
-    help='Password to use to connect to the database'
+    '--pg-pool-min-size', type=non_negative_int, default=0,
+    help='Minimum number of connections in the pool (not more than --pg-pool-max-size)'
 )
 
 parser.add_argument(
-    '--pg-pool-max-size', type=int, default=MAX_REQUEST_SIZE,
-    help='Password to use to connect to the database'
+    '--pg-pool-max-size', type=positive_int, default=10,
+    help='Maximum number of connections in the pool (keep workers * this below Postgres max_connections)'
+)
+
+parser.add_argument(
+    '--pg-pool-acquire-timeout', type=positive_float, default=10,
+    help='Seconds a request may wait for a free pool connection before failing'
+)
+
+parser.add_argument(
+    '--pg-statement-cache-size', type=non_negative_int, default=100,
+    help='Prepared statements cached per connection (0 disables, e.g. behind pgbouncer)'
+)
+
+parser.add_argument(
+    '--pg-max-inactive-connection-lifetime', type=non_negative_float, default=300,
+    help='Seconds after which idle pool connections are closed (0 keeps them forever)'
+)
+
+parser.add_argument(
+    '--pg-init-hook', type=import_object, default=None,
+    help='Coroutine function "module:name" called with every new pool connection'
+)
+
+# imports group
+parser.add_argument(
+    '--import-mode', default='values', choices=IMPORT_MODES,
+    help='How /imports writes rows: multi-VALUES inserts or binary COPY into a staging table'
+)
+parser.add_argument(
+    '--import-workers', type=non_negative_int, default=1,
+    help='Background workers running POST /imports?async=1 jobs (max concurrent async imports), 0 disables them'
+)
+parser.add_argument(
+    '--import-queue-size', type=positive_int, default=16,
+    help='Max async import jobs waiting in the queue'
+)
+parser.add_argument(
+    '--history-mode', default='snapshot', choices=HISTORY_MODES,
+    help='How imports write price history: for every unit of the branch (snapshot) or only for offers, '
+         'rebuilding category statistics on read (lazy)'
+)
+
+# cache group
+parser.add_argument(
+    '--nodes-cache-size', type=non_negative_int, default=64,
+    help='Memory budget of the GET /nodes/{id} response cache, MB (0 disables it)'
+)
+parser.add_argument(
+    '--history-cache-size', type=non_negative_int, default=1000000,
+    help='Budget of the rebuilt category statistics cache (--history-mode lazy), history points (0 disables it)'
+)
+parser.add_argument(
+    '--nodes-stream-threshold', type=non_negative_int, default=10000,
+    help='Stream GET /nodes/{id} responses for subtrees with at least this many nodes '
+         'instead of building them in memory (0 disables streaming)'
+)
+
+# compression group
+parser.add_argument(
+    '--compression-min-size', type=non_negative_int, default=1024,
+    help='Compress response bodies of at least this many bytes (gzip, deflate, br if installed), 0 disables it'
+)
+parser.add_argument(
+    '--compression-offload-size', type=non_negative_int, default=64 * 1024,
+    help='Compress bodies of at least this many bytes in a thread pool instead of the event loop'
+)
+parser.add_argument(
+    '--compression-workers', type=positive_int, default=2,
+    help='Threads compressing large response bodies'
 )
 
 # logging group
@@ -65,6 +137,8 @@ parser.add_argument(
 
 def main():
     args = parser.parse_args()
+    if args.pg_pool_min_size > args.pg_pool_max_size:
+        parser.error('--pg-pool-min-size must not exceed --pg-pool-max-size')
 
     clear_environ(lambda arg: arg.startswith(ENV_VAR_PREFIX))
     basic_config(args.log_level, args.log_format, buffered=True)
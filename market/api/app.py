@@ -8,13 +8,16 @@ from aiohttp.web_app import Application
 from aiohttp_apispec import setup_aiohttp_apispec
 from configargparse import Namespace
 
+from market.api.cache import HistoryCache, NodesCache
 from market.api.handlers import HANDLERS
+from market.api.jobs import setup_import_jobs
+from market.api.compression import setup_compression
+from market.api.middlewares import compression_middleware, metrics_middleware
+from market.api.parsers import MAX_REQUEST_SIZE, MEGABYTE
 from market.api.payloads import AsyncGenJSONListPayload, JsonPayload
+from market.utils.metrics import RequestMetrics
 from market.utils.pg import setup_pg
 
-MEGABYTE = 1024 ** 2
-MAX_REQUEST_SIZE = 70 * MEGABYTE
-
 log = logging.getLogger(__name__)
 
 
@@ -22,11 +25,22 @@ def create_app(args: Namespace) -> Application:
     """
     Создает экземпляр приложения, готового к запуску.
     """
-    app = Application(client_max_size=MAX_REQUEST_SIZE)
+    # метрики снаружи: время ответа включает сжатие
+    app = Application(client_max_size=MAX_REQUEST_SIZE, middlewares=[metrics_middleware, compression_middleware])
+    app['args'] = args
+    app['request_metrics'] = RequestMetrics()
+    app['nodes_cache'] = NodesCache(args.nodes_cache_size * MEGABYTE)
+    app['history_cache'] = HistoryCache(args.history_cache_size)
 
     # Подключение на старте к postgres и отключение при остановке
     app.cleanup_ctx.append(partial(setup_pg, args=args))
 
+    # Запуск обработчиков фоновых задач импорта (после подключения к postgres)
+    app.cleanup_ctx.append(partial(setup_import_jobs, args=args))
+
+    # Пул потоков для сжатия больших ответов
+    app.cleanup_ctx.append(partial(setup_compression, args=args))
+
     # Регистрация обработчиков
     for handler in HANDLERS:
         log.debug('Registering handler %r as %r', handler, handler.URL_PATH)
@@ -0,0 +1,203 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, NamedTuple
+
+# примерные накладные расходы на запись (ключ, узел OrderedDict, объект bytes)
+ENTRY_OVERHEAD = 200
+
+
+class CachedNode(NamedTuple):
+    """
+    Сериализованный ответ и его валидаторы (ETag, Last-Modified)
+    """
+
+    body: bytes
+    etag: str
+    last_modified: datetime
+
+
+class NodesCache:
+    """
+    LRU кэш сериализованных ответов /nodes/{id} с ограничением по памяти.
+
+    Импорт и удаление сбрасывают записи ровно тех элементов, ответ которых
+    мог измениться: сами элементы и их ветки (старые и новые родители).
+    Ответ, прочитанный из бд во время сброса, в кэш не кладется (см. epoch),
+    иначе в кэш могло бы попасть состояние до коммита импорта.
+    Кэш свой у каждого процесса приложения.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: бюджет памяти кэша (0 - кэш выключен)
+        """
+
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.epoch = 0
+        self._entries: OrderedDict[str, CachedNode] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def entry_size(shop_unit_id: str, entry: CachedNode) -> int:
+        return len(shop_unit_id) + len(entry.body) + len(entry.etag) + ENTRY_OVERHEAD
+
+    def get(self, shop_unit_id: str) -> CachedNode | None:
+        """
+        :param shop_unit_id: id элемента
+        :return: сериализованный ответ, либо None, если его нет в кэше
+        """
+
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(shop_unit_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(shop_unit_id)
+        return entry
+
+    def put(self, shop_unit_id: str, entry: CachedNode, epoch: int) -> None:
+        """
+        :param shop_unit_id: id элемента
+        :param entry: сериализованный ответ (валидаторы прочитаны из бд раньше дерева)
+        :param epoch: значение self.epoch до чтения ответа из бд
+        :return: None
+        """
+
+        size = self.entry_size(shop_unit_id, entry)
+        if not self.enabled or epoch != self.epoch or size > self.max_bytes:
+            return
+
+        self._pop(shop_unit_id)
+        self._entries[shop_unit_id] = entry
+        self.bytes += size
+
+        while self.bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, ides: Iterable[str]) -> None:
+        """
+        :param ides: id элементов, ответы которых изменились
+        :return: None
+        """
+
+        self.epoch += 1
+        for shop_unit_id in ides:
+            self.invalidations += self._pop(shop_unit_id)
+
+    def _pop(self, shop_unit_id: str) -> bool:
+        entry = self._entries.pop(shop_unit_id, None)
+        if entry is None:
+            return False
+        self.bytes -= self.entry_size(shop_unit_id, entry)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'maxBytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+class HistoryCache:
+    """
+    LRU кэш восстановленной истории категорий (--history-mode lazy) с ограничением
+    по кол-ву точек. Ключ - (id, версия, начало, конец периода): любое изменение
+    поддерева выдает категории новую версию, поэтому записи не сбрасываются,
+    а устаревшие вытесняются сами. Кэш свой у каждого процесса приложения.
+    """
+
+    def __init__(self, max_points: int):
+        """
+        :param max_points: бюджет кэша, точек истории (0 - кэш выключен)
+        """
+
+        self.max_points = max_points
+        self.points = 0
+        self._entries: OrderedDict[tuple, list] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_points > 0
+
+    @staticmethod
+    def entry_size(points: list) -> int:
+        # пустая история тоже занимает место
+        return max(len(points), 1)
+
+    def get(self, key: tuple) -> list | None:
+        """
+        :param key: (id, версия, начало, конец периода)
+        :return: точки истории, либо None, если их нет в кэше
+        """
+
+        if not self.enabled:
+            return None
+
+        points = self._entries.get(key)
+        if points is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return points
+
+    def put(self, key: tuple, points: list) -> None:
+        """
+        :param key: (id, версия, начало, конец периода)
+        :param points: точки истории
+        :return: None
+        """
+
+        size = self.entry_size(points)
+        if not self.enabled or size > self.max_points:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.points -= self.entry_size(old)
+        self._entries[key] = points
+        self.points += size
+
+        while self.points > self.max_points:
+            _, evicted = self._entries.popitem(last=False)
+            self.points -= self.entry_size(evicted)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'points': self.points,
+            'maxPoints': self.max_points,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+__all__ = (
+    'CachedNode', 'HistoryCache', 'NodesCache',
+)
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from time import thread_time
+from typing import Callable
+
+from aiohttp.web_app import Application
+from configargparse import Namespace
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен (pip install market[brotli])
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+# уровни сжатия: заметно быстрее максимальных при почти том же размере
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def gzip_compress(body: bytes) -> bytes:
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def deflate_compress(body: bytes) -> bytes:
+    return zlib.compress(body, GZIP_LEVEL)
+
+
+def brotli_compress(body: bytes) -> bytes:
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+# кодировки в порядке предпочтения (при одинаковом q у клиента)
+COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    **({'br': brotli_compress} if brotli is not None else {}),
+    'gzip': gzip_compress,
+    'deflate': deflate_compress,
+}
+
+# кодировки, которыми aiohttp умеет сжимать потоковые ответы по частям
+STREAM_CODINGS = ('gzip', 'deflate')
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    """
+    :param header: значение заголовка Accept-Encoding
+    :return: словарь кодировка: q (вес)
+    """
+
+    weights = {}
+    for part in header.split(','):
+        coding, *params = part.strip().split(';')
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            weights[coding.strip().lower()] = q
+    return weights
+
+
+def choose_encoding(header: str | None, codings=COMPRESSORS) -> str | None:
+    """
+    :param header: значение заголовка Accept-Encoding
+    :param codings: поддерживаемые кодировки в порядке предпочтения
+    :return: кодировка с наибольшим q из поддерживаемых, None - не сжимать
+    """
+
+    if not header:
+        return None
+
+    weights = parse_accept_encoding(header)
+    default = weights.get('*', 0.0)
+
+    best, best_q = None, 0.0
+    for coding in codings:
+        q = weights.get(coding, default)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class Compressor:
+    """
+    Сжатие ответов (см. compression_middleware) и его метрики.
+
+    Тела больше offload_size сжимаются в пуле потоков (zlib и brotli отпускают GIL),
+    чтобы не блокировать event loop, тела меньше - прямо в нем (поток дороже сжатия)
+    """
+
+    def __init__(self, min_size: int, offload_size: int, workers: int):
+        """
+        :param min_size: минимальный размер сжимаемого тела, байт (0 - сжатие выключено)
+        :param offload_size: размер тела, начиная с которого сжатие идет в пуле потоков
+        :param workers: кол-во потоков пула
+        """
+
+        self.min_size = min_size
+        self.offload_size = offload_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compression')
+
+        self.responses: dict[str, int] = {coding: 0 for coding in COMPRESSORS}
+        self.offloaded = 0
+        # потоковые ответы (сжимает aiohttp, размеры неизвестны)
+        self.streamed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_size > 0
+
+    @staticmethod
+    def compress_timed(coding: str, body: bytes) -> tuple[bytes, float]:
+        start = thread_time()
+        compressed = COMPRESSORS[coding](body)
+        return compressed, thread_time() - start
+
+    async def compress(self, coding: str, body: bytes) -> bytes:
+        """
+        :param coding: кодировка (ключ COMPRESSORS)
+        :param body: тело ответа
+        :return: сжатое тело
+        """
+
+        if len(body) >= self.offload_size:
+            self.offloaded += 1
+            loop = asyncio.get_running_loop()
+            compressed, cpu_time = await loop.run_in_executor(self.executor, self.compress_timed, coding, body)
+        else:
+            compressed, cpu_time = self.compress_timed(coding, body)
+
+        self.responses[coding] += 1
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        self.cpu_time += cpu_time
+        return compressed
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            'responses': self.responses,
+            'offloaded': self.offloaded,
+            'streamed': self.streamed,
+            'bytesIn': self.bytes_in,
+            'bytesOut': self.bytes_out,
+            'bytesSaved': self.bytes_in - self.bytes_out,
+            'cpuMs': round(self.cpu_time * 1000, 3),
+        }
+
+
+async def setup_compression(app: Application, args: Namespace):
+    """
+    Создание пула потоков сжатия на старте и его остановка при остановке приложения
+    """
+
+    app['compressor'] = Compressor(
+        args.compression_min_size, args.compression_offload_size, args.compression_workers
+    )
+    log.info('Response compression: %s', ', '.join(COMPRESSORS) if app['compressor'].enabled else 'disabled')
+
+    try:
+        yield
+    finally:
+        app['compressor'].close()
+
+
+__all__ = (
+    'COMPRESSORS', 'Compressor', 'choose_encoding', 'setup_compression',
+)
@@ -1,9 +1,13 @@
 from .delete import DeleteView
 from .nodes import NodeView
+from .nodes_batch import NodesBatchView
 from .sales import SalesView
 from .imports import ImportsView
+from .import_jobs import ImportJobView
+from .metrics import MetricsView
 from .stats import StatsView
+from .stats_batch import StatsBatchView
 
 HANDLERS = (
-    StatsView, SalesView, NodeView, ImportsView, DeleteView
+    StatsView, StatsBatchView, SalesView, NodeView, NodesBatchView, ImportsView, ImportJobView, DeleteView, MetricsView
 )
@@ -1,9 +1,16 @@
 import logging
+from datetime import datetime, timezone
+from http import HTTPStatus
 
+from aiohttp.web_exceptions import HTTPNotFound
+from aiohttp.web_response import Response
 from aiohttp.web_urldispatcher import View
+from asyncpg import Record
 from asyncpgsa import PG
+from configargparse import Namespace
 
-from market.api.utils import get_obj_tree_by_id
+from market.api.payloads import dumps_tree
+from market.api.utils import get_category_history, get_obj_tree_by_id, STATEMENTS
 
 log = logging.getLogger(__name__)
 
@@ -20,9 +27,66 @@ class BaseView(View):
         log.debug('Registering handler %r as %r', self.request.app.keys(), type(self.request.app))
         return self.request.app['pg']
 
+    @property
+    def args(self) -> Namespace:
+        return self.request.app['args']
+
     async def get_obj(self, query):
         return await self.pg.fetchrow(query)
 
+    async def get_category_history(self, shop_unit_id: str, version: int,
+                                   date_start: datetime, date_end: datetime) -> list[tuple[datetime, int]]:
+        """
+        :return: история категории, восстановленная из истории ее товаров (--history-mode lazy),
+        кэшируется по (категория, версия, период), см. HistoryCache
+        """
+
+        cache = self.request.app['history_cache']
+        key = (shop_unit_id, version, date_start, date_end)
+
+        points = cache.get(key)
+        if points is None:
+            points = await get_category_history(shop_unit_id, date_start, date_end, self.pg)
+            cache.put(key, points)
+        return points
+
+    def is_not_modified(self, etag: str, last_modified: datetime) -> bool:
+        """
+        :param etag: текущий ETag элемента
+        :param last_modified: время выдачи текущей версии элемента (utc, modified_at)
+        :return: True, если у клиента актуальная версия ответа
+
+        If-None-Match проверяется раньше If-Modified-Since и отменяет его (RFC 7232)
+        """
+
+        if_none_match = self.request.if_none_match
+        if if_none_match is not None:
+            return any(tag.value in (etag, '*') for tag in if_none_match)
+
+        if_modified_since = self.request.if_modified_since
+        if if_modified_since is not None:
+            # Last-Modified передается с точностью до секунды
+            return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= if_modified_since
+
+        return False
+
+    @staticmethod
+    def set_validators(response: Response, etag: str, last_modified: datetime) -> Response:
+        """
+        :param response: ответ
+        :param etag: ETag элемента
+        :param last_modified: время выдачи текущей версии элемента (utc, modified_at)
+        :return: тот же ответ с заголовками ETag и Last-Modified
+        """
+
+        response.etag = etag
+        # отбрасываем доли секунды сами (aiohttp округляет вверх), как и при сравнении в is_not_modified
+        response.last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return response
+
+    def not_modified(self, etag: str, last_modified: datetime) -> Response:
+        return self.set_validators(Response(status=HTTPStatus.NOT_MODIFIED), etag, last_modified)
+
 
 class BaseImportView(BaseView):
     """
@@ -33,9 +97,19 @@ class BaseImportView(BaseView):
     def shop_unit_id(self) -> str:
         return str(self.request.match_info.get('shop_unit_id'))
 
-    async def get_obj_tree(self) -> dict:
+    async def get_obj_tree(self) -> bytes:
+        """
+        :return: bytes - сериализованное дерево, в котором текущий является корнем
+        """
+
+        return dumps_tree(await get_obj_tree_by_id(self.shop_unit_id, self.pg))
+
+    async def get_version(self) -> Record:
         """
-        :return: dict - дерево, в котором текущий является корнем
+        :return: версия элемента и время ее выдачи (404, если элемента нет)
         """
 
-        return await get_obj_tree_by_id(self.shop_unit_id, self.pg)
+        record = await STATEMENTS.fetchrow(self.pg, 'get_shop_unit_version', self.shop_unit_id)
+        if record is None:
+            raise HTTPNotFound()
+        return record
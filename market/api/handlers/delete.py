@@ -4,7 +4,7 @@ from aiohttp.web_exceptions import HTTPNotFound
 from aiohttp.web_response import Response
 from aiohttp_apispec import docs
 
-from market.api.utils import get_item_tree, SQL_REQUESTS
+from market.api.utils import get_item_tree, STATEMENTS
 from market.api.handlers.base import BaseImportView
 
 
@@ -18,12 +18,17 @@ class DeleteView(BaseImportView):
         Метод удаления элемента с каким-либо id из всех таблиц
         """
 
-        ides_to_req, _ = await get_item_tree(self.shop_unit_id, self.pg)
+        ides_to_req = await get_item_tree(self.shop_unit_id, self.pg)
         if not ides_to_req:
             raise HTTPNotFound()
-        ides_to_req = tuple(ides_to_req)
-        sql_request = SQL_REQUESTS['delete_by_ides'].format(
-            ides_to_req, ides_to_req, ides_to_req, ides_to_req).replace(',)', ')')
-        await self.pg.execute(sql_request)
+
+        async with self.pg.transaction() as conn:
+            # вычитаем агрегаты удаляемого поддерева из всей родительской ветки
+            ancestors = await STATEMENTS.fetch(conn, 'subtract_from_branch', self.shop_unit_id)
+            await STATEMENTS.execute(conn, 'delete_by_ides', list(ides_to_req))
+
+        self.request.app['nodes_cache'].invalidate(
+            ides_to_req | {record.get('shop_unit_id') for record in ancestors}
+        )
 
         return Response(status=HTTPStatus.OK)
@@ -0,0 +1,39 @@
+from aiohttp.web_exceptions import HTTPNotFound
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs
+
+from market.api.handlers.base import BaseView
+from market.api.utils import datetime_to_str, STATEMENTS
+
+
+class ImportJobView(BaseView):
+    URL_PATH = r'/imports/{job_id:[\w-]+}'
+
+    @property
+    def job_id(self) -> str:
+        return str(self.request.match_info.get('job_id'))
+
+    @docs(summary='Получить статус фоновой задачи импорта')
+    async def get(self) -> Response:
+        """
+        :return: Response
+        Метод получения прогресса, времени выполнения и ошибки задачи импорта
+        """
+
+        job = await STATEMENTS.fetchrow(self.pg, 'get_import_job', self.job_id)
+        if job is None:
+            raise HTTPNotFound()
+
+        started_at, finished_at = job.get('started_at'), job.get('finished_at')
+        return Response(body={
+            'id': job.get('job_id'),
+            'status': job.get('status').upper(),
+            'updateDate': datetime_to_str(job.get('update_date')),
+            'itemsTotal': job.get('items_total'),
+            'itemsDone': job.get('items_done'),
+            'error': job.get('error'),
+            'createdAt': datetime_to_str(job.get('created_at')),
+            'startedAt': started_at and datetime_to_str(started_at),
+            'finishedAt': finished_at and datetime_to_str(finished_at),
+            'duration': (finished_at - started_at).total_seconds() if started_at and finished_at else None,
+        })
@@ -0,0 +1,28 @@
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs
+
+from market.api.handlers.base import BaseView
+from market.api.utils import HISTORY_METRICS, STATEMENTS
+
+
+class MetricsView(BaseView):
+    URL_PATH = r'/metrics'
+
+    @docs(summary='Получить метрики процесса')
+    async def get(self) -> Response:
+        """
+        :return: Response
+        Метод получения метрик процесса: время ответа и кол-во запросов к бд по обработчикам,
+        кол-во и время выполнения запросов к бд, состояние пула соединений, кэшей /nodes и истории, сжатие ответов
+        и записи истории (добавленные и пропущенные без изменения цены)
+        """
+
+        return Response(body={
+            'requests': self.request.app['request_metrics'].stats(),
+            'statements': STATEMENTS.stats(),
+            'pool': self.pg.pool.stats(),
+            'nodesCache': self.request.app['nodes_cache'].stats(),
+            'historyCache': self.request.app['history_cache'].stats(),
+            'compression': self.request.app['compressor'].stats(),
+            'history': HISTORY_METRICS.stats(),
+        })
@@ -1,18 +1,95 @@
+from http import HTTPStatus
+
 from aiohttp.web_response import Response
 from aiohttp_apispec import docs
 
+from market.api.cache import CachedNode
 from market.api.handlers.base import BaseImportView
+from market.api.payloads import AsyncGenJSONTreePayload, dumps_tree
+from market.api.utils import get_obj_tree_page, iter_obj_tree_by_id, STATEMENTS
 
 
 class NodeView(BaseImportView):
     URL_PATH = r'/nodes/{shop_unit_id:[\w, -]+}'
 
+    def get_page_params(self) -> dict | None:
+        """
+        :return: параметры частичного чтения дерева, None - нужно все дерево
+        :raise ValueError: если параметры некорректны
+        """
+
+        query = self.request.query
+        if not {'depth', 'childrenLimit', 'cursor'} & query.keys():
+            return None
+
+        depth = int(query['depth']) if 'depth' in query else None
+        children_limit = int(query['childrenLimit']) if 'childrenLimit' in query else None
+        if depth is not None and depth < 0 or children_limit is not None and children_limit < 1:
+            raise ValueError('depth must be >= 0, childrenLimit must be >= 1')
+
+        return {'depth': depth, 'children_limit': children_limit, 'cursor': query.get('cursor')}
+
     @docs(summary='Получить объект со всеми дочерними')
     async def get(self) -> Response:
         """
         :return: Response
-        Метод получения дерева элемента
+        Метод получения дерева элемента (сериализованные деревья кэшируются, см. NodesCache).
+        Большие поддеревья не кэшируются и не собираются в памяти, а пишутся клиенту по частям.
+        ETag - версия элемента (меняется при любом изменении поддерева), поэтому проверка
+        If-None-Match/If-Modified-Since стоит одного чтения по первичному ключу, а из кэша - ни одного.
+        ?depth=N обрезает дерево после N уровней, ?childrenLimit=M&cursor=... листает прямых детей
         """
 
-        shop_unit = await self.get_obj_tree()
-        return Response(body=shop_unit)
+        try:
+            page_params = self.get_page_params()
+        except ValueError:
+            return Response(status=HTTPStatus.BAD_REQUEST)
+
+        if page_params is not None:
+            return await self.get_page(**page_params)
+
+        cache = self.request.app['nodes_cache']
+
+        entry = cache.get(self.shop_unit_id)
+        if entry is None:
+            # версия читается раньше дерева: дерево может оказаться только новее ее
+            epoch = cache.epoch
+            version = await self.get_version()
+            etag, last_modified = str(version['version']), version['modified_at']
+
+            if self.is_not_modified(etag, last_modified):
+                return self.not_modified(etag, last_modified)
+
+            # порог - по кол-ву всех элементов поддерева (категории тоже попадают в ответ)
+            threshold = self.args.nodes_stream_threshold
+            if threshold and await STATEMENTS.fetchval(
+                    self.pg, 'count_subtree_nodes', self.shop_unit_id, threshold) >= threshold:
+                payload = AsyncGenJSONTreePayload(iter_obj_tree_by_id(self.shop_unit_id, self.pg))
+                return self.set_validators(Response(body=payload), etag, last_modified)
+
+            entry = CachedNode(await self.get_obj_tree(), etag, last_modified)
+            cache.put(self.shop_unit_id, entry, epoch)
+
+        elif self.is_not_modified(entry.etag, entry.last_modified):
+            return self.not_modified(entry.etag, entry.last_modified)
+
+        response = Response(body=entry.body, content_type='application/json')
+        return self.set_validators(response, entry.etag, entry.last_modified)
+
+    async def get_page(self, depth: int | None, children_limit: int | None, cursor: str | None) -> Response:
+        """
+        :param depth: кол-во уровней под элементом (None - все)
+        :param children_limit: кол-во прямых детей на странице (None - все)
+        :param cursor: nextCursor предыдущей страницы
+        :return: Response
+        Метод получения части дерева (не кэшируется, ETag тот же, что у всего дерева)
+        """
+
+        version = await self.get_version()
+        etag, last_modified = str(version['version']), version['modified_at']
+        if self.is_not_modified(etag, last_modified):
+            return self.not_modified(etag, last_modified)
+
+        rows = await get_obj_tree_page(self.shop_unit_id, self.pg, depth, children_limit, cursor)
+        response = Response(body=dumps_tree(rows), content_type='application/json')
+        return self.set_validators(response, etag, last_modified)
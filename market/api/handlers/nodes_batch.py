@@ -0,0 +1,60 @@
+from http import HTTPStatus
+from json import JSONDecodeError
+
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs, request_schema
+from marshmallow import ValidationError
+
+from market.api.handlers.base import BaseView
+from market.api.payloads import dumps_bytes, dumps_tree
+from market.api.schema import NodesBatchSchema
+from market.api.utils import get_obj_trees_by_ides
+
+
+class NodesBatchView(BaseView):
+    URL_PATH = '/nodes'
+
+    async def get_trees(self, data) -> Response:
+        """
+        :param data: тело запроса ({"ids": [...]})
+        :return: Response - словарь id: дерево элемента (null, если элемента нет)
+        """
+
+        try:
+            ides = NodesBatchSchema().load(data)['ids']
+        except ValidationError:
+            return Response(status=HTTPStatus.BAD_REQUEST)
+
+        # повторяющиеся id схлопываем, порядок ключей ответа - порядок запроса;
+        # каждое дерево сериализуется отдельно (глубина не ограничена, см. dumps_tree)
+        trees = await get_obj_trees_by_ides(list(dict.fromkeys(ides)), self.pg)
+        body = b'{' + b','.join(
+            dumps_bytes(shop_unit_id) + b':' + (b'null' if rows is None else dumps_tree(rows))
+            for shop_unit_id, rows in trees.items()
+        ) + b'}'
+        return Response(body=body, content_type='application/json')
+
+    @docs(summary='Получить несколько объектов со всеми дочерними (?ids=a,b,c)')
+    async def get(self) -> Response:
+        """
+        :return: Response
+        Метод получения деревьев нескольких элементов за два запроса к бд
+        """
+
+        ides = [shop_unit_id for shop_unit_id in self.request.query.get('ids', '').split(',') if shop_unit_id]
+        return await self.get_trees({'ids': ides})
+
+    @docs(summary='Получить несколько объектов со всеми дочерними (длинный список id)')
+    @request_schema(NodesBatchSchema())
+    async def post(self) -> Response:
+        """
+        :return: Response
+        То же, что и get, но id передаются в теле запроса
+        """
+
+        try:
+            data = await self.request.json()
+        except JSONDecodeError:
+            return Response(status=HTTPStatus.BAD_REQUEST)
+
+        return await self.get_trees(data)
@@ -1,47 +1,44 @@
-from datetime import timedelta
 from http import HTTPStatus
-from json import dumps
 from urllib.parse import parse_qs, unquote, urlparse
 
 from aiohttp.web_response import Response
 from aiohttp_apispec import docs
-from sqlalchemy import and_, select
 
-from market.db.schema import history_table, shop_units_table
-from market.api.utils import datetime_to_str, edit_json_to_answer, str_to_datetime
+from market.api.payloads import AsyncGenJSONListPayload
+from market.api.utils import iter_sales, str_to_datetime
 from market.api.handlers.base import BaseImportView
 
 
 class SalesView(BaseImportView):
     URL_PATH = r'/sales'
 
+    def get_page_params(self) -> dict:
+        """
+        :return: параметры страницы (limit, after)
+        :raise ValueError: если параметры некорректны
+        """
+
+        query = self.request.query
+        limit = int(query['limit']) if 'limit' in query else None
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be >= 1')
+
+        return {'limit': limit, 'after': query.get('after')}
+
     @docs(summary='Отобразить товары со скидкой')
     async def get(self) -> Response:
         """
         :return: Response
-        Метод получения элемента (-ов), цена которых менялась за последние 24 часа
+        Метод получения элемента (-ов), цена которых менялась за последние 24 часа.
+        Товары выбираются по индексу last_price_change_at и пишутся клиенту по частям
+        по возрастанию id, ?limit=N&after={id последнего товара} листает их страницами
         """
 
         try:
             date = str_to_datetime(parse_qs(urlparse(unquote(str(self.request.url))).query)['date'][0])
+            page_params = self.get_page_params()
         except (ValueError, KeyError):
             return Response(status=HTTPStatus.BAD_REQUEST)
 
-        sql_request = shop_units_table.select().where(
-            and_(
-                shop_units_table.c.type == 'offer',
-                shop_units_table.c.shop_unit_id.in_(
-                    select(history_table.c.shop_unit_id).where(
-                        and_(
-                            history_table.c.update_date >= date - timedelta(days=1),
-                            history_table.c.update_date <= date,
-                        )
-                    )
-                )
-            )
-        )
-
-        data = list(map(dict, await self.pg.fetch(sql_request)))
-        for record in data:
-            record['date'] = datetime_to_str(record['date'])
-        return Response(body=dumps(await edit_json_to_answer(data)))
+        payload = AsyncGenJSONListPayload(iter_sales(date, self.pg, **page_params), root_object=None)
+        return Response(body=payload)
@@ -1,13 +1,19 @@
+from datetime import datetime
 from http import HTTPStatus
 from urllib.parse import parse_qs, unquote, urlparse
 
 from aiohttp.web_exceptions import HTTPNotFound
 from aiohttp.web_response import Response
 from aiohttp_apispec import docs
-from sqlalchemy import and_, select
+from asyncpg import Record
+from sqlalchemy import select
 
-from market.db.schema import history_table, shop_units_table
-from market.api.utils import datetime_to_str, edit_json_to_answer, str_to_datetime
+from market.db.schema import shop_units_table
+from market.api.payloads import AsyncGenJSONListPayload, dumps_bytes
+from market.api.utils import (
+    HISTORY_BUCKETS, history_points_to_answer, iter_history, shop_unit_to_answer,
+    SHOP_UNIT_FIELDS, str_to_datetime
+)
 from market.api.handlers.base import BaseImportView
 
 
@@ -19,6 +25,9 @@ class StatsView(BaseImportView):
         """
         :return: Response
         Метод получения истории изменений элемента, цена которых менялась с date_start до date_end
+        (ETag - версия элемента, на If-None-Match/If-Modified-Since отвечает 304 до чтения истории).
+        ?bucket=hour|day|week прореживает историю до одной записи на интервал (см. iter_history).
+        В режиме --history-mode lazy история категорий собирается из истории их товаров (см. get_lazy)
         """
 
         # парсим url
@@ -27,28 +36,54 @@ class StatsView(BaseImportView):
         try:
             date_end = str_to_datetime(kwargs['dateEnd'][0])
             date_start = str_to_datetime(kwargs['dateStart'][0])
+            bucket = kwargs['bucket'][0] if 'bucket' in kwargs else None
+            if bucket is not None and bucket not in HISTORY_BUCKETS:
+                raise ValueError(f'bucket must be one of {", ".join(HISTORY_BUCKETS)}')
         except (ValueError, KeyError):
             return Response(status=HTTPStatus.BAD_REQUEST)
 
-        # sql получения истории обновления цены товара/категории
-        sql_request = select(history_table).where(
-            and_(
-                date_start <= history_table.c.update_date,
-                history_table.c.update_date <= date_end,
-                history_table.c.shop_unit_id == self.shop_unit_id
+        # получаем сам объект (вместе с версией) раньше истории: история может оказаться только новее версии
+        columns = (*SHOP_UNIT_FIELDS, 'version', 'modified_at')
+        ans = await self.pg.fetchrow(
+            select(*(shop_units_table.c[field] for field in columns)).where(
+                shop_units_table.c.shop_unit_id == self.shop_unit_id
             )
         )
-
-        prices = [[record.get('price'), record.get('update_date')] for record in await self.pg.fetch(sql_request)]
-
-        # получаем сам объект и добавляем его историю в обновлений
-        ans = await self.pg.fetchrow(
-            shop_units_table.select().where(shop_units_table.c.shop_unit_id == self.shop_unit_id))
-        ans = ans and dict(ans)
         if ans is None:
             raise HTTPNotFound()
-        del ans['date']
-        ans['stats'] = [{'update_date': datetime_to_str(update_date), 'price': price} for price, update_date in prices]
-        ans['price'] = ans['stats'][-1]['price'] if ans['stats'] else None
 
-        return Response(body=await edit_json_to_answer(ans))
+        etag, last_modified = str(ans['version']), ans['modified_at']
+        if self.is_not_modified(etag, last_modified):
+            return self.not_modified(etag, last_modified)
+
+        if self.args.history_mode == 'lazy' and ans['type'] == 'category':
+            return self.set_validators(
+                await self.get_lazy(ans, date_start, date_end, bucket), etag, last_modified
+            )
+
+        # история пишется клиенту по частям, цена элемента - последняя цена в периоде,
+        # поэтому она дописывается после истории
+        ans = shop_unit_to_answer(ans, with_date=False)
+        del ans['price']
+        payload = AsyncGenJSONListPayload(
+            iter_history(self.shop_unit_id, date_start, date_end, self.pg, bucket),
+            root_object='stats', head=ans, tail=lambda last: {'price': last['price'] if last else None},
+        )
+        return self.set_validators(Response(body=payload), etag, last_modified)
+
+    async def get_lazy(self, ans: Record, date_start: datetime, date_end: datetime, bucket: str | None) -> Response:
+        """
+        :param ans: строка категории (с версией)
+        :param date_start: начало периода
+        :param date_end: конец периода
+        :param bucket: интервал прореживания, None - все точки
+        :return: Response
+        Метод получения истории категории, восстановленной из истории ее товаров (--history-mode lazy)
+        """
+
+        points = await self.get_category_history(self.shop_unit_id, ans['version'], date_start, date_end)
+
+        body = shop_unit_to_answer(ans, with_date=False)
+        body['stats'] = history_points_to_answer(points, bucket)
+        body['price'] = points[-1][1] if points else None
+        return Response(body=dumps_bytes(body), content_type='application/json')
@@ -0,0 +1,113 @@
+from datetime import datetime
+from http import HTTPStatus
+from json import JSONDecodeError
+from typing import AsyncIterator
+
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs, request_schema
+from marshmallow import ValidationError
+
+from market.api.handlers.base import BaseView
+from market.api.payloads import AsyncGenJSONListPayload
+from market.api.schema import StatisticBatchSchema
+from market.api.utils import (
+    history_points_to_answer, iter_histories, shop_unit_to_answer, STATEMENTS, str_to_datetime
+)
+
+
+class StatsBatchView(BaseView):
+    URL_PATH = '/statistic'
+
+    async def get_stats(self, data) -> Response:
+        """
+        :param data: тело запроса ({"ids": [...], "dateStart": ..., "dateEnd": ...})
+        :return: Response - {"notFound": [id, ...], "items": [элемент с историей, ...]}
+        """
+
+        try:
+            data = StatisticBatchSchema().load(data)
+            date_start, date_end = str_to_datetime(data['dateStart']), str_to_datetime(data['dateEnd'])
+        except (ValidationError, ValueError):
+            return Response(status=HTTPStatus.BAD_REQUEST)
+
+        # повторяющиеся id схлопываем, несуществующие возвращаются в notFound
+        ides = list(dict.fromkeys(data['ids']))
+        records = await STATEMENTS.fetch(self.pg, 'get_statistic_units', ides)
+        units = {record['shop_unit_id']: record for record in records}
+
+        payload = AsyncGenJSONListPayload(
+            self.iter_items(units, date_start, date_end), root_object='items',
+            head={'notFound': [shop_unit_id for shop_unit_id in ides if shop_unit_id not in units]},
+        )
+        return Response(body=payload)
+
+    async def iter_items(self, units: dict, date_start: datetime, date_end: datetime) -> AsyncIterator[dict]:
+        """
+        :param units: словарь id: строка элемента (см. запрос get_statistic_units)
+        :param date_start: начало периода
+        :param date_end: конец периода
+        :return: AsyncIterator элементов с историей (в формате /node/{id}/statistic)
+
+        Сначала идут элементы с историей в периоде (по мере чтения из курсора),
+        затем остальные. В режиме --history-mode lazy история категорий собирается
+        из истории их товаров (по одной категории, с кэшем)
+        """
+
+        lazy = self.args.history_mode == 'lazy'
+        categories = {
+            shop_unit_id for shop_unit_id, unit in units.items() if lazy and unit['type'] == 'category'
+        }
+
+        rest = dict(units)
+        history_ides = [shop_unit_id for shop_unit_id in units if shop_unit_id not in categories]
+        if history_ides:
+            async for shop_unit_id, stats in iter_histories(history_ides, date_start, date_end, self.pg):
+                yield self.make_item(rest.pop(shop_unit_id), stats)
+
+        for shop_unit_id, unit in rest.items():
+            stats = []
+            if shop_unit_id in categories:
+                points = await self.get_category_history(shop_unit_id, unit['version'], date_start, date_end)
+                stats = history_points_to_answer(points)
+            yield self.make_item(unit, stats)
+
+    @staticmethod
+    def make_item(unit, stats: list[dict]) -> dict:
+        """
+        :param unit: строка элемента
+        :param stats: записи истории элемента
+        :return: элемент с историей, цена - последняя цена в периоде
+        """
+
+        item = shop_unit_to_answer(unit, with_date=False)
+        item['price'] = stats[-1]['price'] if stats else None
+        item['stats'] = stats
+        return item
+
+    @docs(summary='Отобразить историю изменения нескольких товаров (?ids=a,b,c&dateStart=...&dateEnd=...)')
+    async def get(self) -> Response:
+        """
+        :return: Response
+        Метод получения истории нескольких элементов: история всех элементов читается одним запросом
+        и пишется клиенту по частям, сгруппированной по элементам
+        """
+
+        query = self.request.query
+        ides = [shop_unit_id for shop_unit_id in query.get('ids', '').split(',') if shop_unit_id]
+        dates = {key: query[key] for key in ('dateStart', 'dateEnd') if key in query}
+        return await self.get_stats({'ids': ides, **dates})
+
+    @docs(summary='Отобразить историю изменения нескольких товаров (длинный список id)')
+    @request_schema(StatisticBatchSchema())
+    async def post(self) -> Response:
+        """
+        :return: Response
+        То же, что и get, но параметры передаются в теле запроса
+        """
+
+        try:
+            data = await self.request.json()
+        except JSONDecodeError:
+            return Response(status=HTTPStatus.BAD_REQUEST)
+
+        return await self.get_stats(data)
@@ -0,0 +1,297 @@
+import logging
+from datetime import datetime
+from typing import Generator
+
+from asyncpg import Connection
+from asyncpgsa import PG
+from sqlalchemy.dialects.postgresql import insert
+
+from market.api.utils import BranchesUpdate, get_branch, get_branches_states, STATEMENTS
+from market.api.validators import validate_all_items
+from market.db.schema import relations_table, shop_units_table
+from market.utils.pg import MAX_QUERY_ARGS
+
+log = logging.getLogger(__name__)
+
+IMPORT_MODES = ('values', 'copy')
+STAGING_COLUMNS = ('shop_unit_id', 'name', 'date', 'parent_id', 'type', 'price')
+
+# updateDate может прийти в теле после items, тогда части пишутся с этой датой,
+# а настоящая проставляется всем элементам выгрузки в BranchesUpdate.finish
+PENDING_DATE = datetime.min
+
+
+class ShopUnitsImporter:
+    """
+    Запись выгрузки в бд частями внутри одной транзакции.
+    Используется и обработчиком /imports, и фоновыми задачами импорта
+    """
+
+    # Так как данных может быть много, а postgres поддерживает только
+    # MAX_QUERY_ARGS аргументов в одном запросе, писать в БД необходимо
+    # частями.
+    # Максимальное кол-во строк для вставки можно рассчитать как отношение
+    # MAX_QUERY_ARGS к кол-ву вставляемых в таблицу столбцов.
+
+    MAX_CITIZENS_PER_INSERT = MAX_QUERY_ARGS // len(shop_units_table.columns)
+    MAX_RELATIONS_PER_INSERT = MAX_QUERY_ARGS // len(relations_table.columns)
+
+    def __init__(self, pg: PG, conn: Connection, import_mode: str = 'values', history_mode: str = 'snapshot'):
+        """
+        :param pg: PG объект коннекта к базе данных
+        :param conn: объект коннекта к бд (внутри транзакции)
+        :param import_mode: путь записи (values/copy)
+        :param history_mode: как пишется история (snapshot/lazy, см. HISTORY_MODES)
+        """
+
+        self.pg = pg
+        self.conn = conn
+        self.import_mode = import_mode
+        self.branches = BranchesUpdate(history_mode)
+
+    @classmethod
+    def make_shop_units_table_rows(cls, shop_units: list[dict], date: datetime) -> Generator:
+        """
+        :param shop_units: список элементов для вставки
+        :param date: дата обновления
+        :return: Generator
+
+        Метод, который генерирует данные готовые для вставки в таблицу shop_units
+        """
+
+        for shop_unit in shop_units:
+            yield {
+                'shop_unit_id': shop_unit['id'],
+                'name': shop_unit['name'],
+                'date': date,
+                'type': shop_unit['type'].lower(),
+                'parent_id': shop_unit.get('parentId'),
+                'price': shop_unit.get('price'),
+            }
+
+    @classmethod
+    def make_relations_table_rows(cls, relations: list[dict]) -> Generator:
+        """
+        :param relations: список словарей для вставки
+        :return: Generator
+
+        Метод, который генерирует данные готовые для вставки в таблицу relations
+        """
+
+        for shop_unit in relations:
+            if not shop_unit.get('parentId'):
+                continue
+            yield {
+                'children_id': shop_unit['id'],
+                'relation_id': shop_unit['parentId'],
+            }
+
+    @staticmethod
+    async def add_relatives(conn: Connection, chunk: list[dict]) -> None:
+        """
+        :param conn: объект коннекта к бд
+        :param chunk список элементов для вставки
+        :return: None
+
+        Метод, который вставляет данные в таблицу relations
+        """
+
+        query = insert(relations_table).on_conflict_do_nothing(index_elements=['relation_id', 'children_id'])
+        query.parameters = []
+
+        await conn.execute(query.values(list(chunk)))
+
+    async def update_or_create(self, conn: Connection, chunk: list[dict]):
+        """
+        :param conn: объект коннекта к бд
+        :param chunk список элементов для вставки
+        :return: None
+
+        Метод, который вставляет данные в таблицу shop_units
+        """
+
+        parents = set()
+        all_objects = dict()
+
+        for data in chunk:
+            if data.get('parent_id'):
+                parents.add(data.get('parent_id'))
+            all_objects[data.get('shop_unit_id')] = data.copy()
+
+        # проверяем, что родитель есть в бд и что его тип == 'category'
+        if parents:
+            for parent in await STATEMENTS.fetch(self.pg, 'get_by_ides', list(parents)):
+                assert parent is not None and parent.get('type').lower() == 'category', \
+                    f'Incorrect parent with id {parent.get("shop_unit_id")} (Not found in db or type is OFFER)'
+
+        await self.insert_shop_units(conn, list(all_objects.values()))
+
+    @staticmethod
+    async def insert_shop_units(conn: Connection, chunk: list[dict]) -> None:
+        """
+        :param conn: объект коннекта к бд
+        :param chunk список элементов для вставки
+        :return: None
+
+        Метод, который вставляет данные в таблицу shop_units одним multi-VALUES запросом
+        """
+
+        # добавляем объекты, которых еще нет в бд, и обновляем существующие
+        # (агрегаты поддеревьев пересчитываются отдельно, см. BranchesUpdate)
+        insert_query = insert(shop_units_table).values(chunk)
+        insert_query = insert_query.on_conflict_do_update(
+            index_elements=['shop_unit_id'],
+            set_={column: insert_query.excluded[column] for column in ('name', 'date', 'parent_id', 'type', 'price')}
+        )
+        insert_query.parameters = []
+
+        await conn.execute(insert_query)
+
+    @staticmethod
+    def validate_parents(states: dict[str, dict], rows: dict[str, dict]) -> None:
+        """
+        :param states: состояние элементов выгрузки и их родителей до импорта
+        :param rows: строки всей выгрузки по id (см. BranchesUpdate.rows)
+        :return: None
+
+        Метод, который проверяет, что родитель каждого элемента есть в бд или в выгрузке
+        (в любой ее части) и что он - категория (без запросов к бд)
+        """
+
+        for row in rows.values():
+            if not row['parent_id']:
+                continue
+            parent = rows.get(row['parent_id']) or states.get(row['parent_id'])
+            assert parent is not None and parent.get('type').lower() == 'category', \
+                f'Incorrect parent with id {row["parent_id"]} (Not found in db or type is OFFER)'
+
+    @staticmethod
+    async def copy_shop_units(conn: Connection, shop_unit_rows: list[dict]) -> None:
+        """
+        :param conn: объект коннекта к бд (внутри транзакции)
+        :param shop_unit_rows: строки выгрузки для таблицы shop_units
+        :return: None
+
+        Метод, который бинарным COPY загружает выгрузку во временную таблицу
+        и переносит ее в shop_units одним INSERT ... ON CONFLICT.
+        Временная таблица удаляется в конце транзакции, из нее же потом
+        заполняется таблица relations (см. запрос merge_relations)
+        """
+
+        # ON CONFLICT DO UPDATE не может дважды изменить одну строку,
+        # поэтому повторяющиеся id схлопываем (последний побеждает)
+        rows = {row['shop_unit_id']: row for row in shop_unit_rows}
+
+        await STATEMENTS.execute(conn, 'create_shop_units_staging')
+        await conn.copy_records_to_table(
+            'shop_units_staging', columns=STAGING_COLUMNS,
+            records=(tuple(row[column] for column in STAGING_COLUMNS) for row in rows.values())
+        )
+        await STATEMENTS.execute(conn, 'merge_shop_units')
+
+    @staticmethod
+    async def update_hierarchy(conn: Connection, states: dict[str, dict], shop_unit_rows: list[dict]) -> None:
+        """
+        :param conn: объект коннекta к бд (внутри транзакции)
+        :param states: состояние элементов выгрузки и их родителей до импорта
+        :param shop_unit_rows: строки выгрузки для таблицы shop_units
+        :return: None
+
+        Метод, который поддерживает closure-таблицу hierarchy: новые элементы
+        добавляются под своих родителей, перемещенные вместе со своим поддеревом
+        отцепляются от старых предков и прицепляются к новым
+        """
+
+        rows = {row['shop_unit_id']: row for row in shop_unit_rows}
+        await STATEMENTS.execute(conn, 'insert_hierarchy_nodes', list(rows))
+
+        moved = [
+            shop_unit_id for shop_unit_id, row in rows.items()
+            if shop_unit_id in states and states[shop_unit_id]['parent_id'] != row['parent_id']
+        ]
+        if moved:
+            await STATEMENTS.execute(conn, 'detach_hierarchy', moved)
+
+        attach = {
+            shop_unit_id: row['parent_id'] for shop_unit_id, row in rows.items()
+            if row['parent_id'] and (shop_unit_id not in states or shop_unit_id in moved)
+        }
+
+        # один запрос видит таблицу до своих изменений, поэтому элемент и любой
+        # его новый предок из той же части прицепляются разными запросами:
+        # уровень элемента - кол-во прицепляемых элементов в его новой ветке
+        parents = {shop_unit_id: state['parent_id'] for shop_unit_id, state in states.items()}
+        parents.update((shop_unit_id, row['parent_id']) for shop_unit_id, row in rows.items())
+
+        levels = {}
+        for shop_unit_id in attach:
+            level = sum(1 for parent_id in get_branch(parents[shop_unit_id], parents) if parent_id in attach)
+            levels.setdefault(level, []).append(shop_unit_id)
+
+        for level in sorted(levels):
+            await STATEMENTS.execute(
+                conn, 'attach_hierarchy', levels[level], [attach[shop_unit_id] for shop_unit_id in levels[level]]
+            )
+
+    async def import_chunk(self, shop_units: list[dict], date: datetime) -> None:
+        """
+        :param shop_units: часть элементов выгрузки
+        :param date: дата обновления (либо PENDING_DATE, если она еще не известна)
+        :return: None
+
+        Метод, который пишет в бд строки очередной части выгрузки; closure-таблица и агрегаты веток
+        пересчитываются в finish по всей выгрузке, т.к. родитель может прийти в более поздней части
+        """
+
+        conn = self.conn
+        shop_unit_rows = list(self.make_shop_units_table_rows(shop_units, date))
+        validate_all_items([shop_unit_rows])
+
+        # состояние веток до вставки нужно для пересчета агрегатов поддеревьев
+        self.branches.add_chunk(await get_branches_states(
+            {row['shop_unit_id'] for row in shop_unit_rows} |
+            {row['parent_id'] for row in shop_unit_rows if row.get('parent_id')},
+            conn
+        ), shop_unit_rows)
+        states = self.branches.states
+
+        # values - multi-VALUES запрос,
+        # copy - бинарный COPY во временную таблицу и перенос одним запросом на таблицу
+        copy_mode = self.import_mode == 'copy'
+        if copy_mode:
+            await self.copy_shop_units(conn, shop_unit_rows)
+        else:
+            await self.update_or_create(conn, shop_unit_rows)
+
+        # у перемещенных элементов удаляем связь со старым родителем
+        moved = [
+            row['shop_unit_id'] for row in shop_unit_rows
+            if row['shop_unit_id'] in states and states[row['shop_unit_id']]['parent_id'] != row['parent_id']
+        ]
+        if moved:
+            await STATEMENTS.execute(conn, 'delete_relations', moved)
+
+        if copy_mode:
+            await STATEMENTS.execute(conn, 'merge_relations')
+        else:
+            relations_rows = list(self.make_relations_table_rows(shop_units))
+            if relations_rows:
+                await self.add_relatives(conn, relations_rows)
+
+    @property
+    def touched_ides(self) -> set[str]:
+        return self.branches.touched_ides
+
+    async def finish(self, date: datetime) -> None:
+        """
+        :param date: дата обновления
+        :return: None
+
+        Метод, который завершает выгрузку: проверяет родителей, обновляет closure-таблицу,
+        пересчитывает агрегаты, проставляет дату веткам и пишет историю
+        """
+
+        states, rows = self.branches.states, self.branches.rows
+        self.validate_parents(states, rows)
+        await self.update_hierarchy(self.conn, states, list(rows.values()))
+        await self.branches.finish(self.conn, date)
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+from uuid import uuid4
+
+from aiohttp import StreamReader
+from aiohttp.web_app import Application
+from asyncpgsa import PG
+from configargparse import Namespace
+
+from market.api.cache import NodesCache
+from market.api.importer import ShopUnitsImporter
+from market.api.parsers import ItemsStreamParser
+from market.api.utils import STATEMENTS, str_to_datetime
+
+log = logging.getLogger(__name__)
+
+
+class ImportJobs:
+    """
+    Фоновые задачи импорта: выгрузка сохраняется в бд (import_jobs, import_job_items),
+    id задачи кладется в ограниченную очередь, которую разбирают workers обработчиков.
+    Кол-во одновременно выполняемых импортов в процессе не превышает workers,
+    кол-во ожидающих - queue_size. Задачу выполняет тот обработчик (в любом из процессов),
+    который первым перевел ее из queued в running
+    """
+
+    def __init__(self, pg: PG, import_mode: str, workers: int, queue_size: int, nodes_cache: NodesCache,
+                 history_mode: str = 'snapshot'):
+        self.pg = pg
+        self.nodes_cache = nodes_cache
+        self.import_mode = import_mode
+        self.history_mode = history_mode
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+
+    async def start(self) -> None:
+        """
+        Метод запуска обработчиков; ожидающие задачи и задачи, выполнение которых прервала
+        остановка процесса, ставятся в очередь заново (задачи, которые выполняют
+        другие работающие процессы, не трогаются, см. запрос get_unfinished_import_jobs)
+        """
+
+        self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+        records = await STATEMENTS.fetch(self.pg, 'get_unfinished_import_jobs')
+        if records:
+            log.info('Requeueing %d unfinished import jobs', len(records))
+            self._tasks.append(asyncio.create_task(self.requeue([record.get('job_id') for record in records])))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def requeue(self, job_ides: list[str]) -> None:
+        for job_id in job_ides:
+            await self.queue.put(job_id)
+
+    async def create(self, content: StreamReader) -> str:
+        """
+        :param content: поток тела запроса /imports
+        :return: id задачи
+        :raise asyncio.QueueFull: если очередь заполнилась, пока сохранялась выгрузка (задача помечается failed)
+
+        Метод, который потоково сохраняет выгрузку в бд и ставит задачу в очередь
+        """
+
+        job_id = str(uuid4())
+        parser = ItemsStreamParser()
+
+        async with self.pg.transaction() as conn:
+            chunk = []
+            async for shop_unit in parser.iter_items(content):
+                chunk.append(json.dumps(shop_unit, ensure_ascii=False))
+                if len(chunk) == ShopUnitsImporter.MAX_CITIZENS_PER_INSERT:
+                    await self.add_items(conn, job_id, parser.items_count - len(chunk), chunk)
+                    chunk = []
+            if chunk:
+                await self.add_items(conn, job_id, parser.items_count - len(chunk), chunk)
+
+            assert parser.items_count and parser.fields.get('updateDate')
+            update_date = str_to_datetime(parser.fields['updateDate'])
+
+            await STATEMENTS.execute(conn, 'create_import_job', job_id, update_date, parser.items_count)
+
+        try:
+            self.queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            await self.finish(job_id, 'failed', 'Import queue is full')
+            raise
+        return job_id
+
+    @staticmethod
+    async def add_items(conn, job_id: str, start: int, items: list[str]) -> None:
+        await STATEMENTS.execute(
+            conn, 'insert_import_job_items', job_id, list(range(start, start + len(items))), items
+        )
+
+    async def worker(self) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.run(job_id)
+            except Exception:
+                log.exception('Import job %s crashed', job_id)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job_id: str) -> None:
+        """
+        :param job_id: id задачи
+        :return: None
+
+        Метод выполнения задачи: выгрузка читается из бд частями и пишется
+        тем же путем, что и при синхронном импорте, в одной транзакции.
+        Прогресс и статус пишутся отдельными запросами вне транзакции,
+        чтобы их было видно в GET /imports/{job_id}
+        """
+
+        job = None
+        try:
+            async with self.pg.transaction() as conn:
+                # блокировка берется раньше, чем задача становится running, и держится до конца транзакции:
+                # пока она занята, задачу не поставит в очередь заново перезапуск другого процесса
+                await STATEMENTS.execute(conn, 'lock_import_job', job_id)
+                job = await STATEMENTS.fetchrow(self.pg, 'start_import_job', job_id)
+                if job is None:
+                    # задача уже выполнена или ее выполняет другой обработчик
+                    return
+                log.info('Import job %s started (%d items)', job_id, job.get('items_total'))
+
+                importer = ShopUnitsImporter(self.pg, conn, self.import_mode, self.history_mode)
+
+                for start in range(0, job.get('items_total'), importer.MAX_CITIZENS_PER_INSERT):
+                    records = await STATEMENTS.fetch(
+                        conn, 'get_import_job_items', job_id, start, start + importer.MAX_CITIZENS_PER_INSERT
+                    )
+                    await importer.import_chunk([json.loads(record.get('item')) for record in records],
+                                                job.get('update_date'))
+                    await STATEMENTS.execute(self.pg, 'update_import_job_progress', job_id, start + len(records))
+
+                await importer.finish(job.get('update_date'))
+                await STATEMENTS.execute(conn, 'delete_import_job_items', job_id)
+
+            self.nodes_cache.invalidate(importer.touched_ides)
+
+        except (AssertionError, ValueError) as err:
+            await self.finish(job_id, 'failed', str(err) or repr(err))
+        except asyncio.CancelledError:
+            # задача будет поставлена в очередь заново при следующем запуске
+            raise
+        except Exception as err:
+            if job is None:
+                # задача не получена (ошибка до start_import_job), остается queued до следующего запуска
+                raise
+            log.exception('Import job %s failed', job_id)
+            await self.finish(job_id, 'failed', repr(err))
+        else:
+            await self.finish(job_id, 'done')
+
+    async def finish(self, job_id: str, status: str, error: str | None = None) -> None:
+        await STATEMENTS.execute(self.pg, 'finish_import_job', job_id, status, error)
+        if status == 'failed':
+            await STATEMENTS.execute(self.pg, 'delete_import_job_items', job_id)
+        log.info('Import job %s %s', job_id, status)
+
+
+async def setup_import_jobs(app: Application, args: Namespace):
+    """
+    Запуск обработчиков фоновых задач импорта на старте и их остановка при остановке приложения.
+    При --import-workers 0 асинхронный импорт выключен
+    """
+
+    app['import_jobs'] = None
+    if args.import_workers:
+        app['import_jobs'] = ImportJobs(
+            app['pg'], args.import_mode, args.import_workers, args.import_queue_size, app['nodes_cache'],
+            args.history_mode
+        )
+        await app['import_jobs'].start()
+
+    try:
+        yield
+    finally:
+        if app['import_jobs'] is not None:
+            await app['import_jobs'].stop()
@@ -0,0 +1,97 @@
+from http import HTTPStatus
+from time import perf_counter
+
+from aiohttp import hdrs
+from aiohttp.helpers import ETag
+from aiohttp.payload import BytesPayload, Payload
+from aiohttp.web_exceptions import HTTPException
+from aiohttp.web_middlewares import middleware
+from aiohttp.web_request import Request
+from aiohttp.web_response import ContentCoding, Response
+
+from market.api.compression import choose_encoding, STREAM_CODINGS
+from market.utils.pg import QUERY_COUNTER, QueryCounter
+
+
+@middleware
+async def metrics_middleware(request: Request, handler):
+    """
+    Считает время ответа и кол-во запросов к бд для каждого обработчика
+    (app['request_metrics'], отдается в GET /metrics)
+    """
+
+    resource = request.match_info.route.resource
+    route = f'{request.method} {resource.canonical if resource is not None else "unmatched"}'
+
+    counter = QueryCounter()
+    token = QUERY_COUNTER.set(counter)
+    start, status = perf_counter(), 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except HTTPException as err:
+        status = err.status
+        raise
+    finally:
+        QUERY_COUNTER.reset(token)
+        request.app['request_metrics'].observe(route, perf_counter() - start, status, counter.queries)
+
+
+@middleware
+async def compression_middleware(request: Request, handler):
+    """
+    Сжимает тела ответов не меньше --compression-min-size кодировкой, выбранной
+    по Accept-Encoding (br, gzip, deflate; app['compressor'], метрики - в GET /metrics).
+    Потоковые ответы сжимает сам aiohttp по частям (gzip, deflate)
+    """
+
+    response = await handler(request)
+
+    compressor = request.app['compressor']
+    if (not compressor.enabled or not isinstance(response, Response)
+            or hdrs.CONTENT_ENCODING in response.headers
+            or response.status in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED)):
+        return response
+
+    body = response.body
+    if isinstance(body, BytesPayload):
+        body = body._value
+
+    if isinstance(body, (bytes, bytearray)):
+        if len(body) < compressor.min_size:
+            return response
+
+        add_vary(response)
+        coding = choose_encoding(request.headers.get(hdrs.ACCEPT_ENCODING))
+        if coding is None:
+            return response
+
+        response.body = await compressor.compress(coding, bytes(body))
+        response.headers[hdrs.CONTENT_ENCODING] = coding
+    elif isinstance(body, Payload) and body.size is None:
+        add_vary(response)
+        coding = choose_encoding(request.headers.get(hdrs.ACCEPT_ENCODING), STREAM_CODINGS)
+        if coding is None:
+            return response
+
+        compressor.streamed += 1
+        response.enable_compression(ContentCoding(coding))
+    else:
+        return response
+
+    # сжатое представление отличается побайтово, поэтому ETag становится слабым
+    # (If-None-Match сравнивает ETag без учета слабости, см. BaseView.is_not_modified)
+    etag = response.etag
+    if etag is not None and not etag.is_weak:
+        response.etag = ETag(value=etag.value, is_weak=True)
+
+    return response
+
+
+def add_vary(response: Response) -> None:
+    vary = response.headers.get(hdrs.VARY)
+    if vary is None:
+        response.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+    elif hdrs.ACCEPT_ENCODING.lower() not in vary.lower():
+        response.headers[hdrs.VARY] = f'{vary}, {hdrs.ACCEPT_ENCODING}'
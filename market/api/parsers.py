@@ -0,0 +1,199 @@
+import asyncio
+import codecs
+import json
+import re
+from typing import AsyncIterator
+
+from aiohttp import StreamReader
+from aiohttp.web_exceptions import HTTPRequestEntityTooLarge
+
+MEGABYTE = 1024 ** 2
+MAX_REQUEST_SIZE = 70 * MEGABYTE
+
+# сколько байт тела запроса читается и разбирается за раз
+READ_CHUNK_SIZE = 256 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+# лексемы JSON: пробелы, строка, структурный символ, число или литерал
+# (незакрытая строка не совпадает ни с одной из них)
+TOKEN = re.compile(r'[ \t\n\r]+|"(?:[^"\\]|\\.)*"|[{}\[\]:,]|[^ \t\n\r{}\[\]:,"]+', re.DOTALL)
+
+
+class ItemsStreamParser:
+    """
+    Инкрементальный парсер JSON-объекта верхнего уровня: элементы массива
+    array_field отдаются по одному по мере поступления данных, остальные
+    поля объекта собираются в fields.
+
+    В памяти держится только непрочитанный хвост последней части тела,
+    поэтому память на запрос ограничена размером части и элемента массива,
+    а не размером всего тела.
+    """
+
+    def __init__(self, array_field: str = 'items'):
+        self.array_field = array_field
+        self.fields = {}
+        self.items_count = 0
+
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._state = 'start'
+        self._key = None
+
+    def _decode(self, buffer: str, pos: int, eof: bool) -> tuple:
+        """
+        :param buffer: текущий буфер
+        :param pos: позиция начала значения
+        :param eof: получено ли тело целиком
+        :return: значение и позиция его конца, либо (None, None), если значение получено не полностью
+        """
+
+        try:
+            value, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as err:
+            # ждать следующей части имеет смысл, только если ошибка - в обрезанной последней лексеме,
+            # иначе буфер рос бы до размера всего тела
+            if eof or err.pos < self._tail_start(buffer, pos):
+                raise
+            return None, None
+
+        # число или литерал на границе части могут быть обрезаны (в т.ч. так, что начало разбирается: "-2.")
+        if not eof and buffer[pos] not in '{["' and TOKEN.match(buffer, pos).end() == len(buffer):
+            return None, None
+        return value, end
+
+    @staticmethod
+    def _tail_start(buffer: str, pos: int) -> int:
+        """
+        :param buffer: текущий буфер
+        :param pos: позиция начала значения
+        :return: позиция, с которой буфер может быть обрезан границей части: начало незакрытой строки
+        или числа/литерала в самом конце буфера (len(buffer), если последняя лексема закончена)
+
+        Вызывается только при ошибке разбора, проходит одно значение (не больше элемента и части тела)
+        """
+
+        last = len(buffer)
+        while pos < len(buffer):
+            match = TOKEN.match(buffer, pos)
+            if match is None:
+                # незакрытая строка
+                return pos
+            last, pos = pos, match.end()
+
+        if last < len(buffer) and buffer[last] not in '{}[]:,"' + WHITESPACE:
+            return last
+        return len(buffer)
+
+    @staticmethod
+    def _expect(condition: bool, pos: int) -> None:
+        if not condition:
+            raise ValueError(f'Invalid JSON at position {pos}')
+
+    def feed(self, data: bytes, eof: bool = False) -> list:
+        """
+        :param data: очередная часть тела запроса
+        :param eof: последняя ли это часть
+        :return: элементы массива, полностью полученные к этому моменту
+
+        Метод, который разбирает очередную часть тела (синхронный, можно вызывать в потоке)
+        """
+
+        buffer = self._buffer + self._text_decoder.decode(data, final=eof)
+        items = []
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+
+            char = buffer[pos]
+
+            if self._state == 'start':
+                self._expect(char == '{', pos)
+                pos, self._state = pos + 1, 'key_or_end'
+
+            elif self._state in ('key_or_end', 'key'):
+                if char == '}' and self._state == 'key_or_end':
+                    pos, self._state = pos + 1, 'end'
+                    continue
+                self._expect(char == '"', pos)
+                key, end = self._decode(buffer, pos, eof)
+                if end is None:
+                    break
+                self._key, pos, self._state = key, end, 'colon'
+
+            elif self._state == 'colon':
+                self._expect(char == ':', pos)
+                pos, self._state = pos + 1, 'value'
+
+            elif self._state == 'value':
+                if self._key == self.array_field and char == '[':
+                    pos, self._state = pos + 1, 'item_or_end'
+                    continue
+                value, end = self._decode(buffer, pos, eof)
+                if end is None:
+                    break
+                self.fields[self._key] = value
+                pos, self._state = end, 'next_key'
+
+            elif self._state == 'next_key':
+                self._expect(char in ',}', pos)
+                pos, self._state = pos + 1, 'key' if char == ',' else 'end'
+
+            elif self._state in ('item_or_end', 'item'):
+                if char == ']' and self._state == 'item_or_end':
+                    pos, self._state = pos + 1, 'next_key'
+                    continue
+                item, end = self._decode(buffer, pos, eof)
+                if end is None:
+                    break
+                items.append(item)
+                pos, self._state = end, 'next_item'
+
+            elif self._state == 'next_item':
+                self._expect(char in ',]', pos)
+                pos, self._state = pos + 1, 'item' if char == ',' else 'next_key'
+
+            else:
+                raise ValueError(f'Extra data after JSON object at position {pos}')
+
+        self._buffer = buffer[pos:]
+        self.items_count += len(items)
+
+        if eof and self._state != 'end':
+            raise ValueError('Unexpected end of JSON')
+        return items
+
+    async def iter_items(self, content: StreamReader, max_size: int = MAX_REQUEST_SIZE) -> AsyncIterator[dict]:
+        """
+        :param content: поток тела запроса (request.content)
+        :param max_size: максимальный размер тела
+        :return: AsyncIterator
+
+        Метод, который читает тело частями и отдает элементы массива по одному.
+        Разбор частей выполняется в пуле потоков, чтобы не блокировать event loop
+        """
+
+        loop = asyncio.get_running_loop()
+        size = 0
+
+        async for data in content.iter_chunked(READ_CHUNK_SIZE):
+            size += len(data)
+            if size > max_size:
+                raise HTTPRequestEntityTooLarge(max_size=max_size, actual_size=size)
+
+            for item in await loop.run_in_executor(None, self.feed, data):
+                yield item
+
+        for item in await loop.run_in_executor(None, self.feed, b'', True):
+            yield item
+
+
+__all__ = (
+    'ItemsStreamParser', 'MAX_REQUEST_SIZE', 'MEGABYTE'
+)
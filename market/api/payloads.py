@@ -1,12 +1,20 @@
 import json
 from decimal import Decimal
 from functools import partial, singledispatch
-from typing import Any
+from typing import Any, Callable, Iterable, Sequence
 
-from aiohttp.payload import JsonPayload as BaseJsonPayload, Payload
-from aiohttp.typedefs import JSONEncoder
+from aiohttp.payload import BytesPayload, Payload
 from asyncpg import Record
 
+try:
+    import orjson
+except ImportError:  # быстрый json-бэкенд необязателен (pip install market[fast])
+    orjson = None
+
+# orjson сериализует не больше 254 уровней вложенности, а каждый уровень дерева - это два уровня
+# (объект элемента и список children)
+ORJSON_MAX_TREE_DEPTH = 120
+
 
 @singledispatch
 def convert(value):
@@ -40,47 +48,214 @@ def convert_decimal(value: Decimal):
 dumps = partial(json.dumps, default=convert, ensure_ascii=False)
 
 
-class JsonPayload(BaseJsonPayload):
+def dumps_bytes(value: Any) -> bytes:
+    """
+    Сериализует значение в JSON (utf-8) через orjson, если он установлен,
+    иначе через стандартный json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=convert)
+        except orjson.JSONEncodeError:
+            # orjson не сериализует вложенность глубже 254 уровней
+            pass
+    return dumps(value).encode('utf-8')
+
+
+class JsonPayload(BytesPayload):
     """
     Заменяет функцию сериализации на более "умную" (умеющую упаковывать в JSON
-    объекты asyncpg.Record и другие сущности).
+    объекты asyncpg.Record и другие сущности) и по возможности быструю (orjson).
     """
 
     def __init__(self, value: Any, encoding: str = 'utf-8',
-                 content_type: str = 'application/json', dumps: JSONEncoder = dumps,
-                 *args: Any, **kwargs: Any) -> None:
-        super().__init__(value, encoding, content_type, dumps, *args, **kwargs)
+                 content_type: str = 'application/json', *args: Any, **kwargs: Any) -> None:
+        super().__init__(dumps_bytes(value), content_type=content_type, encoding=encoding, *args, **kwargs)
 
 
 class AsyncGenJSONListPayload(Payload):
     """
     Итерируется по объектам AsyncIterable, частями сериализует данные из них
     в JSON и отправляет клиенту.
+    Если root_object = None, отправляется JSON-список без объекта-обертки.
+    head - остальные ключи объекта-обертки (пишутся перед списком),
+    tail(последний элемент списка или None) - ключи, которые пишутся после списка
     """
 
     def __init__(self, value, encoding: str = 'utf-8', content_type: str = 'application/json',
-                 root_object: str = 'data', *args, **kwargs):
+                 root_object: str | None = 'data', buffer_size: int = 64 * 1024,
+                 head: dict | None = None, tail: Callable[[Any], dict] | None = None, *args, **kwargs):
         self.root_object = root_object
+        self.buffer_size = buffer_size
+        self.head = head
+        self.tail = tail
         super().__init__(value, content_type=content_type, encoding=encoding, *args, **kwargs)
 
+    def decode(self, encoding: str = 'utf-8', errors: str = 'strict') -> str:
+        raise TypeError('Streamed payload can not be decoded')
+
+    @staticmethod
+    def object_keys(value: dict | None) -> bytes:
+        """
+        :return: ключи объекта в JSON без фигурных скобок (с запятой в конце, если ключи есть)
+        """
+
+        return dumps_bytes(value)[1:-1] + b',' if value else b''
+
     async def write(self, writer):
         # Начало объекта
-        await writer.write(('{"%s":[' % self.root_object).encode(self._encoding))
+        if self.root_object is None:
+            buffer = bytearray(b'[')
+        else:
+            buffer = bytearray(b'{' + self.object_keys(self.head) + dumps_bytes(self.root_object) + b':[')
 
-        first = True
-        async for row in self._value:
-            # Перед первой строчкой запятая не нужнаа
-            if not first:
-                await writer.write(b',')
-            else:
-                first = False
+        last = None
+        try:
+            first = True
+            async for row in self._value:
+                # Перед первой строчкой запятая не нужна
+                if not first:
+                    buffer += b','
+                else:
+                    first = False
 
-            await writer.write(dumps(row).encode(self._encoding))
+                buffer += dumps_bytes(row)
+                last = row
+                if len(buffer) >= self.buffer_size:
+                    await writer.write(bytes(buffer))
+                    buffer.clear()
+        finally:
+            # если клиент отключился, курсор и соединение освобождаются сразу
+            aclose = getattr(self._value, 'aclose', None)
+            if aclose is not None:
+                await aclose()
 
         # Конец объекта
-        await writer.write(b']}')
+        if self.root_object is None:
+            buffer += b']'
+        else:
+            buffer += b'],' + self.object_keys(self.tail(last) if self.tail else None)
+            buffer[-1:] = b'}'
+        await writer.write(bytes(buffer))
+
+
+class JSONTreeWriter:
+    """
+    Собирает вложенное JSON-дерево из элементов, которые приходят парами
+    (глубина, элемент без children) в порядке обхода в глубину, глубина корня - 0.
+    Каждый элемент сериализуется сразу, в памяти держится только буфер
+    и путь от корня до текущего элемента
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # для каждого элемента пути: начат ли уже его список children
+        self.has_children: list[bool] = []
+        self.empty = True
+
+    def add(self, depth: int, node: dict) -> None:
+        has_children = self.has_children
+
+        # закрываем элементы, поддеревья которых закончились
+        while len(has_children) > depth:
+            self.buffer += b']}' if has_children.pop() else b'null}'
+
+        if has_children:
+            self.buffer += b',' if has_children[-1] else b'['
+            has_children[-1] = True
+
+        # children дописывается последним ключом (вместо закрывающей скобки), его значение - следующие элементы
+        self.buffer += dumps_bytes(node)
+        self.buffer[-1:] = b',"children":'
+        has_children.append(False)
+        self.empty = False
+
+    def close(self) -> None:
+        if self.empty:
+            self.buffer += b'null'
+        while self.has_children:
+            self.buffer += b']}' if self.has_children.pop() else b'null}'
+
+    def flush(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def nest_tree(rows: Iterable[tuple[int, dict]]) -> dict:
+    """
+    :param rows: элементы дерева (глубина, элемент) в порядке обхода в глубину
+    :return: корневой элемент, дочерние элементы - в 'children' (None, если их нет)
+
+    Функция, собирающая дерево за O(n) без рекурсии и без индекса по id:
+    родитель каждого элемента - последний элемент на глубину выше
+    """
+
+    path = []
+    for depth, node in rows:
+        node['children'] = None
+        del path[depth:]
+        if path:
+            parent = path[-1]
+            if parent['children'] is None:
+                parent['children'] = []
+            parent['children'].append(node)
+        path.append(node)
+    return path[0]
+
+
+def dumps_tree(rows: Sequence[tuple[int, dict]]) -> bytes:
+    """
+    :param rows: элементы дерева (глубина, элемент) в порядке обхода в глубину
+    :return: вложенное JSON-дерево (utf-8)
+
+    Неглубокое дерево собирается в словари и сериализуется orjson одним вызовом (так быстрее),
+    остальные пишутся по элементу через JSONTreeWriter (глубина не ограничена рекурсией)
+    """
+
+    if orjson is not None and rows and max(depth for depth, _ in rows) < ORJSON_MAX_TREE_DEPTH:
+        return dumps_bytes(nest_tree(rows))
+
+    writer = JSONTreeWriter()
+    for depth, node in rows:
+        writer.add(depth, node)
+    writer.close()
+    return writer.flush()
+
+
+class AsyncGenJSONTreePayload(Payload):
+    """
+    Пишет клиенту вложенное JSON-дерево по частям (см. JSONTreeWriter),
+    элементы приходят из AsyncIterable
+    """
+
+    def __init__(self, value, encoding: str = 'utf-8', content_type: str = 'application/json',
+                 buffer_size: int = 64 * 1024, *args, **kwargs):
+        self.buffer_size = buffer_size
+        super().__init__(value, content_type=content_type, encoding=encoding, *args, **kwargs)
+
+    def decode(self, encoding: str = 'utf-8', errors: str = 'strict') -> str:
+        raise TypeError('Streamed payload can not be decoded')
+
+    async def write(self, writer):
+        tree = JSONTreeWriter()
+
+        try:
+            async for depth, node in self._value:
+                tree.add(depth, node)
+                if len(tree.buffer) >= self.buffer_size:
+                    await writer.write(tree.flush())
+        finally:
+            # если клиент отключился, курсор и соединение освобождаются сразу
+            aclose = getattr(self._value, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+        tree.close()
+        await writer.write(tree.flush())
 
 
 __all__ = (
-    'JsonPayload', 'AsyncGenJSONListPayload'
+    'JsonPayload', 'AsyncGenJSONListPayload', 'AsyncGenJSONTreePayload', 'JSONTreeWriter',
+    'dumps', 'dumps_bytes', 'dumps_tree', 'nest_tree'
 )
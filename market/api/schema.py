@@ -1,5 +1,5 @@
 from marshmallow import Schema, validates_schema, ValidationError
-from marshmallow.fields import Dict, Int, Nested, Str
+from marshmallow.fields import Dict, Int, List, Nested, Str
 from marshmallow.validate import Length
 
 from market.api.validators import validate_all_items
@@ -32,6 +32,16 @@ class ImportSchema(Schema):
             shop_unit_ids.add(shop_unit['shop_unit_id'])
 
 
+class NodesBatchSchema(Schema):
+    ids = List(Str(validate=Length(min=1, max=256)), required=True, validate=Length(min=1, max=1000))
+
+
+class StatisticBatchSchema(Schema):
+    ids = List(Str(validate=Length(min=1, max=256)), required=True, validate=Length(min=1, max=1000))
+    dateStart = Str(required=True)
+    dateEnd = Str(required=True)
+
+
 class ErrorSchema(Schema):
     code = Str(required=True)
     message = Str(required=True)
@@ -1,14 +1,11 @@
-import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import AsyncIterator, Generator, Iterable, Mapping
 
 from aiohttp.web_exceptions import HTTPNotFound
-from aiomisc import chunk_list
-from asyncpg import Record
 from asyncpgsa import PG
-from sqlalchemy.dialects.postgresql import insert
 
-from market.db.schema import history_table
-from market.utils.pg import MAX_QUERY_ARGS
+from market.utils.statements import StatementRegistry
 
 ''' 
 Пишу ручками некоторые запросы т.к. 
@@ -17,275 +14,928 @@ from market.utils.pg import MAX_QUERY_ARGS
 3) либо это рекурсивный запрос, который легче написать ручками
 '''
 
+# поля shop_units, которые отдаются клиенту (без агрегатов поддерева)
+SHOP_UNIT_FIELDS = ('shop_unit_id', 'name', 'date', 'parent_id', 'type', 'price')
+
 SQL_REQUESTS = {
     'get_by_ides': '''
-        SELECT shop_units.shop_unit_id, shop_units.name, shop_units.date, shop_units.parent_id, shop_units.type, shop_units.price 
+        SELECT shop_units.shop_unit_id, shop_units.name, shop_units.date, shop_units.parent_id, shop_units.type, shop_units.price, 
+            shop_units.sum_price, shop_units.offer_count
         FROM shop_units 
-        WHERE shop_units.shop_unit_id IN {}''',
+        WHERE shop_units.shop_unit_id = ANY($1::text[])''',
     'delete_by_ides': '''
-    DELETE FROM public.history WHERE shop_unit_id IN {};
-    DELETE FROM public.shop_units WHERE shop_unit_id IN {};
-    DELETE FROM public.relations WHERE children_id IN {} OR relation_id IN {};''',
+    WITH deleted_history AS (
+        DELETE FROM history WHERE shop_unit_id = ANY($1::text[])
+    ), deleted_relations AS (
+        DELETE FROM relations WHERE children_id = ANY($1::text[]) OR relation_id = ANY($1::text[])
+    ), deleted_hierarchy AS (
+        DELETE FROM hierarchy WHERE descendant_id = ANY($1::text[])
+    )
+    DELETE FROM shop_units WHERE shop_unit_id = ANY($1::text[])''',
     'get_item_tree': '''
-    WITH RECURSIVE search_tree(relation_id, children_id) AS (
-        SELECT t.relation_id, t.children_id
-        FROM relations t WHERE relation_id = '{}'
-      UNION ALL
-        SELECT t.relation_id, t.children_id
-        FROM relations t, search_tree st
-        WHERE t.relation_id = st.children_id
-    )   
-    SELECT * FROM search_tree;''',
-    'get_parent_brunch': '''
-    WITH RECURSIVE search_tree(relation_id, children_id) AS (
-        SELECT t.relation_id, t.children_id
-        FROM relations t WHERE children_id = '{}'
-      UNION ALL
-        SELECT t.relation_id, t.children_id
-        FROM relations t, search_tree st
-        WHERE t.children_id = st.relation_id
+    SELECT descendant_id FROM hierarchy WHERE ancestor_id = $1''',
+    'get_items_trees': '''
+    SELECT ancestor_id, descendant_id FROM hierarchy WHERE ancestor_id = ANY($1::text[])''',
+    # версия элемента для ETag/Last-Modified (одно чтение по первичному ключу)
+    'get_shop_unit_version': '''
+    SELECT version, modified_at FROM shop_units WHERE shop_unit_id = $1''',
+    # кол-во элементов поддерева (вместе с корнем) по индексу hierarchy, но не больше $2:
+    # для выбора потоковой отдачи достаточно знать, дотягивает ли поддерево до порога
+    'count_subtree_nodes': '''
+    SELECT count(*) FROM (SELECT 1 FROM hierarchy WHERE ancestor_id = $1 LIMIT $2::integer) AS subtree''',
+    # поддерево целиком (рекурсия по индексу parent_id), цены категорий берутся из агрегатов;
+    # строки не упорядочены: сортировка по пути от корня стоит O(глубина²), порядок обхода
+    # восстанавливает order_subtree по parent_id
+    'get_subtree_rows': '''
+    WITH RECURSIVE tree AS (
+        SELECT shop_unit_id, name, date, parent_id, type, price, sum_price, offer_count
+        FROM shop_units WHERE shop_unit_id = $1
+        UNION ALL
+        SELECT t.shop_unit_id, t.name, t.date, t.parent_id, t.type, t.price, t.sum_price, t.offer_count
+        FROM shop_units t JOIN tree ON t.parent_id = tree.shop_unit_id
+    )
+    SELECT * FROM tree''',
+    # поддерево для потоковой отдачи: строки уходят из бд уже в порядке обхода в глубину
+    # (сортировка по пути от корня, дети - по возрастанию id в порядке "C", как в order_subtree).
+    # Сортирует postgres (в пределах work_mem, дальше - во временных файлах), путь стоит O(глубина)
+    # на строку, зато клиенту строки отдаются курсором без накопления в памяти
+    'get_subtree_stream': '''
+    WITH RECURSIVE tree AS (
+        SELECT shop_unit_id, 0 AS depth, ARRAY[shop_unit_id] AS path
+        FROM shop_units WHERE shop_unit_id = $1
+        UNION ALL
+        SELECT t.shop_unit_id, tree.depth + 1, tree.path || t.shop_unit_id
+        FROM shop_units t JOIN tree ON t.parent_id = tree.shop_unit_id
+    )
+    SELECT t.shop_unit_id, t.name, t.date, t.parent_id, t.type, t.price, t.sum_price, t.offer_count, tree.depth
+    FROM tree JOIN shop_units t ON t.shop_unit_id = tree.shop_unit_id
+    ORDER BY tree.path COLLATE "C"''',
+    # поддерево не глубже $2 уровней (NULL - без ограничения), прямые дети корня - страница
+    # из $4 элементов (NULL - все) с id больше $3 (курсор, NULL - первая страница);
+    # рекурсия идет по индексу parent_id и дальше ограничения не читает
+    'get_subtree_page': '''
+    WITH RECURSIVE tree AS (
+        SELECT shop_unit_id, 0 AS depth FROM shop_units WHERE shop_unit_id = $1
+        UNION ALL
+        (SELECT shop_unit_id, 1 FROM shop_units
+        WHERE parent_id = $1 AND ($2::integer IS NULL OR $2 > 0) AND ($3::text IS NULL OR shop_unit_id > $3)
+        ORDER BY shop_unit_id LIMIT $4::integer)
+        UNION ALL
+        SELECT t.shop_unit_id, tree.depth + 1
+        FROM shop_units t JOIN tree ON t.parent_id = tree.shop_unit_id
+        WHERE tree.depth > 0 AND ($2::integer IS NULL OR tree.depth < $2)
     )
-    SELECT * FROM search_tree;''',
+    SELECT t.shop_unit_id, t.name, t.date, t.parent_id, t.type, t.price, t.sum_price, t.offer_count, tree.depth
+    FROM tree JOIN shop_units t ON t.shop_unit_id = tree.shop_unit_id
+    ORDER BY tree.depth, t.shop_unit_id''',
+    # товары, цена которых менялась в окне [$1 - 24ч, $1] (диапазон по индексу last_price_change_at),
+    # страница из $3 товаров (NULL - все) с id больше $2 (курсор, NULL - первая страница)
+    'get_sales': '''
+    SELECT shop_unit_id, name, date, parent_id, type, price FROM shop_units
+    WHERE last_price_change_at >= $1::timestamp - interval '1 day' AND last_price_change_at <= $1::timestamp
+        AND type = 'offer' AND ($2::text IS NULL OR shop_unit_id > $2)
+    ORDER BY shop_unit_id LIMIT $3::integer''',
+    'get_branches_states': '''
+    SELECT DISTINCT t.shop_unit_id, t.parent_id, t.type, t.price, t.sum_price, t.offer_count
+    FROM hierarchy h JOIN shop_units t ON t.shop_unit_id = h.ancestor_id
+    WHERE h.descendant_id = ANY($1::text[])''',
+    'update_aggregates': '''
+    UPDATE shop_units
+    SET sum_price = shop_units.sum_price + d.sum_price, offer_count = shop_units.offer_count + d.offer_count
+    FROM unnest($1::text[], $2::bigint[], $3::integer[]) AS d(shop_unit_id, sum_price, offer_count)
+    WHERE shop_units.shop_unit_id = d.shop_unit_id''',
+    'subtract_from_branch': '''
+    WITH deleted AS (
+        SELECT t.sum_price, t.offer_count FROM shop_units t WHERE shop_unit_id = $1
+    )
+    UPDATE shop_units
+    SET sum_price = shop_units.sum_price - d.sum_price, offer_count = shop_units.offer_count - d.offer_count,
+        version = nextval('shop_units_version_seq'), modified_at = now() AT TIME ZONE 'utc'
+    FROM deleted d
+    WHERE shop_units.shop_unit_id IN (SELECT ancestor_id FROM hierarchy WHERE descendant_id = $1 AND depth > 0)
+    RETURNING shop_units.shop_unit_id''',
+    'delete_relations': '''
+    DELETE FROM relations WHERE children_id = ANY($1::text[])''',
+    'insert_hierarchy_nodes': '''
+    INSERT INTO hierarchy (ancestor_id, descendant_id, depth)
+    SELECT shop_unit_id, shop_unit_id, 0 FROM unnest($1::text[]) AS t(shop_unit_id)
+    ON CONFLICT (ancestor_id, descendant_id) DO NOTHING''',
+    'detach_hierarchy': '''
+    DELETE FROM hierarchy h
+    USING hierarchy sub, hierarchy sup
+    WHERE sub.ancestor_id = ANY($1::text[]) AND sup.descendant_id = sub.ancestor_id AND sup.depth > 0
+        AND h.ancestor_id = sup.ancestor_id AND h.descendant_id = sub.descendant_id''',
+    'attach_hierarchy': '''
+    INSERT INTO hierarchy (ancestor_id, descendant_id, depth)
+    SELECT sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1
+    FROM unnest($1::text[], $2::text[]) AS m(shop_unit_id, parent_id)
+    JOIN hierarchy sup ON sup.descendant_id = m.parent_id
+    JOIN hierarchy sub ON sub.ancestor_id = m.shop_unit_id
+    ON CONFLICT (ancestor_id, descendant_id) DO NOTHING''',
+    # товарам с изменившейся ценой ($3) дата выгрузки проставляется и как дата изменения цены,
+    # но только вперед: выгрузка задним числом не сдвигает окно /sales назад (greatest пропускает NULL)
     'update_date': '''
     UPDATE shop_units 
-    SET date = '{}'
-    WHERE shop_units.shop_unit_id IN {}''',
+    SET date = $1, version = nextval('shop_units_version_seq'), modified_at = now() AT TIME ZONE 'utc',
+        last_price_change_at = CASE
+            WHEN shop_unit_id = ANY($3::text[]) THEN greatest(last_price_change_at, $1) ELSE last_price_change_at
+        END
+    WHERE shop_units.shop_unit_id = ANY($2::text[])''',
+    'touch_shop_units': '''
+    UPDATE shop_units SET version = nextval('shop_units_version_seq'), modified_at = now() AT TIME ZONE 'utc'
+    WHERE shop_unit_id = ANY($1::text[])''',
+    'create_shop_units_staging': '''
+    CREATE TEMPORARY TABLE IF NOT EXISTS shop_units_staging (LIKE shop_units INCLUDING DEFAULTS) ON COMMIT DROP;
+    TRUNCATE shop_units_staging''',
+    'merge_shop_units': '''
+    INSERT INTO shop_units (shop_unit_id, name, date, parent_id, type, price)
+    SELECT shop_unit_id, name, date, parent_id, type, price FROM shop_units_staging
+    ON CONFLICT (shop_unit_id) DO UPDATE
+    SET name = excluded.name, date = excluded.date, parent_id = excluded.parent_id,
+        type = excluded.type, price = excluded.price''',
+    'merge_relations': '''
+    INSERT INTO relations (relation_id, children_id)
+    SELECT parent_id, shop_unit_id FROM shop_units_staging WHERE parent_id IS NOT NULL
+    ON CONFLICT (relation_id, children_id) DO NOTHING''',
+    'insert_import_job_items': '''
+    INSERT INTO import_job_items (job_id, position, item)
+    SELECT $1, position, item::jsonb FROM unnest($2::integer[], $3::text[]) AS t(position, item)''',
+    'create_import_job': '''
+    INSERT INTO import_jobs (job_id, status, update_date, items_total, created_at)
+    VALUES ($1, 'queued', $2, $3, timezone('utc', now()))''',
+    'get_import_job': '''
+    SELECT job_id, status, update_date, items_total, items_done, error, created_at, started_at, finished_at
+    FROM import_jobs WHERE job_id = $1''',
+    'get_import_job_items': '''
+    SELECT item FROM import_job_items
+    WHERE job_id = $1 AND position >= $2 AND position < $3
+    ORDER BY position''',
+    # ожидающие задачи и выполняющиеся задачи без владельца: владелец держит блокировку lock_import_job
+    # до конца своей транзакции, так что свободная блокировка значит, что его процесс остановлен
+    'get_unfinished_import_jobs': '''
+    WITH orphaned AS (
+        UPDATE import_jobs SET status = 'queued', items_done = 0, started_at = NULL
+        WHERE status = 'running' AND pg_try_advisory_xact_lock(hashtext('import_job:' || job_id))
+        RETURNING job_id, created_at
+    )
+    SELECT job_id, created_at FROM import_jobs WHERE status = 'queued'
+    UNION ALL
+    SELECT job_id, created_at FROM orphaned
+    ORDER BY created_at''',
+    'lock_import_job': '''
+    SELECT pg_advisory_xact_lock(hashtext('import_job:' || $1))''',
+    # задачу получает только один обработчик (из всех процессов)
+    'start_import_job': '''
+    UPDATE import_jobs SET status = 'running', started_at = timezone('utc', now())
+    WHERE job_id = $1 AND status = 'queued'
+    RETURNING update_date, items_total''',
+    'update_import_job_progress': '''
+    UPDATE import_jobs SET items_done = $2 WHERE job_id = $1''',
+    'finish_import_job': '''
+    UPDATE import_jobs SET status = $2, error = $3, finished_at = timezone('utc', now()) WHERE job_id = $1''',
+    'delete_import_job_items': '''
+    DELETE FROM import_job_items WHERE job_id = $1''',
+    # история элемента за [$2, $3] (по уникальному индексу (shop_unit_id, update_date), уже по порядку)
+    'get_history': '''
+    SELECT update_date, price FROM history
+    WHERE shop_unit_id = $1 AND update_date >= $2::timestamp AND update_date <= $3::timestamp
+    ORDER BY update_date''',
+    # элементы для истории нескольких элементов (с версией для кэша ленивой истории категорий)
+    'get_statistic_units': '''
+    SELECT shop_unit_id, name, parent_id, type, price, version FROM shop_units WHERE shop_unit_id = ANY($1::text[])''',
+    # история нескольких элементов за [$2, $3] одним запросом, по элементам и датам
+    'get_histories': '''
+    SELECT shop_unit_id, update_date, price FROM history
+    WHERE shop_unit_id = ANY($1::text[]) AND update_date >= $2::timestamp AND update_date <= $3::timestamp
+    ORDER BY shop_unit_id, update_date''',
+    # та же история, прореженная до одной точки на интервал $4 (hour, day, week):
+    # начало интервала, последняя цена в нем, минимум, максимум, среднее и кол-во записей
+    'get_history_buckets': '''
+    SELECT date_trunc($4::text, update_date) AS bucket,
+        (array_agg(price ORDER BY update_date DESC))[1] AS last, min(price) AS min, max(price) AS max,
+        round(avg(price), 2) AS avg, count(*) AS count
+    FROM history
+    WHERE shop_unit_id = $1 AND update_date >= $2::timestamp AND update_date <= $3::timestamp
+    GROUP BY bucket
+    ORDER BY bucket''',
+    # ленивая история категорий (--history-mode lazy): последняя цена каждого товара поддерева $1
+    # строго до $2 (по уникальному индексу истории) и изменения цен товаров поддерева за [$2, $3] по порядку
+    'get_subtree_offers_prices': '''
+    SELECT d.descendant_id AS shop_unit_id, last.price
+    FROM hierarchy d
+    JOIN shop_units t ON t.shop_unit_id = d.descendant_id AND t.type = 'offer'
+    JOIN LATERAL (
+        SELECT h.price FROM history h
+        WHERE h.shop_unit_id = d.descendant_id AND h.update_date < $2::timestamp
+        ORDER BY h.update_date DESC LIMIT 1
+    ) last ON true
+    WHERE d.ancestor_id = $1''',
+    'get_subtree_offers_events': '''
+    SELECT h.shop_unit_id, h.update_date, h.price
+    FROM hierarchy d
+    JOIN shop_units t ON t.shop_unit_id = d.descendant_id AND t.type = 'offer'
+    JOIN history h ON h.shop_unit_id = d.descendant_id
+    WHERE d.ancestor_id = $1 AND h.update_date >= $2::timestamp AND h.update_date <= $3::timestamp
+    ORDER BY h.update_date''',
+    'ensure_history_partition': '''
+    SELECT ensure_history_partition($1::timestamp)''',
+    # целочисленное деление postgres для неотрицательных цен совпадает с get_price (//);
+    # запись добавляется, только если цена отличается от предыдущей записи (строго раньше $2), так что
+    # выгрузка задним числом сравнивается с ценой на свою дату, а не с последней известной.
+    # Записи, которые после этого перестают быть изменениями цены, удаляются: запись на $2, совпавшая
+    # с предыдущей, и следующая после $2, совпавшая с новой ценой
+    # (соседние записи - по уникальному индексу (shop_unit_id, update_date))
+    'insert_history': '''
+    WITH candidates AS (
+        SELECT t.shop_unit_id, t.sum_price / t.offer_count AS price, prev.price AS prev_price,
+            next.update_date AS next_date, next.price AS next_price
+        FROM shop_units t
+        LEFT JOIN LATERAL (
+            SELECT h.price FROM history h
+            WHERE h.shop_unit_id = t.shop_unit_id AND h.update_date < $2::timestamp
+            ORDER BY h.update_date DESC LIMIT 1
+        ) prev ON true
+        LEFT JOIN LATERAL (
+            SELECT h.update_date, h.price FROM history h
+            WHERE h.shop_unit_id = t.shop_unit_id AND h.update_date > $2::timestamp
+            ORDER BY h.update_date LIMIT 1
+        ) next ON true
+        WHERE t.shop_unit_id = ANY($1::text[]) AND t.offer_count > 0
+    ), inserted AS (
+        INSERT INTO history (shop_unit_id, update_date, price)
+        SELECT shop_unit_id, $2::timestamp, price FROM candidates WHERE prev_price IS DISTINCT FROM price
+        ON CONFLICT (shop_unit_id, update_date) DO UPDATE SET price = excluded.price
+        WHERE history.price <> excluded.price
+        RETURNING 1
+    ), redundant AS (
+        DELETE FROM history h USING candidates c
+        WHERE h.shop_unit_id = c.shop_unit_id AND (
+            h.update_date = $2::timestamp AND c.prev_price = c.price
+            OR h.update_date = c.next_date AND c.next_price = c.price
+        )
+    )
+    SELECT (SELECT count(*) FROM candidates) AS candidates, (SELECT count(*) FROM inserted) AS inserted''',
 }
 
+STATEMENTS = StatementRegistry(SQL_REQUESTS)
 
-async def get_item_tree(root_id, pg: PG) -> tuple[set[str], list[Record]] | tuple[None, None]:
+# кол-во строк, забираемых из серверного курсора за раз (потоковые ответы)
+STREAM_PREFETCH = 1000
+
+# интервалы прореживания истории (значения date_trunc)
+HISTORY_BUCKETS = ('hour', 'day', 'week')
+
+# как пишется история: snapshot - каждому элементу ветки при импорте,
+# lazy - только товарам, история категории собирается из истории ее товаров при чтении
+HISTORY_MODES = ('snapshot', 'lazy')
+
+
+async def get_item_tree(root_id, pg: PG) -> set[str] | None:
     """
     :param root_id: id корневого элемента дерева
     :param pg: PG объект коннекта к базе данных
-    :return:
+    :return: id всех элементов поддерева (включая корневой), либо None, если элемента нет
+
+    Функция, возвращающая поддерево элемента одним запросом к closure-таблице hierarchy
     """
 
-    sql_request = SQL_REQUESTS['get_item_tree'].format(root_id)
+    records = await STATEMENTS.fetch(pg, 'get_item_tree', root_id)
+
+    if not records:
+        return None
 
-    ides = await pg.fetch(sql_request)
+    return {record.get('descendant_id') for record in records}
 
-    if not ides:
-        return None, None
 
-    ides_to_req = {root_id}
+def link_nodes(nodes: dict[str, dict]) -> None:
+    """
+    :param nodes: словарь id: элемент в виде ответа (см. shop_unit_to_answer)
+    :return: None
+
+    Функция, которая за O(n) без рекурсии прикрепляет каждый элемент к его родителю
+    (в 'children', None - если детей нет), если родитель есть в nodes.
+    Словарь nodes служит индексом по id
+    """
 
-    for record in ides:
-        ides_to_req.update(record.values())
+    for node in nodes.values():
+        node['children'] = None
 
-    return ides_to_req, ides
+    for node in nodes.values():
+        parent = nodes.get(node['parentId'])
+        if parent is None:
+            continue
+        if parent['children'] is None:
+            parent['children'] = []
+        parent['children'].append(node)
 
 
-async def build_tree_json(ans: dict, data: list[Record], records: dict[str: dict]) -> None:
+def build_tree(root_id: str, nodes: dict[str, dict]) -> dict:
     """
-    :param ans: Словарь-ответ
-    :param data: список рекордов для построения дерева (таблица связей)
-    :param records: словарь id: record для удобства
-    :return: None
+    :param root_id: id корневого элемента
+    :param nodes: словарь id: элемент поддерева в виде ответа (см. shop_unit_to_answer)
+    :return: корневой элемент, дочерние элементы - в 'children' (None, если их нет)
 
-    Функция построения базового дерева ответа
+    Функция построения дерева ответа (родителя корня в nodes нет, см. link_nodes)
     """
 
-    while data:
+    link_nodes(nodes)
+    return nodes[root_id]
 
-        # костыль во избежание зацикливания
-        # если среди дочерних элементов текущего нет не одного из data
-        # мы прерываем цикл
-        any_children_in_data = True
 
-        for index, record in enumerate(data):
-            parent_id, children_id = record.get('relation_id'), record.get('children_id')
-            if parent_id != ans['shop_unit_id']:
-                continue
+def order_subtree(root_id: str, records: Iterable[Mapping]) -> list[tuple[int, Mapping]]:
+    """
+    :param root_id: id корневого элемента
+    :param records: строки поддерева (с shop_unit_id и parent_id) в любом порядке
+    :return: строки парами (глубина, строка) в порядке обхода в глубину, дети - по возрастанию id
+    (пустой список, если корня среди строк нет)
+
+    Функция без рекурсии и без копирования пути от корня: O(n) на обход и сортировка детей каждого элемента
+    """
 
-            any_children_in_data = False
-            data.pop(index)
+    children = {}
+    root = None
+    for record in records:
+        if record['shop_unit_id'] == root_id:
+            root = record
+        else:
+            children.setdefault(record['parent_id'], []).append(record)
 
-            if ans.get('children') is None:
-                ans['children'] = []
-            ans['children'].append(records[children_id])
+    if root is None:
+        return []
 
-            await build_tree_json(ans['children'][-1], data, records)
+    key = itemgetter('shop_unit_id')
+    rows, stack = [], [(0, root)]
+    while stack:
+        depth, record = stack.pop()
+        rows.append((depth, record))
 
-        if any_children_in_data:
-            break
+        nodes = children.get(record['shop_unit_id'])
+        if nodes:
+            # со стека дети снимаются в обратном порядке, т.е. по возрастанию id
+            nodes.sort(key=key, reverse=True)
+            stack.extend([(depth + 1, child) for child in nodes])
+    return rows
 
 
-async def get_total_price(tree: dict) -> tuple[int, int] | None:
+def get_price(sum_price: int, offer_count: int) -> int | None:
     """
-    :param tree: дерево элементов
-    :return: либо цену и кол-во дочерних элементов (для рекурсии), либо None
+    :param sum_price: сумма цен товаров поддерева
+    :param offer_count: кол-во товаров поддерева
+    :return: цена элемента, либо None, если товаров в поддереве нет
 
-    Функция, считающая и добавляющая цены категории
+    Функция, считающая цену элемента по агрегатам его поддерева
     """
 
-    price = tree.get('price') or 0
-    count = 0
+    return sum_price // offer_count if offer_count else None
 
-    if tree.get('children'):
-        for item in tree['children']:
-            if item.get('children'):
 
-                local_price, local_count = await get_total_price(item)
-                item['price'] = local_price // local_count
-                price += local_price
-                count += local_count
-            else:
-                item['children'] = None
-                price += 0 if item.get('price') is None else item.get('price')
-                count += 1
-            item['date'] = datetime_to_str(item['date'])
-        tree['price'] = price // count
-    else:
-        tree['date'] = datetime_to_str(tree['date'])
-        tree['children'] = None
-    return price, count or 1
+def shop_unit_to_answer(record: Mapping, with_date: bool = True) -> dict:
+    """
+    :param record: строка таблицы shop_units (Record или dict)
+    :param with_date: добавлять ли дату обновления
+    :return: элемент в виде ответа API
+
+    Функция, которая за один проход переводит строку бд в элемент ответа: имена полей API,
+    тип заглавными буквами, дата строкой. Если в строке есть агрегаты поддерева,
+    цена считается по ним (см. get_price)
+    """
+
+    offer_count = record.get('offer_count')
+    answer = {
+        'id': record['shop_unit_id'],
+        'name': record['name'],
+        'parentId': record['parent_id'],
+        'type': record['type'].upper(),
+        'price': record['price'] if offer_count is None else get_price(record['sum_price'], offer_count),
+    }
+    if with_date:
+        answer['date'] = datetime_to_str(record['date'])
+    return answer
 
 
-async def edit_json_to_answer(data: dict | list) -> dict:
+async def get_obj_tree_by_id(shop_unit_id: str, pg: PG) -> list[tuple[int, dict]]:
     """
-    :param data: данные для запросов
-    :return: данные, подготовленные для отправки
+    :param shop_unit_id: id элемента, для которого надо создать дерево
+    :param pg: PG объект коннекта к базе данных
+    :return: элементы поддерева парами (глубина, элемент без children) в порядке обхода в глубину
 
-    Функция изменения данных для ответа
+    Функция, читающая поддерево одним рекурсивным запросом (цены категорий - из агрегатов),
+    порядок обхода восстанавливает order_subtree, дерево из строк собирает dumps_tree
     """
-    return json.loads(
-        json.dumps(data, ensure_ascii=False).replace('category', 'CATEGORY').replace('offer', 'OFFER')
-        .replace('shop_unit_id', 'id').replace('parent_id', 'parentId')
-    )
 
+    rows = order_subtree(shop_unit_id, await STATEMENTS.fetch(pg, 'get_subtree_rows', shop_unit_id))
+    if not rows:
+        raise HTTPNotFound()
+
+    return [(depth, shop_unit_to_answer(record)) for depth, record in rows]
 
-async def get_obj_tree_by_id(shop_unit_id: str, pg: PG) -> dict:
+
+async def get_obj_trees_by_ides(ides: list[str], pg: PG) -> dict[str, list[tuple[int, dict]] | None]:
     """
-    :param shop_unit_id: id элемента, для которого надо создать дерево
+    :param ides: id элементов, для которых надо создать деревья
     :param pg: PG объект коннекта к базе данных
-    :return: json, готовый к отправке на клиент
+    :return: словарь id: элементы дерева парами (глубина, элемент без children) в порядке обхода
+    в глубину, как у get_obj_tree_by_id (None, если элемента нет)
+
+    Функция, возвращающая несколько деревьев за два запроса независимо от их кол-ва:
+    поддеревья всех элементов - одним запросом к hierarchy, строки - одним get_by_ides.
+    Общие элементы поддеревьев (один элемент внутри другого) читаются один раз
+    """
+
+    subtrees = {}
+    for record in await STATEMENTS.fetch(pg, 'get_items_trees', list(ides)):
+        subtrees.setdefault(record['ancestor_id'], []).append(record['descendant_id'])
+
+    records = {}
+    if subtrees:
+        descendants = {descendant_id for subtree in subtrees.values() for descendant_id in subtree}
+        records = {
+            record['shop_unit_id']: record
+            for record in await STATEMENTS.fetch(pg, 'get_by_ides', list(descendants))
+        }
+
+    trees = {}
+    for shop_unit_id in ides:
+        rows = order_subtree(shop_unit_id, [
+            records[descendant_id] for descendant_id in subtrees.get(shop_unit_id, ()) if descendant_id in records
+        ])
+        # элементы каждого дерева - свои (dumps_tree может дописать им children)
+        trees[shop_unit_id] = [(depth, shop_unit_to_answer(record)) for depth, record in rows] or None
+    return trees
 
-    Функция, возвращающая json, готовый к отправке на клиент
+
+async def get_obj_tree_page(shop_unit_id: str, pg: PG, depth: int | None = None,
+                            children_limit: int | None = None, cursor: str | None = None) -> list[tuple[int, dict]]:
+    """
+    :param shop_unit_id: id корневого элемента дерева
+    :param pg: PG объект коннекта к базе данных
+    :param depth: кол-во уровней под корнем (None - все)
+    :param children_limit: кол-во прямых детей корня на странице (None - все)
+    :param cursor: id последнего прямого ребенка предыдущей страницы
+    :return: элементы части дерева парами (глубина, элемент без children) в порядке обхода в глубину,
+    у корня - nextCursor, если задан children_limit (дерево из строк собирает dumps_tree)
+
+    Функция, возвращающая часть дерева одним запросом: элементы глубже depth не читаются,
+    у обрезанных категорий children = None, цена по-прежнему считается по всему поддереву
     """
 
-    ides_to_req, ides = await get_item_tree(shop_unit_id, pg)
-    if not ides_to_req:
+    records = await STATEMENTS.fetch(pg, 'get_subtree_page', shop_unit_id, depth, cursor, children_limit)
+    rows = [(row_depth, shop_unit_to_answer(record)) for row_depth, record in order_subtree(shop_unit_id, records)]
+    if not rows:
         raise HTTPNotFound()
 
-    sql_request = SQL_REQUESTS['get_by_ides'].format(tuple(ides_to_req)).replace(',)', ')')
-    records = await pg.fetch(sql_request)
-    records = {record.get('shop_unit_id'): dict(record) for record in records}
-    ans = records.get(shop_unit_id)
-    ans['date'] = datetime_to_str(ans['date'])
+    if children_limit is not None:
+        # полная страница - возможно, есть следующая (последняя страница может оказаться пустой)
+        page = [record['shop_unit_id'] for record in records if record['depth'] == 1]
+        rows[0][1]['nextCursor'] = page[-1] if len(page) == children_limit else None
 
-    await build_tree_json(ans, ides, records)
-    await get_total_price(ans)
+    return rows
 
-    return await edit_json_to_answer(ans)
 
+async def iter_obj_tree_by_id(shop_unit_id: str, pg: PG,
+                              prefetch: int = STREAM_PREFETCH) -> AsyncIterator[tuple[int, dict]]:
+    """
+    :param shop_unit_id: id корневого элемента дерева
+    :param pg: PG объект коннекта к базе данных
+    :param prefetch: кол-во строк, забираемых из курсора за раз
+    :return: AsyncIterator пар (глубина, элемент без children) в порядке обхода в глубину
 
-async def get_history(obj_tree: dict, update_date: datetime, ides: list, data: dict):
+    Функция, читающая поддерево серверным курсором (get_subtree_stream): строки приходят
+    уже упорядоченными, в памяти держится не больше prefetch строк независимо от размера поддерева.
+    Курсор - один запрос (один снимок), но живет внутри транзакции, поэтому соединение занято,
+    пока ответ пишется клиенту
     """
-    :param obj_tree: дерево элементов, для которых необходимо получить историю
-    :param update_date: время обновления
-    :param ides: список айдишников для запроса
-    :param data: словарь историй
-    :return: None
 
-    Функция, которая рекурсивно собирает историю
+    async with pg.transaction(readonly=True) as conn:
+        async for record in STATEMENTS.cursor(conn, 'get_subtree_stream', shop_unit_id, prefetch=prefetch):
+            yield record['depth'], shop_unit_to_answer(record)
+
+
+async def iter_sales(date: datetime, pg: PG, after: str | None = None, limit: int | None = None,
+                     prefetch: int = STREAM_PREFETCH) -> AsyncIterator[dict]:
     """
+    :param date: конец 24-часового окна
+    :param pg: PG объект коннекта к базе данных
+    :param after: id последнего товара предыдущей страницы
+    :param limit: кол-во товаров на странице (None - все)
+    :param prefetch: кол-во строк, забираемых из курсора за раз
+    :return: AsyncIterator товаров, цена которых менялась в окне, по возрастанию id
 
-    record = ides.pop(0)
-    parent_id, children_id = record.get('relation_id'), record.get('children_id')
-    data[parent_id] = {
-        'price': obj_tree['price'],
-        'date': update_date
-    }
+    Функция, читающая товары со скидкой серверным курсором (память не зависит от их кол-ва)
+    """
 
-    for children in obj_tree['children']:
-        if children.get('id') != children_id:
-            continue
-        if not ides:
-            data[children_id] = {
-                'price': children['price'],
-                'date': update_date
-            }
-        else:
-            await get_history(children, update_date, ides, data)
+    async with pg.transaction(readonly=True) as conn:
+        async for record in STATEMENTS.cursor(conn, 'get_sales', date, after, limit, prefetch=prefetch):
+            yield shop_unit_to_answer(record)
 
 
-async def get_parent_brunch_ides(children_id: str, pg: PG) -> list[Record]:
+def history_to_answer(record: Mapping) -> dict:
     """
-    :param children_id: id дочернего элемента в ветке
+    :param record: строка истории (get_history)
+    :return: запись истории в виде ответа API
+    """
+
+    return {'update_date': datetime_to_str(record['update_date']), 'price': record['price']}
+
+
+def history_bucket_to_answer(record: Mapping) -> dict:
+    """
+    :param record: интервал истории (get_history_buckets)
+    :return: запись истории в виде ответа API: начало интервала, последняя цена в нем и его статистика
+    """
+
+    return {
+        'update_date': datetime_to_str(record['bucket']), 'price': record['last'],
+        'min': record['min'], 'max': record['max'], 'avg': record['avg'], 'count': record['count'],
+    }
+
+
+async def iter_histories(ides: list[str], date_start: datetime, date_end: datetime, pg: PG,
+                         prefetch: int = STREAM_PREFETCH) -> AsyncIterator[tuple[str, list[dict]]]:
+    """
+    :param ides: id элементов
+    :param date_start: начало периода (включительно)
+    :param date_end: конец периода (включительно)
     :param pg: PG объект коннекта к базе данных
-    :return: список рекордов
+    :param prefetch: кол-во строк, забираемых из курсора за раз
+    :return: AsyncIterator пар (id, записи истории элемента по возрастанию даты),
+    элементы без истории в периоде не возвращаются
 
-    Функция, возвращающая объекты из всей родительской ветки
+    Функция, читающая историю нескольких элементов одним запросом серверным курсором:
+    строки идут по элементам, поэтому в памяти держится история только одного элемента
     """
 
-    return await pg.fetch(SQL_REQUESTS['get_parent_brunch'].format(children_id))
+    async with pg.transaction(readonly=True) as conn:
+        shop_unit_id, stats = None, []
+        async for record in STATEMENTS.cursor(conn, 'get_histories', ides, date_start, date_end, prefetch=prefetch):
+            if record['shop_unit_id'] != shop_unit_id:
+                if shop_unit_id is not None:
+                    yield shop_unit_id, stats
+                shop_unit_id, stats = record['shop_unit_id'], []
+            stats.append(history_to_answer(record))
+
+        if shop_unit_id is not None:
+            yield shop_unit_id, stats
 
 
-def get_history_table_chunk(prices: dict) -> None:
+def truncate_date(date: datetime, bucket: str) -> datetime:
     """
-    :param prices: Словарь со входными данными
-    :return: None
+    :param date: дата
+    :param bucket: интервал (один из HISTORY_BUCKETS)
+    :return: начало интервала, в который попадает дата (как date_trunc в postgres, неделя - с понедельника)
+    """
+
+    date = date.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'hour':
+        return date
+    date = date.replace(hour=0)
+    if bucket == 'week':
+        date -= timedelta(days=date.weekday())
+    return date
+
 
-    Функция генерации данных для записи в таблицу историй
+def history_points_to_answer(points: list[tuple[datetime, int]], bucket: str | None = None) -> list[dict]:
     """
+    :param points: точки истории (дата, цена) по возрастанию даты
+    :param bucket: интервал прореживания (один из HISTORY_BUCKETS), None - все точки
+    :return: записи истории в виде ответа API (как у iter_history)
+    """
+
+    if bucket is None:
+        return [{'update_date': datetime_to_str(date), 'price': price} for date, price in points]
 
-    for obj_id, obj_data in prices.items():
-        yield {
-            'shop_unit_id': obj_id,
-            'update_date': obj_data.get('date'),
-            'price': obj_data.get('price'),
+    buckets = {}
+    for date, price in points:
+        buckets.setdefault(truncate_date(date, bucket), []).append(price)
+
+    return [
+        {
+            'update_date': datetime_to_str(start), 'price': prices[-1], 'min': min(prices), 'max': max(prices),
+            'avg': round(sum(prices) / len(prices), 2), 'count': len(prices),
         }
+        for start, prices in buckets.items()
+    ]
 
 
-async def add_history(children_id: str, pg: PG, update_date: datetime, main_parents_trees: dict) -> None:
+async def get_category_history(category_id: str, date_start: datetime, date_end: datetime,
+                               pg: PG) -> list[tuple[datetime, int]]:
     """
-    :param children_id: id дочернего элемента в ветке
+    :param category_id: id категории
+    :param date_start: начало периода (включительно)
+    :param date_end: конец периода (включительно)
     :param pg: PG объект коннекта к базе данных
-    :param update_date: время обновления
-    :param main_parents_trees: словарь, чтобы не запрашивать историю и дерево объекта несколько раз
-    :return: None
+    :return: точки истории цены категории (дата, цена) по возрастанию даты
 
-    Функция вычисления и добавления истории объекту
+    Функция, восстанавливающая историю категории из истории ее товаров (--history-mode lazy)
+    проходом по событиям: состояние на начало периода - последние цены товаров до него,
+    дальше изменения цен применяются по порядку дат, после всех изменений одной даты
+    считается средняя цена. Точка добавляется, если цена отличается от предыдущей
+    (как и при записи истории, см. insert_history). Товары поддерева - по текущей иерархии
     """
 
-    ides = await get_parent_brunch_ides(children_id, pg)
-    main_parent_id = ides and ides[-1].get('relation_id')
+    async with pg.transaction(readonly=True, isolation='repeatable_read') as conn:
+        prices = {
+            record['shop_unit_id']: record['price']
+            for record in await STATEMENTS.fetch(conn, 'get_subtree_offers_prices', category_id, date_start)
+        }
+        events = await STATEMENTS.fetch(conn, 'get_subtree_offers_events', category_id, date_start, date_end)
 
-    if main_parents_trees.get(main_parent_id) is None:
-        prices = {}
-        main_parent_tree = await get_obj_tree_by_id(main_parent_id or children_id, pg)
-        await get_history(main_parent_tree, update_date, ides[::-1], prices)
+    sum_price, offer_count = sum(prices.values()), len(prices)
+    last_price = get_price(sum_price, offer_count)
 
-        main_parents_trees[main_parent_id] = [main_parent_tree, prices]
+    points = []
+    for index, record in enumerate(events):
+        old_price = prices.get(record['shop_unit_id'])
+        sum_price += record['price'] - (old_price or 0)
+        offer_count += old_price is None
+        prices[record['shop_unit_id']] = record['price']
 
-        sql_request = insert(history_table).on_conflict_do_nothing(
-            index_elements=['shop_unit_id', 'update_date']
-        )
-        sql_request.parameters = []
+        # следующее событие той же даты - цена категории еще не окончательная
+        if index + 1 < len(events) and events[index + 1]['update_date'] == record['update_date']:
+            continue
 
-        history_rows = list(chunk_list(get_history_table_chunk(prices), MAX_QUERY_ARGS // 3))
-        for chunk in history_rows:
-            await pg.execute(sql_request.values(chunk))
+        price = get_price(sum_price, offer_count)
+        if price != last_price:
+            points.append((record['update_date'], price))
+            last_price = price
 
+    return points
 
-async def update_parent_branch_date(children_id: str, pg: PG, update_date: datetime) -> None:
+
+async def iter_history(shop_unit_id: str, date_start: datetime, date_end: datetime, pg: PG,
+                       bucket: str | None = None, prefetch: int = STREAM_PREFETCH) -> AsyncIterator[dict]:
+    """
+    :param shop_unit_id: id элемента
+    :param date_start: начало периода (включительно)
+    :param date_end: конец периода (включительно)
+    :param pg: PG объект коннекта к базе данных
+    :param bucket: интервал прореживания (один из HISTORY_BUCKETS), None - все записи
+    :param prefetch: кол-во строк, забираемых из курсора за раз
+    :return: AsyncIterator записей истории по возрастанию даты
+
+    Функция, читающая историю цены элемента серверным курсором. С bucket каждая запись -
+    интервал (update_date - его начало, price - последняя цена в нем, а также min, max, avg и count),
+    прореживание делает postgres, поэтому длинный период отдается несколькими сотнями записей
+    """
+
+    async with pg.transaction(readonly=True) as conn:
+        if bucket is None:
+            async for record in STATEMENTS.cursor(
+                    conn, 'get_history', shop_unit_id, date_start, date_end, prefetch=prefetch):
+                yield history_to_answer(record)
+            return
+
+        async for record in STATEMENTS.cursor(
+                conn, 'get_history_buckets', shop_unit_id, date_start, date_end, bucket, prefetch=prefetch):
+            yield history_bucket_to_answer(record)
+
+
+def get_branch(children_id: str, parents: dict[str, str]) -> Generator:
     """
     :param children_id: id дочернего элемента в ветке
+    :param parents: словарь id: id родителя
+    :return: Generator
+
+    Функция, которая генерирует id элемента и всех его родителей (снизу вверх)
+    """
+
+    visited = set()
+    while children_id is not None and children_id not in visited:
+        visited.add(children_id)
+        yield children_id
+        children_id = parents.get(children_id)
+
+
+async def get_branches_states(ides: Iterable[str], pg: PG) -> dict[str, dict]:
+    """
+    :param ides: id элементов
     :param pg: PG объект коннекта к базе данных
-    :param update_date: время обновления
-    :return: None
+    :return: словарь id: состояние элемента (родитель, тип, цена и агрегаты поддерева)
 
-    Функция обновляет дату во всей родительской ветке
+    Функция, возвращающая текущее состояние элементов и всех их родителей одним запросом
     """
 
-    ides = await get_parent_brunch_ides(children_id, pg)
-    ides_to_req = set()
+    records = await STATEMENTS.fetch(pg, 'get_branches_states', list(ides))
+    return {record.get('shop_unit_id'): dict(record) for record in records}
 
-    for record in ides:
-        ides_to_req.update((record.get('relation_id'), record.get('children_id')))
 
-    sql_request = SQL_REQUESTS['update_date'].format(update_date, tuple(ides_to_req))
-    await pg.execute(sql_request)
+def get_own_aggregates(shop_unit: dict) -> tuple[int, int]:
+    """
+    :param shop_unit: элемент (строка таблицы shop_units)
+    :return: собственный вклад элемента в агрегаты (сумма цен, кол-во товаров)
+
+    Функция, возвращающая вклад самого элемента в агрегаты его ветки
+    """
+
+    if shop_unit.get('type').lower() != 'offer':
+        return 0, 0
+    return shop_unit.get('price') or 0, 1
+
+
+def propagate_aggregates(states: dict[str, dict], shop_units: list[dict]) -> tuple[dict, dict, dict]:
+    """
+    :param states: состояние элементов выгрузки и их родителей до импорта (см. get_branches_states)
+    :param shop_units: строки выгрузки для таблицы shop_units
+    :return: новые родители, новые агрегаты и изменения агрегатов
+
+    Функция, которая пересчитывает агрегаты поддеревьев распространением изменений вверх по веткам.
+    Каждый элемент выгрузки сначала отцепляется от старого родителя (его агрегаты вычитаются
+    из старой ветки), затем у него меняется собственный вклад, затем он прицепляется к новому
+    родителю (агрегаты прибавляются к новой ветке). Сложность O(кол-во элементов * глубина).
+    """
+
+    parents = {shop_unit_id: state['parent_id'] for shop_unit_id, state in states.items()}
+    aggregates = {shop_unit_id: [state['sum_price'], state['offer_count']] for shop_unit_id, state in states.items()}
+    initial = {shop_unit_id: tuple(aggregate) for shop_unit_id, aggregate in aggregates.items()}
+
+    def add_to_branch(shop_unit_id: str, sum_price: int, offer_count: int) -> None:
+        for node_id in get_branch(shop_unit_id, parents):
+            aggregate = aggregates.setdefault(node_id, [0, 0])
+            aggregate[0] += sum_price
+            aggregate[1] += offer_count
+
+    for shop_unit in shop_units:
+        shop_unit_id = shop_unit['shop_unit_id']
+        aggregate = aggregates.setdefault(shop_unit_id, [0, 0])
+        state = states.get(shop_unit_id)
+        old_sum_price, old_offer_count = get_own_aggregates(state) if state else (0, 0)
+
+        parent_id = parents.pop(shop_unit_id, None)
+        if parent_id is not None:
+            add_to_branch(parent_id, -aggregate[0], -aggregate[1])
+
+        new_sum_price, new_offer_count = get_own_aggregates(shop_unit)
+        aggregate[0] += new_sum_price - old_sum_price
+        aggregate[1] += new_offer_count - old_offer_count
+
+    for shop_unit in shop_units:
+        shop_unit_id, parent_id = shop_unit['shop_unit_id'], shop_unit.get('parent_id')
+        parents[shop_unit_id] = parent_id
+        if parent_id is not None:
+            add_to_branch(parent_id, *aggregates[shop_unit_id])
+
+    deltas = {}
+    for shop_unit_id, (sum_price, offer_count) in aggregates.items():
+        old_sum_price, old_offer_count = initial.get(shop_unit_id, (0, 0))
+        if (sum_price, offer_count) != (old_sum_price, old_offer_count):
+            deltas[shop_unit_id] = (sum_price - old_sum_price, offer_count - old_offer_count)
+
+    return parents, aggregates, deltas
+
+
+class HistoryMetrics:
+    """
+    Кол-во записей истории, добавленных импортами процесса, и пропущенных
+    (цена элемента не изменилась с его последней записи, см. запрос insert_history)
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+
+    def track(self, written: int, skipped: int) -> None:
+        self.written += written
+        self.skipped += skipped
+
+    def stats(self) -> dict:
+        return {
+            'written': self.written,
+            'skipped': self.skipped,
+        }
+
+
+HISTORY_METRICS = HistoryMetrics()
+
+
+class BranchesUpdate:
+    """
+    Пакетный пересчет родительских веток выгрузки, которая пишется частями:
+    add_chunk запоминает состояние веток до импорта и строки очередной части,
+    finish пересчитывает агрегаты по всей выгрузке сразу (элементы могут идти в любом
+    порядке, в т.ч. ребенок в более ранней части, чем его родитель), обновляет веткам дату
+    и записывает историю каждому затронутому элементу не больше одного раза
+    (и только если цена изменилась).
+
+    Количество запросов не зависит от кол-ва элементов в части:
+        на каждую часть - 1 запрос на состояние веток (get_branches_states, до вставки),
+        на всю выгрузку - 1 запрос на изменение агрегатов,
+                          1 запрос на обновление дат, версий и дат изменения цен,
+                          2 запроса на вставку истории (секция и строки)
+                          и при перемещениях 1 запрос на версии старых веток.
+    В памяти до конца выгрузки держатся только id, родитель, тип и цена ее элементов
+    и состояния их веток.
+    """
+
+    # поля строк выгрузки, нужные для пересчета веток
+    ROW_FIELDS = ('shop_unit_id', 'parent_id', 'type', 'price')
+
+    def __init__(self, history_mode: str = 'snapshot'):
+        """
+        :param history_mode: как пишется история (один из HISTORY_MODES)
+        """
+
+        self.history_mode = history_mode
+        # состояние элементов и их веток до импорта и строки выгрузки (повторный элемент - последний)
+        self.states = {}
+        self.rows = {}
+
+        self.ides_to_update = set()
+        self.history_ides = set()
+        # товары, цена которых изменилась (в т.ч. новые)
+        self.price_changed_ides = set()
+        # элементы, агрегаты которых изменились (в т.ч. старые ветки перемещенных)
+        self.aggregates_ides = set()
+
+    @property
+    def touched_ides(self) -> set[str]:
+        """
+        :return: id элементов, представление которых изменила выгрузка
+        """
+
+        return self.ides_to_update | self.aggregates_ides
+
+    def add_chunk(self, states: dict[str, dict], shop_units: list[dict]) -> None:
+        """
+        :param states: состояние элементов части и их родителей до ее вставки (см. get_branches_states)
+        :param shop_units: строки части для таблицы shop_units
+        :return: None
+
+        Состояние элемента запоминается при первом чтении: строки, записанные
+        предыдущими частями этой выгрузки, состоянием до импорта не являются
+        """
+
+        for shop_unit_id, state in states.items():
+            if shop_unit_id not in self.rows:
+                self.states.setdefault(shop_unit_id, state)
+
+        for shop_unit in shop_units:
+            self.rows[shop_unit['shop_unit_id']] = {field: shop_unit.get(field) for field in self.ROW_FIELDS}
+
+    async def apply(self, pg: PG) -> None:
+        """
+        :param pg: PG объект коннекта к базе данных (или коннект транзакции)
+        :return: None
+
+        Метод, который распространяет изменения агрегатов всей выгрузки вверх по веткам
+        и запоминает затронутые ветки
+        """
+
+        states, shop_units = self.states, list(self.rows.values())
+        old_parents = {shop_unit_id: state['parent_id'] for shop_unit_id, state in states.items()}
+        parents, _, deltas = propagate_aggregates(states, shop_units)
+
+        self.aggregates_ides.update(deltas)
+        # у старой ветки перемещенного элемента меняются дети, даже если агрегаты остались прежними
+        for shop_unit in shop_units:
+            old_parent_id = old_parents.get(shop_unit['shop_unit_id'])
+            if old_parent_id is not None and old_parent_id != shop_unit.get('parent_id'):
+                self.aggregates_ides.update(get_branch(old_parent_id, old_parents))
+        if deltas:
+            await STATEMENTS.execute(
+                pg, 'update_aggregates',
+                list(deltas), [delta[0] for delta in deltas.values()], [delta[1] for delta in deltas.values()]
+            )
+
+        for shop_unit in shop_units:
+            state = states.get(shop_unit['shop_unit_id'])
+            if shop_unit.get('type').lower() == 'offer' and (
+                    state is None or state['type'].lower() != 'offer' or state['price'] != shop_unit.get('price')):
+                self.price_changed_ides.add(shop_unit['shop_unit_id'])
+
+        # все элементы выгрузки и их ветки получают дату обновления,
+        # история пишется товарам и всем их родителям (в режиме lazy - только товарам)
+        for shop_unit in shop_units:
+            branch = get_branch(shop_unit['shop_unit_id'], parents)
+            if shop_unit.get('type').lower() == 'offer':
+                branch = list(branch)
+                self.history_ides.update(branch if self.history_mode == 'snapshot' else branch[:1])
+            self.ides_to_update.update(branch)
+
+    async def finish(self, pg: PG, update_date: datetime) -> None:
+        """
+        :param pg: PG объект коннекта к базе данных (или коннект транзакции)
+        :param update_date: время обновления
+        :return: None
+        """
+
+        await self.apply(pg)
+
+        if self.ides_to_update:
+            await STATEMENTS.execute(
+                pg, 'update_date', update_date, list(self.ides_to_update), list(self.price_changed_ides)
+            )
+
+        # остальным затронутым элементам (старые ветки) меняется только версия
+        touched_only = self.aggregates_ides - self.ides_to_update
+        if touched_only:
+            await STATEMENTS.execute(pg, 'touch_shop_units', list(touched_only))
+
+        # цены считаются в бд по уже пересчитанным агрегатам,
+        # история секционирована по месяцам - секция месяца выгрузки создается при первой вставке
+        if self.history_ides:
+            await STATEMENTS.execute(pg, 'ensure_history_partition', update_date)
+            record = await STATEMENTS.fetchrow(pg, 'insert_history', list(self.history_ides), update_date)
+            HISTORY_METRICS.track(record['inserted'], record['candidates'] - record['inserted'])
 
 
 def datetime_to_str(date: datetime) -> str:
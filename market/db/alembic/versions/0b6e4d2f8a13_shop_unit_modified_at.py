@@ -0,0 +1,27 @@
+"""Shop unit modified_at
+
+Revision ID: 0b6e4d2f8a13
+Revises: 5d92e0b7a1c4
+Create Date: 2026-10-18 21:14:08.530472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e4d2f8a13'
+down_revision = '5d92e0b7a1c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # существующие строки получают время миграции: ответы, закэшированные клиентами раньше, считаются устаревшими
+    op.add_column('shop_units', sa.Column(
+        'modified_at', sa.DateTime(), server_default=sa.text("(now() AT TIME ZONE 'utc')"), nullable=False
+    ))
+
+
+def downgrade() -> None:
+    op.drop_column('shop_units', 'modified_at')
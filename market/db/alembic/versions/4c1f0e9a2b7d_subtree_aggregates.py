@@ -0,0 +1,45 @@
+"""Subtree aggregates
+
+Revision ID: 4c1f0e9a2b7d
+Revises: 61bd2cdad215
+Create Date: 2026-10-18 12:10:41.512734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1f0e9a2b7d'
+down_revision = '61bd2cdad215'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('shop_units', sa.Column('sum_price', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('shop_units', sa.Column('offer_count', sa.Integer(), server_default='0', nullable=False))
+
+    # заполняем агрегаты по уже существующим данным: каждый товар
+    # поднимается по своей ветке и добавляет цену всем родителям
+    op.execute('''
+    WITH RECURSIVE branch(shop_unit_id, price) AS (
+        SELECT shop_unit_id, coalesce(price, 0) FROM shop_units WHERE type = 'offer'
+      UNION ALL
+        SELECT t.parent_id, b.price
+        FROM shop_units t, branch b
+        WHERE t.shop_unit_id = b.shop_unit_id AND t.parent_id IS NOT NULL
+    ), aggregates AS (
+        SELECT shop_unit_id, sum(price) AS sum_price, count(*) AS offer_count
+        FROM branch GROUP BY shop_unit_id
+    )
+    UPDATE shop_units
+    SET sum_price = a.sum_price, offer_count = a.offer_count
+    FROM aggregates a
+    WHERE shop_units.shop_unit_id = a.shop_unit_id
+    ''')
+
+
+def downgrade() -> None:
+    op.drop_column('shop_units', 'offer_count')
+    op.drop_column('shop_units', 'sum_price')
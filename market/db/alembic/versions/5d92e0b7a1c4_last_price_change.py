@@ -0,0 +1,48 @@
+"""Last price change of offers
+
+Revision ID: 5d92e0b7a1c4
+Revises: c41d7e8a9b52
+Create Date: 2026-10-18 19:05:41.370218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d92e0b7a1c4'
+down_revision = 'c41d7e8a9b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('shop_units', sa.Column('last_price_change_at', sa.DateTime(), nullable=True))
+
+    # последнее изменение цены - последняя запись истории товара, цена в которой отличается от предыдущей
+    op.execute('''
+    UPDATE shop_units SET last_price_change_at = changes.changed_at
+    FROM (
+        SELECT shop_unit_id, max(update_date) AS changed_at
+        FROM (
+            SELECT shop_unit_id, update_date, price,
+                lag(price) OVER (PARTITION BY shop_unit_id ORDER BY update_date) AS previous_price
+            FROM history
+        ) h
+        WHERE previous_price IS DISTINCT FROM price
+        GROUP BY shop_unit_id
+    ) changes
+    WHERE shop_units.shop_unit_id = changes.shop_unit_id AND shop_units.type = 'offer'
+    ''')
+    op.execute('''
+    UPDATE shop_units SET last_price_change_at = date WHERE type = 'offer' AND last_price_change_at IS NULL
+    ''')
+
+    op.create_index(
+        op.f('ix__shop_units__last_price_change_at'), 'shop_units', ['last_price_change_at'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix__shop_units__last_price_change_at'), table_name='shop_units')
+    op.drop_column('shop_units', 'last_price_change_at')
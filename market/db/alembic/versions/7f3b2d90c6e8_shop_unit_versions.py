@@ -0,0 +1,29 @@
+"""Shop unit versions
+
+Revision ID: 7f3b2d90c6e8
+Revises: e5a1c9f27b34
+Create Date: 2026-10-18 17:12:45.204617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3b2d90c6e8'
+down_revision = 'e5a1c9f27b34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('shop_units_version_seq')))
+    # существующие строки получают разные версии из последовательности
+    op.add_column('shop_units', sa.Column(
+        'version', sa.BigInteger(), server_default=sa.text("nextval('shop_units_version_seq')"), nullable=False
+    ))
+
+
+def downgrade() -> None:
+    op.drop_column('shop_units', 'version')
+    op.execute(sa.schema.DropSequence(sa.Sequence('shop_units_version_seq')))
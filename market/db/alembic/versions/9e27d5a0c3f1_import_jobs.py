@@ -0,0 +1,44 @@
+"""Import jobs
+
+Revision ID: 9e27d5a0c3f1
+Revises: 4c1f0e9a2b7d
+Create Date: 2026-10-18 14:02:17.390115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9e27d5a0c3f1'
+down_revision = '4c1f0e9a2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('import_jobs',
+    sa.Column('job_id', sa.String(), nullable=False),
+    sa.Column('status', sa.Enum('queued', 'running', 'done', 'failed', name='import_job_status'), nullable=False),
+    sa.Column('update_date', sa.DateTime(), nullable=False),
+    sa.Column('items_total', sa.Integer(), nullable=False),
+    sa.Column('items_done', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('job_id', name=op.f('pk__import_jobs'))
+    )
+    op.create_table('import_job_items',
+    sa.Column('job_id', sa.String(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('item', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.PrimaryKeyConstraint('job_id', 'position', name=op.f('pk__import_job_items'))
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('import_job_items')
+    op.drop_table('import_jobs')
+    op.execute('DROP TYPE import_job_status')
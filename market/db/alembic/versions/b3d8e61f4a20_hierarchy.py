@@ -0,0 +1,47 @@
+"""Hierarchy closure table
+
+Revision ID: b3d8e61f4a20
+Revises: 9e27d5a0c3f1
+Create Date: 2026-10-18 15:21:48.074612
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8e61f4a20'
+down_revision = '9e27d5a0c3f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('hierarchy',
+    sa.Column('ancestor_id', sa.String(), nullable=False),
+    sa.Column('descendant_id', sa.String(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id', name=op.f('pk__hierarchy'))
+    )
+    op.create_index(op.f('ix__hierarchy__descendant_id'), 'hierarchy', ['descendant_id'], unique=False)
+
+    # заполняем по существующим связям; связи, оставшиеся от перемещенных
+    # элементов (не совпадающие с shop_units.parent_id), пропускаем
+    op.execute('''
+    INSERT INTO hierarchy (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE edges AS (
+        SELECT r.relation_id, r.children_id
+        FROM relations r JOIN shop_units s ON s.shop_unit_id = r.children_id AND s.parent_id = r.relation_id
+    ), closure(ancestor_id, descendant_id, depth) AS (
+        SELECT shop_unit_id, shop_unit_id, 0 FROM shop_units
+      UNION ALL
+        SELECT c.ancestor_id, e.children_id, c.depth + 1
+        FROM closure c JOIN edges e ON e.relation_id = c.descendant_id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM closure
+    ''')
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix__hierarchy__descendant_id'), table_name='hierarchy')
+    op.drop_table('hierarchy')
@@ -0,0 +1,84 @@
+"""Partition history by update_date
+
+Revision ID: c41d7e8a9b52
+Revises: 7f3b2d90c6e8
+Create Date: 2026-10-18 18:03:27.661093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e8a9b52'
+down_revision = '7f3b2d90c6e8'
+branch_labels = None
+depends_on = None
+
+# создает месячную секцию history для даты, если ее еще нет. Вызывается перед вставкой
+# истории (см. запрос ensure_history_partition); advisory lock не дает двум транзакциям
+# одновременно создавать одну и ту же секцию
+ENSURE_HISTORY_PARTITION = '''
+CREATE FUNCTION ensure_history_partition(day timestamp) RETURNS void AS $$
+DECLARE
+    month_start timestamp := date_trunc('month', day);
+    partition_name text := 'history_' || to_char(month_start, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM pg_advisory_xact_lock(hashtext(partition_name));
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF history FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, month_start + interval '1 month'
+    );
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE history RENAME TO history_unpartitioned')
+    op.execute('ALTER INDEX uix_2 RENAME TO uix_2_unpartitioned')
+
+    # уникальность на секционированной таблице должна включать ключ секционирования (update_date)
+    op.create_table('history',
+    sa.Column('shop_unit_id', sa.String(), nullable=False),
+    sa.Column('update_date', sa.DateTime(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.UniqueConstraint('shop_unit_id', 'update_date', name='uix_2'),
+    postgresql_partition_by='RANGE (update_date)'
+    )
+    op.create_index(op.f('ix__history__update_date'), 'history', ['update_date'], unique=False)
+
+    op.execute(ENSURE_HISTORY_PARTITION)
+    op.execute('''
+    SELECT ensure_history_partition(month)
+    FROM (SELECT DISTINCT date_trunc('month', update_date) AS month FROM history_unpartitioned) months
+    ''')
+    op.execute('''
+    INSERT INTO history (shop_unit_id, update_date, price)
+    SELECT shop_unit_id, update_date, price FROM history_unpartitioned
+    ''')
+    op.drop_table('history_unpartitioned')
+
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE history RENAME TO history_partitioned')
+    op.execute('ALTER INDEX uix_2 RENAME TO uix_2_partitioned')
+
+    op.create_table('history',
+    sa.Column('shop_unit_id', sa.String(), nullable=False),
+    sa.Column('update_date', sa.DateTime(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.UniqueConstraint('shop_unit_id', 'update_date', name='uix_2')
+    )
+    op.execute('''
+    INSERT INTO history (shop_unit_id, update_date, price)
+    SELECT shop_unit_id, update_date, price FROM history_partitioned
+    ''')
+
+    # секции удаляются вместе с родительской таблицей
+    op.drop_table('history_partitioned')
+    op.execute('DROP FUNCTION ensure_history_partition(timestamp)')
@@ -0,0 +1,24 @@
+"""Index on shop_units.parent_id
+
+Revision ID: e5a1c9f27b34
+Revises: b3d8e61f4a20
+Create Date: 2026-10-18 16:40:12.518904
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c9f27b34'
+down_revision = 'b3d8e61f4a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # обход поддерева сверху вниз (потоковый /nodes) идет по parent_id
+    op.create_index(op.f('ix__shop_units__parent_id'), 'shop_units', ['parent_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix__shop_units__parent_id'), table_name='shop_units')
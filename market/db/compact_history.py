@@ -0,0 +1,74 @@
+"""
+Сжатие истории цен: удаление записей, цена в которых совпадает с предыдущей
+записью того же элемента (раньше история писалась при каждом импорте, даже
+если цена не изменилась, см. запрос insert_history).
+
+market-compact-history            - вывести кол-во лишних записей
+market-compact-history --delete   - удалить их
+
+Лишние записи ищутся целиком в postgres. Элементам, история которых сжалась,
+выдается новая версия (ETag /node/{id}/statistic)
+"""
+import logging
+
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from sqlalchemy import create_engine, text
+
+from market.utils.pg import DEFAULT_PG_URL
+
+log = logging.getLogger(__name__)
+
+REDUNDANT_HISTORY = '''
+    WITH redundant AS (
+        SELECT shop_unit_id, update_date
+        FROM (
+            SELECT shop_unit_id, update_date, price,
+                lag(price) OVER (PARTITION BY shop_unit_id ORDER BY update_date) AS previous_price
+            FROM history
+        ) h
+        WHERE price = previous_price
+    )
+'''
+
+SQL_REQUESTS = {
+    'count_redundant': REDUNDANT_HISTORY + '''
+    SELECT count(*) AS rows, count(DISTINCT shop_unit_id) AS units FROM redundant''',
+    'delete_redundant': REDUNDANT_HISTORY + ''',
+    deleted AS (
+        DELETE FROM history h USING redundant r
+        WHERE h.shop_unit_id = r.shop_unit_id AND h.update_date = r.update_date
+        RETURNING h.shop_unit_id
+    ), touched AS (
+        UPDATE shop_units SET version = nextval('shop_units_version_seq'), modified_at = now() AT TIME ZONE 'utc'
+        WHERE shop_unit_id IN (SELECT shop_unit_id FROM deleted)
+    )
+    SELECT count(*) AS rows, count(DISTINCT shop_unit_id) AS units FROM deleted''',
+}
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument(
+    '--pg-url', default=str(DEFAULT_PG_URL.url),
+    help='URL to use to connect to the database'
+)
+parser.add_argument(
+    '--delete', action='store_true',
+    help='Delete history rows that repeat the previous price of the same unit'
+)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+
+    engine = create_engine(args.pg_url)
+    with engine.begin() as conn:
+        if args.delete:
+            row = conn.execute(text(SQL_REQUESTS['delete_redundant'])).one()
+            log.info('Deleted %d redundant history rows of %d units', row.rows, row.units)
+        else:
+            row = conn.execute(text(SQL_REQUESTS['count_redundant'])).one()
+            log.info('Found %d redundant history rows of %d units', row.rows, row.units)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Пересчет агрегатов поддеревьев (sum_price, offer_count) с нуля и сравнение
+их с теми, что поддерживаются импортом и удалением.
+
+market-repair                - вывести расхождения
+market-repair --fix          - вывести расхождения и исправить их
+market-repair --unit <id>    - проверить только поддерево элемента
+
+Агрегаты считаются целиком в postgres, клиенту приходят только расхождения.
+Цена категории - sum_price / offer_count: целочисленное деление postgres
+для неотрицательных цен совпадает с // в python (см. get_price и test_prices_rounding
+в tests/unit_test.py - цены /nodes и истории на дробных средних)
+"""
+import logging
+
+from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from sqlalchemy import create_engine, text
+
+from market.utils.pg import DEFAULT_PG_URL
+
+log = logging.getLogger(__name__)
+
+# каждый товар поднимается по своей ветке и добавляет свою цену всем родителям
+# (по parent_id, а не по hierarchy, чтобы проверка не зависела от поддерживаемых импортом таблиц);
+# с :root_id проверяются только элементы его поддерева (NULL - все элементы)
+EXPECTED_AGGREGATES = '''
+    WITH RECURSIVE subtree AS (
+        SELECT shop_unit_id FROM shop_units WHERE shop_unit_id = :root_id
+      UNION ALL
+        SELECT t.shop_unit_id FROM shop_units t JOIN subtree s ON t.parent_id = s.shop_unit_id
+    ), branch(shop_unit_id, price) AS (
+        SELECT shop_unit_id, coalesce(price, 0) FROM shop_units
+        WHERE type = 'offer' AND (CAST(:root_id AS text) IS NULL OR shop_unit_id IN (SELECT shop_unit_id FROM subtree))
+      UNION ALL
+        SELECT t.parent_id, b.price
+        FROM shop_units t, branch b
+        WHERE t.shop_unit_id = b.shop_unit_id AND t.parent_id IS NOT NULL
+    ), aggregates AS (
+        SELECT shop_unit_id, sum(price) AS sum_price, count(*) AS offer_count
+        FROM branch GROUP BY shop_unit_id
+    ), mismatches AS (
+        SELECT
+            u.shop_unit_id,
+            u.sum_price, coalesce(a.sum_price, 0) AS expected_sum_price,
+            u.offer_count, coalesce(a.offer_count, 0) AS expected_offer_count
+        FROM shop_units u LEFT JOIN aggregates a ON u.shop_unit_id = a.shop_unit_id
+        WHERE (u.sum_price <> coalesce(a.sum_price, 0) OR u.offer_count <> coalesce(a.offer_count, 0))
+            AND (CAST(:root_id AS text) IS NULL OR u.shop_unit_id IN (SELECT shop_unit_id FROM subtree))
+    )
+'''
+
+SQL_REQUESTS = {
+    'get_mismatches': EXPECTED_AGGREGATES + 'SELECT * FROM mismatches ORDER BY shop_unit_id',
+    'fix_mismatches': EXPECTED_AGGREGATES + '''
+    UPDATE shop_units
+    SET sum_price = m.expected_sum_price, offer_count = m.expected_offer_count,
+        version = nextval('shop_units_version_seq'), modified_at = now() AT TIME ZONE 'utc'
+    FROM mismatches m
+    WHERE shop_units.shop_unit_id = m.shop_unit_id''',
+}
+
+parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
+parser.add_argument(
+    '--pg-url', default=str(DEFAULT_PG_URL.url),
+    help='URL to use to connect to the database'
+)
+parser.add_argument(
+    '--unit', default=None,
+    help='Check only the subtree of this unit'
+)
+parser.add_argument(
+    '--fix', action='store_true',
+    help='Overwrite mismatched aggregates with recomputed ones'
+)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+
+    engine = create_engine(args.pg_url)
+    with engine.begin() as conn:
+        mismatches = conn.execute(text(SQL_REQUESTS['get_mismatches']), {'root_id': args.unit}).fetchall()
+
+        for row in mismatches:
+            log.warning(
+                '%s: sum_price %s (expected %s), offer_count %s (expected %s)',
+                row.shop_unit_id, row.sum_price, row.expected_sum_price, row.offer_count, row.expected_offer_count
+            )
+        log.info('Found %d mismatched aggregates', len(mismatches))
+
+        if args.fix and mismatches:
+            conn.execute(text(SQL_REQUESTS['fix_mismatches']), {'root_id': args.unit})
+            log.info('Fixed %d mismatched aggregates', len(mismatches))
+
+    exit(1 if mismatches and not args.fix else 0)
+
+
+if __name__ == '__main__':
+    main()
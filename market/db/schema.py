@@ -1,6 +1,9 @@
 from enum import Enum, unique
 
-from sqlalchemy import (Column, DateTime, Enum as PgEnum, Integer, MetaData, String, Table, UniqueConstraint)
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Enum as PgEnum, Integer, MetaData, Sequence, String, Table, text, UniqueConstraint
+)
+from sqlalchemy.dialects.postgresql import JSONB
 
 convention = {
     'all_column_names': lambda constraint, table: '_'.join([
@@ -21,15 +24,41 @@ class ShopUnitType(Enum):
     offer = 'OFFER'
 
 
+@unique
+class ImportJobStatus(Enum):
+    queued = 'QUEUED'
+    running = 'RUNNING'
+    done = 'DONE'
+    failed = 'FAILED'
+
+
+# версии элементов: любое изменение представления элемента (/nodes, /statistic)
+# выдает ему новое значение, значения не повторяются и после удаления элемента
+shop_units_version_seq = Sequence('shop_units_version_seq', metadata=metadata)
+
 shop_units_table = Table(
     'shop_units',
     metadata,
     Column('shop_unit_id', String, primary_key=True),
     Column('name', String, nullable=False, index=True),
     Column('date', DateTime, nullable=False),
-    Column('parent_id', String, nullable=True),
+    Column('parent_id', String, nullable=True, index=True),
     Column('type', PgEnum(ShopUnitType, name='type'), nullable=False),
     Column('price', Integer, nullable=True),
+
+    # агрегаты поддерева (сумма цен и кол-во товаров, включая сам элемент),
+    # поддерживаются импортом и удалением, цена категории = sum_price // offer_count
+    Column('sum_price', BigInteger, nullable=False, server_default='0'),
+    Column('offer_count', Integer, nullable=False, server_default='0'),
+
+    # версия для ETag (см. shop_units_version_seq)
+    Column('version', BigInteger, nullable=False, server_default=shop_units_version_seq.next_value()),
+    # время выдачи текущей версии (utc) для Last-Modified: меняется вместе с version, в отличие от date,
+    # которая не отражает изменения поддерева и может уменьшиться при импорте с более ранней датой
+    Column('modified_at', DateTime, nullable=False, server_default=text("(now() AT TIME ZONE 'utc')")),
+
+    # дата последнего изменения цены товара (у категорий NULL), поддерживается импортом, по ней - /sales
+    Column('last_price_change_at', DateTime, nullable=True, index=True),
 )
 
 relations_table = Table(
@@ -41,13 +70,51 @@ relations_table = Table(
     UniqueConstraint('relation_id', 'children_id', name='uix_1')
 )
 
+# closure-таблица иерархии: все пары (предок, потомок) с расстоянием между ними,
+# включая пары (элемент, элемент) с depth = 0
+hierarchy_table = Table(
+    'hierarchy',
+    metadata,
+    Column('ancestor_id', String, primary_key=True),
+    Column('descendant_id', String, primary_key=True, index=True),
+    Column('depth', Integer, nullable=False),
+)
+
+# секционирована по месяцам update_date (секции создает функция ensure_history_partition,
+# см. миграцию c41d7e8a9b52), запросы с диапазоном дат читают только нужные секции
 history_table = Table(
     'history',
     metadata,
 
     Column('shop_unit_id', String, nullable=False),
-    Column('update_date', DateTime, nullable=False),
+    Column('update_date', DateTime, nullable=False, index=True),
     Column('price', Integer, nullable=False),
 
-    UniqueConstraint('shop_unit_id', 'update_date', name='uix_2')
+    UniqueConstraint('shop_unit_id', 'update_date', name='uix_2'),
+    postgresql_partition_by='RANGE (update_date)',
+)
+
+import_jobs_table = Table(
+    'import_jobs',
+    metadata,
+
+    Column('job_id', String, primary_key=True),
+    Column('status', PgEnum(ImportJobStatus, name='import_job_status'), nullable=False),
+    Column('update_date', DateTime, nullable=False),
+    Column('items_total', Integer, nullable=False),
+    Column('items_done', Integer, nullable=False, server_default='0'),
+    Column('error', String, nullable=True),
+    Column('created_at', DateTime, nullable=False),
+    Column('started_at', DateTime, nullable=True),
+    Column('finished_at', DateTime, nullable=True),
+)
+
+# элементы выгрузки фоновой задачи импорта, удаляются после ее выполнения
+import_job_items_table = Table(
+    'import_job_items',
+    metadata,
+
+    Column('job_id', String, primary_key=True),
+    Column('position', Integer, primary_key=True),
+    Column('item', JSONB, nullable=False),
 )
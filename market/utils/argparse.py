@@ -1,5 +1,6 @@
 import os
 from argparse import ArgumentTypeError
+from importlib import import_module
 from typing import Callable
 
 
@@ -14,6 +15,20 @@ def validate(type: Callable, constrain: Callable):
 
 
 positive_int = validate(int, constrain=lambda x: x > 0)
+non_negative_int = validate(int, constrain=lambda x: x >= 0)
+positive_float = validate(float, constrain=lambda x: x > 0)
+non_negative_float = validate(float, constrain=lambda x: x >= 0)
+
+
+def import_object(path: str):
+    """
+    Импортирует объект по пути вида 'package.module:name'.
+    """
+    module_name, _, name = path.partition(':')
+    try:
+        return getattr(import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError) as err:
+        raise ArgumentTypeError(f'Can not import {path!r}: {err}')
 
 
 def clear_environ(rule: Callable):
@@ -0,0 +1,89 @@
+from bisect import bisect_left
+
+# границы корзин гистограмм времени (в миллисекундах)
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с фиксированными границами корзин.
+    Корзины в stats накопительные (кол-во наблюдений <= границы), как в prometheus
+    """
+
+    def __init__(self, buckets_ms: tuple = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, duration: float) -> None:
+        """
+        :param duration: длительность в секундах
+        :return: None
+        """
+
+        self.counts[bisect_left(self.buckets_ms, duration * 1000)] += 1
+        self.count += 1
+        self.total += duration
+
+    def stats(self) -> dict:
+        buckets, cumulative = {}, 0
+        for bound, count in zip(self.buckets_ms + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        return {
+            'count': self.count,
+            'sumMs': round(self.total * 1000, 3),
+            'bucketsMs': buckets,
+        }
+
+
+class RouteMetrics:
+    """
+    Метрики одного обработчика: кол-во запросов, ошибки (5xx),
+    кол-во запросов к бд и гистограмма времени ответа
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.queries = 0
+        self.latency = Histogram()
+
+    def observe(self, duration: float, status: int, queries: int) -> None:
+        self.count += 1
+        self.errors += status >= 500
+        self.queries += queries
+        self.latency.observe(duration)
+
+    def stats(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'queries': self.queries,
+            'queriesPerRequest': round(self.queries / self.count, 3) if self.count else None,
+            'latency': self.latency.stats(),
+        }
+
+
+class RequestMetrics:
+    """
+    Метрики http-запросов по обработчикам (ключ - метод и шаблон пути)
+    """
+
+    def __init__(self):
+        self.routes: dict[str, RouteMetrics] = {}
+
+    def observe(self, route: str, duration: float, status: int, queries: int) -> None:
+        if route not in self.routes:
+            self.routes[route] = RouteMetrics()
+        self.routes[route].observe(duration, status, queries)
+
+    def stats(self) -> dict[str, dict]:
+        return {route: metrics.stats() for route, metrics in sorted(self.routes.items())}
+
+
+__all__ = (
+    'DEFAULT_BUCKETS_MS', 'Histogram', 'RequestMetrics', 'RouteMetrics',
+)
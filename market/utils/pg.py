@@ -1,14 +1,25 @@
+import asyncio
 import logging
 import os
+from contextvars import ContextVar
 from dataclasses import dataclass
 from pathlib import Path
 from re import match
+from time import perf_counter
+from typing import Awaitable, Callable
 
 from aiohttp.web_app import Application
+from asyncpg import Connection
+from asyncpg.pool import Pool
 from asyncpgsa import PG
+from asyncpgsa.connection import SAConnection
+from asyncpgsa.pgsingleton import NotInitializedError
+from asyncpgsa.transactionmanager import ConnectionTransactionContextManager
 from configargparse import Namespace
 from dotenv import load_dotenv
 
+from market.utils.metrics import Histogram
+
 from sqlalchemy import create_engine
 
 CENSORED = '***'
@@ -57,17 +68,187 @@ class DataBaseData:
         return str(self.__dict__)
 
 
+class QueryCounter:
+    """
+    Счетчик запросов к бд, сделанных в рамках одного http-запроса
+    """
+
+    __slots__ = ('queries',)
+
+    def __init__(self):
+        self.queries = 0
+
+
+# счетчик текущего http-запроса (выставляется middleware, см. market.api.middlewares)
+QUERY_COUNTER: ContextVar[QueryCounter | None] = ContextVar('query_counter', default=None)
+
+
+def count_query() -> None:
+    counter = QUERY_COUNTER.get()
+    if counter is not None:
+        counter.queries += 1
+
+
+class MeteredConnection(SAConnection):
+    """
+    Соединение, которое считает выполненные запросы в QUERY_COUNTER
+    (fetch*, execute и copy_records_to_table, каждый вызов - один запрос)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._in_execute = False
+
+    def _execute(self, *args, **kwargs):
+        # execute с параметрами тоже проходит через _execute, он уже посчитан
+        if not self._in_execute:
+            count_query()
+        return super()._execute(*args, **kwargs)
+
+    async def execute(self, script, *args, **kwargs) -> str:
+        count_query()
+        self._in_execute = True
+        try:
+            return await super().execute(script, *args, **kwargs)
+        finally:
+            self._in_execute = False
+
+    async def copy_records_to_table(self, *args, **kwargs) -> str:
+        count_query()
+        return await super().copy_records_to_table(*args, **kwargs)
+
+
+class PoolMetrics:
+    """
+    Счетчики пула соединений: ожидающие соединения запросы, время ожидания
+    соединения (гистограмма), таймауты ожидания и кол-во открытых соединений
+    """
+
+    def __init__(self):
+        self.waiters = 0
+        self.acquire_timeouts = 0
+        self.connections_opened = 0
+        self.acquire_wait = Histogram()
+
+    def stats(self, pool: Pool) -> dict:
+        """
+        :param pool: пул asyncpg
+        :return: текущее состояние пула и накопленные счетчики
+        """
+
+        size, idle = pool.get_size(), pool.get_idle_size()
+        return {
+            'minSize': pool.get_min_size(),
+            'maxSize': pool.get_max_size(),
+            'size': size,
+            'inUse': size - idle,
+            'idle': idle,
+            'waiters': self.waiters,
+            'acquireTimeouts': self.acquire_timeouts,
+            'connectionsOpened': self.connections_opened,
+            'acquireWait': self.acquire_wait.stats(),
+        }
+
+
+class MeteredAcquireContext:
+    __slots__ = ('context', 'metrics')
+
+    def __init__(self, context, metrics: PoolMetrics):
+        self.context = context
+        self.metrics = metrics
+
+    async def __aenter__(self) -> Connection:
+        start = perf_counter()
+        self.metrics.waiters += 1
+        try:
+            return await self.context.__aenter__()
+        except asyncio.TimeoutError:
+            self.metrics.acquire_timeouts += 1
+            raise
+        finally:
+            self.metrics.waiters -= 1
+            self.metrics.acquire_wait.observe(perf_counter() - start)
+
+    async def __aexit__(self, *exc_info):
+        return await self.context.__aexit__(*exc_info)
+
+
+class MeteredPool:
+    """
+    Обертка над пулом asyncpg: acquire (и transaction через него) с таймаутом
+    ожидания соединения по умолчанию и замером ожидания. Остальное - как у пула
+    """
+
+    def __init__(self, pool: Pool, metrics: PoolMetrics, acquire_timeout: float | None = None):
+        self._pool = pool
+        self.metrics = metrics
+        self.acquire_timeout = acquire_timeout
+
+    def __getattr__(self, name: str):
+        return getattr(self._pool, name)
+
+    def acquire(self, timeout: float | None = None) -> MeteredAcquireContext:
+        return MeteredAcquireContext(self._pool.acquire(timeout=timeout or self.acquire_timeout), self.metrics)
+
+    def transaction(self, **kwargs) -> ConnectionTransactionContextManager:
+        return ConnectionTransactionContextManager(self, **kwargs)
+
+    def stats(self) -> dict:
+        return self.metrics.stats(self._pool)
+
+
+class MeteredPG(PG):
+    """
+    PG, все запросы которого (fetch, execute, transaction, ...) берут
+    соединения через MeteredPool
+    """
+
+    __slots__ = ('_metered_pool', 'metrics', 'acquire_timeout')
+
+    def __init__(self, acquire_timeout: float | None = None):
+        super().__init__()
+        self._metered_pool = None
+        self.metrics = PoolMetrics()
+        self.acquire_timeout = acquire_timeout
+
+    async def init(self, *args, init: Callable[[Connection], Awaitable] | None = None, **kwargs):
+        """
+        :param init: хук, вызываемый для каждого нового соединения пула
+        """
+
+        async def init_connection(conn: Connection) -> None:
+            self.metrics.connections_opened += 1
+            if init is not None:
+                await init(conn)
+
+        await super().init(*args, init=init_connection, connection_class=MeteredConnection, **kwargs)
+        self._metered_pool = MeteredPool(super().pool, self.metrics, self.acquire_timeout)
+
+    @property
+    def pool(self) -> MeteredPool:
+        if self._metered_pool is None:
+            raise NotInitializedError('pg.init() needs to be called before you can make queries')
+        return self._metered_pool
+
+
 async def setup_pg(app: Application, args: Namespace) -> PG:
     db_info = args.pg_url.with_password(CENSORED)
     log.info('Connecting to database: %s', db_info)
 
     db_data = await DataBaseData.get_from_url(str(DEFAULT_PG_URL.url))
 
-    app['pg'] = PG()
-    await app['pg'].init(**db_data.__dict__)
+    app['pg'] = MeteredPG(acquire_timeout=args.pg_pool_acquire_timeout)
+    await app['pg'].init(
+        **db_data.__dict__,
+        min_size=args.pg_pool_min_size,
+        max_size=args.pg_pool_max_size,
+        max_inactive_connection_lifetime=args.pg_max_inactive_connection_lifetime,
+        statement_cache_size=args.pg_statement_cache_size,
+        init=args.pg_init_hook,
+    )
     await app['pg'].fetchval('SELECT 1')
 
-    log.info('Connected to database %s', db_info)
+    log.info('Connected to database %s (pool size %d..%d)', db_info, args.pg_pool_min_size, args.pg_pool_max_size)
 
     try:
         yield
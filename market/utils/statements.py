@@ -0,0 +1,125 @@
+import logging
+from time import perf_counter
+from typing import Any, AsyncIterator, Mapping
+
+from asyncpg import Record
+
+log = logging.getLogger(__name__)
+
+
+class Statement:
+    """
+    SQL запрос реестра и статистика его выполнения
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def track(self, duration: float, failed: bool = False) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'totalMs': round(self.total_time * 1000, 3),
+            'avgMs': round(self.total_time * 1000 / self.calls, 3) if self.calls else None,
+            'maxMs': round(self.max_time * 1000, 3),
+        }
+
+
+class StatementRegistry:
+    """
+    Реестр именованных параметризованных запросов.
+
+    Текст каждого запроса постоянен (значения передаются только через $n),
+    поэтому asyncpg готовит его один раз на соединение пула и дальше берет
+    из своего кэша подготовленных запросов (statement_cache_size), а postgres
+    не разбирает и не планирует его заново.
+    Для каждого запроса считается кол-во выполнений и время выполнения
+    (вместе с ожиданием соединения, если передан PG, а не соединение)
+    """
+
+    def __init__(self, statements: Mapping[str, str]):
+        self.statements = {name: Statement(name, sql) for name, sql in statements.items()}
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def __getitem__(self, name: str) -> Statement:
+        return self.statements[name]
+
+    async def _run(self, method: str, conn, name: str, *args) -> Any:
+        """
+        :param method: метод соединения (fetch, fetchrow, fetchval, execute)
+        :param conn: PG объект коннекта к базе данных либо соединение
+        :param name: имя запроса в реестре
+        :param args: параметры запроса
+        :return: результат метода
+        """
+
+        statement = self.statements[name]
+        start = perf_counter()
+        try:
+            result = await getattr(conn, method)(statement.sql, *args)
+        except Exception:
+            statement.track(perf_counter() - start, failed=True)
+            raise
+
+        statement.track(perf_counter() - start)
+        return result
+
+    async def fetch(self, conn, name: str, *args) -> list[Record]:
+        return await self._run('fetch', conn, name, *args)
+
+    async def fetchrow(self, conn, name: str, *args) -> Record | None:
+        return await self._run('fetchrow', conn, name, *args)
+
+    async def fetchval(self, conn, name: str, *args) -> Any:
+        return await self._run('fetchval', conn, name, *args)
+
+    async def execute(self, conn, name: str, *args) -> str:
+        return await self._run('execute', conn, name, *args)
+
+    async def cursor(self, conn, name: str, *args, prefetch: int | None = None) -> AsyncIterator[Record]:
+        """
+        :param conn: соединение внутри транзакции (курсор postgres живет только в ней)
+        :param name: имя запроса в реестре
+        :param args: параметры запроса
+        :param prefetch: кол-во строк, забираемых с сервера за раз
+        :return: AsyncIterator строк результата
+
+        Время выполнения считается до закрытия курсора (вместе с обработкой строк)
+        """
+
+        statement = self.statements[name]
+        start = perf_counter()
+        failed = False
+        try:
+            async for record in conn.cursor(statement.sql, *args, prefetch=prefetch):
+                yield record
+        except Exception:
+            failed = True
+            raise
+        finally:
+            statement.track(perf_counter() - start, failed=failed)
+
+    def stats(self) -> dict[str, dict]:
+        """
+        :return: словарь имя запроса: статистика (только выполнявшиеся запросы)
+        """
+
+        return {name: statement.stats() for name, statement in self.statements.items() if statement.calls}
+
+
+__all__ = (
+    'Statement', 'StatementRegistry',
+)
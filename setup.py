@@ -45,13 +45,15 @@ setup(
         'Programming Language :: Python :: Implementation :: CPython'
     ],
     python_requires='>=3.10',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     # install_requires=load_requirements('requirements.txt'),
-    extras_require={'dev': load_requirements('requirements.dev.txt')},
+    extras_require={'dev': load_requirements('requirements.dev.txt'), 'fast': ['orjson'], 'brotli': ['brotli']},
     entry_points={
         'console_scripts': [
             '{0}-api = {0}.api.__main__:main'.format(module_name),
-            '{0}-db = {0}.db.__main__:main'.format(module_name)
+            '{0}-db = {0}.db.__main__:main'.format(module_name),
+            '{0}-repair = {0}.db.repair:main'.format(module_name),
+            '{0}-compact-history = {0}.db.compact_history:main'.format(module_name)
         ]
     },
     include_package_data=True
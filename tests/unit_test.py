@@ -1,9 +1,11 @@
 # encoding=utf8
 import datetime
+import gzip
 import json
 import re
 import subprocess
 import sys
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -277,6 +279,15 @@ def request(path, method="GET", data=None, json_response=False):
         return (e.getcode(), None)
 
 
+def request_headers(path, headers=None):
+    req = urllib.request.Request(f"{API_BASEURL}{path}", headers=headers or {})
+    try:
+        with urllib.request.urlopen(req) as res:
+            return res.getcode(), res.headers
+    except urllib.error.HTTPError as e:
+        return e.getcode(), e.headers
+
+
 def deep_sort_children(node):
     if node.get("children"):
         node["children"].sort(key=lambda x: x["id"])
@@ -307,6 +318,29 @@ def print_diff(expected, response):
                     "expected.json", "response.json"])
 
 
+def check_repair(shop_unit_id):
+    # market-repair пересчитывает агрегаты с нуля в той же бд, что и сервис
+    # (подключение берется из окружения, см. --pg-url), и выходит с 1 при расхождениях
+    result = subprocess.run(["market-repair", "--unit", shop_unit_id])
+    assert result.returncode == 0, f"market-repair found mismatches in {shop_unit_id}"
+
+
+def check_tree(shop_unit_id, expected):
+    # цены и потомки дерева из /nodes/{id} и из /nodes?ids= совпадают с ожидаемыми
+    status, response = request(f"/nodes/{shop_unit_id}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    status, batch = request(f"/nodes?ids={shop_unit_id}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    for tree in (response, batch[shop_unit_id]):
+        deep_sort_children(tree)
+        deep_sort_children(expected)
+        if tree != expected:
+            print_diff(expected, tree)
+            print("Response tree doesn't match expected tree.")
+            sys.exit(1)
+
+
 def test_import():
     for index, batch in enumerate(IMPORT_BATCHES):
         start = datetime.datetime.now()
@@ -329,6 +363,282 @@ def test_import():
     print("Test import passed.")
 
 
+def test_import_async():
+    start = datetime.datetime.now()
+    # повторная выгрузка последнего батча не меняет данных, но проходит через очередь задач
+    status, response = request("/imports?async=1", method="POST", data=IMPORT_BATCHES[-1], json_response=True)
+    assert status == 202, f"Expected HTTP status code 202, got {status}"
+    job_id = response["id"]
+
+    for _ in range(50):
+        status, job = request(f"/imports/{job_id}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        if job["status"] in ("DONE", "FAILED"):
+            break
+        time.sleep(0.1)
+
+    assert job["status"] == "DONE", f"Expected job status DONE, got {job}"
+    assert job["itemsDone"] == job["itemsTotal"] == len(IMPORT_BATCHES[-1]["items"])
+    print("Async import request time: %s" % (datetime.datetime.now() - start))
+
+    status, _ = request("/imports/bla_bla_bla", json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    print("Test import async passed.")
+
+
+def test_import_chunks():
+    # выгрузка больше одной части (MAX_CITIZENS_PER_INSERT = 2978 элементов),
+    # товары идут раньше своих категорий, поэтому родители попадают в последнюю часть
+    root_id = "3c0d5e7a-9b1f-4d2e-8a6c-5f7b9d1e3a01"
+    category_id = "3c0d5e7a-9b1f-4d2e-8a6c-5f7b9d1e3a02"
+    date = "2022-02-07T12:00:00.000Z"
+    offers = [
+        {"type": "OFFER", "name": f"offer {index}", "id": f"3c0d5e7a-offer-{index:05}",
+         "parentId": category_id, "price": index * 7 + 1}
+        for index in range(3000)
+    ]
+    batch = {
+        "items": offers + [
+            {"type": "CATEGORY", "name": "chunk category", "id": category_id, "parentId": root_id},
+            {"type": "CATEGORY", "name": "chunk root", "id": root_id, "parentId": None},
+        ],
+        "updateDate": date
+    }
+
+    start = datetime.datetime.now()
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    print("Chunked import request time: %s" % (datetime.datetime.now() - start))
+
+    def expected_tree(offers, date):
+        price = sum(offer["price"] for offer in offers) // len(offers)
+        category = {
+            "type": "CATEGORY", "name": "chunk category", "id": category_id, "parentId": root_id,
+            "price": price, "date": date,
+            "children": [
+                {"type": "OFFER", "name": offer["name"], "id": offer["id"], "parentId": category_id,
+                 "price": offer["price"], "date": date, "children": None}
+                for offer in offers
+            ]
+        }
+        return {
+            "type": "CATEGORY", "name": "chunk root", "id": root_id, "parentId": None,
+            "price": price, "date": date, "children": [category]
+        }
+
+    check_tree(root_id, expected_tree(offers, date))
+    check_repair(root_id)
+
+    # повторная выгрузка всех товаров (тоже несколькими частями) меняет цены половины из них:
+    # даты и история веток обновляются один раз на выгрузку
+    first_price = sum(offer["price"] for offer in offers) // len(offers)
+    new_date = "2022-02-08T12:00:00.000Z"
+    offers = [dict(offer, price=offer["price"] + 3) if index % 2 == 0 else offer
+              for index, offer in enumerate(offers)]
+    batch = {
+        "items": offers + [
+            {"type": "CATEGORY", "name": "chunk category", "id": category_id, "parentId": root_id},
+        ],
+        "updateDate": new_date
+    }
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    check_tree(root_id, expected_tree(offers, new_date))
+    check_repair(root_id)
+
+    params = urllib.parse.urlencode({
+        "dateStart": "2022-02-07T00:00:00.000Z", "dateEnd": "2022-02-09T00:00:00.000Z"
+    })
+    status, response = request(f"/node/{root_id}/statistic?{params}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    sort_stats(response)
+    expected = [
+        {"update_date": date, "price": first_price},
+        {"update_date": new_date, "price": sum(offer["price"] for offer in offers) // len(offers)},
+    ]
+    assert response["stats"] == expected, response["stats"]
+
+    status, _ = request(f"/delete/{root_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test import chunks passed.")
+
+
+def flatten_tree(node, nodes=None):
+    # элементы дерева ответа: id -> (parentId, price)
+    nodes = {} if nodes is None else nodes
+    nodes[node["id"]] = (node["parentId"], node["price"])
+    for child in node.get("children") or ():
+        flatten_tree(child, nodes)
+    return nodes
+
+
+def check_prices(shop_unit_id, expected):
+    # родители и цены поддерева в /nodes/{id} и в /nodes?ids= (поддерево по hierarchy)
+    status, response = request(f"/nodes/{shop_unit_id}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    status, batch = request(f"/nodes?ids={shop_unit_id}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    for tree in (response, batch[shop_unit_id]):
+        nodes = flatten_tree(tree)
+        if nodes != expected:
+            print_diff(expected, nodes)
+            print("Response tree doesn't match expected tree.")
+            sys.exit(1)
+
+
+def test_moves():
+    # перемещения товаров и категорий (вместе с поддеревом) между ветками одного дерева и из него
+    root_id, a_id, b_id, b1_id = (f"6f1b3d5a-7c9e-4b2d-8f4a-{index:012}" for index in range(4))
+    a1_id, a2_id, b11_id = (f"6f1b3d5a-7c9e-4b2d-8f4a-{index:012}" for index in range(4, 7))
+
+    def offer(shop_unit_id, parent_id, price):
+        return {"type": "OFFER", "name": "moved offer", "id": shop_unit_id, "parentId": parent_id, "price": price}
+
+    def category(shop_unit_id, parent_id):
+        return {"type": "CATEGORY", "name": "moved category", "id": shop_unit_id, "parentId": parent_id}
+
+    steps = [
+        (
+            [category(root_id, None), category(a_id, root_id), category(b_id, root_id), category(b1_id, b_id),
+             offer(a1_id, a_id, 10), offer(a2_id, a_id, 21), offer(b11_id, b1_id, 5)],
+            {root_id: (None, 12), a_id: (root_id, 15), b_id: (root_id, 5), b1_id: (b_id, 5),
+             a1_id: (a_id, 10), a2_id: (a_id, 21), b11_id: (b1_id, 5)},
+        ),
+        # товар в другую ветку с новой ценой
+        (
+            [offer(a2_id, b1_id, 22)],
+            {root_id: (None, 12), a_id: (root_id, 10), b_id: (root_id, 13), b1_id: (b_id, 13),
+             a1_id: (a_id, 10), a2_id: (b1_id, 22), b11_id: (b1_id, 5)},
+        ),
+        # категория вместе с поддеревом
+        (
+            [category(a_id, b_id)],
+            {root_id: (None, 12), a_id: (b_id, 10), b_id: (root_id, 12), b1_id: (b_id, 13),
+             a1_id: (a_id, 10), a2_id: (b1_id, 22), b11_id: (b1_id, 5)},
+        ),
+        # товар из дерева
+        (
+            [offer(b11_id, None, 5)],
+            {root_id: (None, 16), a_id: (b_id, 10), b_id: (root_id, 16), b1_id: (b_id, 22),
+             a1_id: (a_id, 10), a2_id: (b1_id, 22)},
+        ),
+    ]
+    for index, (items, expected) in enumerate(steps):
+        status, _ = request("/imports", method="POST", data={
+            "items": items, "updateDate": f"2022-06-{index + 10}T12:00:00.000Z"
+        })
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        check_prices(root_id, expected)
+        check_repair(root_id)
+
+    check_repair(b11_id)
+    for shop_unit_id in (root_id, b11_id):
+        status, _ = request(f"/delete/{shop_unit_id}", method="DELETE")
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test moves passed.")
+
+
+def test_delete_reimport():
+    # удаленные элементы пропадают из hierarchy и агрегатов веток, повторная выгрузка тех же id
+    # строит ветки заново (в т.ч. под другими родителями)
+    root_id, category_id, o1_id, o2_id, o3_id = (f"2a4c6e8b-0d1f-4a3c-9e5b-{index:012}" for index in range(5))
+    batch = {
+        "items": [
+            {"type": "CATEGORY", "name": "reimport", "id": root_id, "parentId": None},
+            {"type": "CATEGORY", "name": "reimport category", "id": category_id, "parentId": root_id},
+            {"type": "OFFER", "name": "reimport offer", "id": o1_id, "parentId": category_id, "price": 10},
+            {"type": "OFFER", "name": "reimport offer", "id": o2_id, "parentId": category_id, "price": 20},
+            {"type": "OFFER", "name": "reimport offer", "id": o3_id, "parentId": root_id, "price": 40},
+        ],
+        "updateDate": "2022-06-20T12:00:00.000Z"
+    }
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_prices(root_id, {
+        root_id: (None, 23), category_id: (root_id, 15),
+        o1_id: (category_id, 10), o2_id: (category_id, 20), o3_id: (root_id, 40),
+    })
+
+    status, _ = request(f"/delete/{category_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    for shop_unit_id in (category_id, o1_id, o2_id):
+        status, _ = request(f"/nodes/{shop_unit_id}")
+        assert status == 404, f"Expected HTTP status code 404, got {status}"
+    check_prices(root_id, {root_id: (None, 40), o3_id: (root_id, 40)})
+    check_repair(root_id)
+
+    batch = {
+        "items": [
+            {"type": "CATEGORY", "name": "reimport category", "id": category_id, "parentId": root_id},
+            {"type": "OFFER", "name": "reimport offer", "id": o1_id, "parentId": category_id, "price": 30},
+            {"type": "OFFER", "name": "reimport offer", "id": o2_id, "parentId": root_id, "price": 20},
+        ],
+        "updateDate": "2022-06-21T12:00:00.000Z"
+    }
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_prices(root_id, {
+        root_id: (None, 30), category_id: (root_id, 30),
+        o1_id: (category_id, 30), o2_id: (root_id, 20), o3_id: (root_id, 40),
+    })
+    check_prices(category_id, {category_id: (root_id, 30), o1_id: (category_id, 30)})
+    check_repair(root_id)
+
+    status, _ = request(f"/delete/{root_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test delete reimport passed.")
+
+
+def test_prices_rounding():
+    # цены категорий - целая часть среднего: агрегаты в бд совпадают с пересчетом market-repair,
+    # цена в /nodes и в истории (считается делением в postgres) - с // в python
+    root_id = "4b6d8f0a-2c4e-4a6b-8d0f-1a3c5e7b9d01"
+    left_id = "4b6d8f0a-2c4e-4a6b-8d0f-1a3c5e7b9d02"
+    right_id = "4b6d8f0a-2c4e-4a6b-8d0f-1a3c5e7b9d03"
+    date = "2022-05-01T12:00:00.000Z"
+    prices = {left_id: [1, 2, 2], right_id: [7, 10]}
+    batch = {
+        "items": [
+            {"type": "CATEGORY", "name": "rounding", "id": root_id, "parentId": None},
+            {"type": "CATEGORY", "name": "rounding left", "id": left_id, "parentId": root_id},
+            {"type": "CATEGORY", "name": "rounding right", "id": right_id, "parentId": root_id},
+        ] + [
+            {"type": "OFFER", "name": f"rounding offer {index}", "id": f"{parent_id}-{index}",
+             "parentId": parent_id, "price": price}
+            for parent_id, offer_prices in prices.items() for index, price in enumerate(offer_prices)
+        ],
+        "updateDate": date
+    }
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_repair(root_id)
+
+    expected = {shop_unit_id: sum(offer_prices) // len(offer_prices) for shop_unit_id, offer_prices in prices.items()}
+    expected[root_id] = sum(map(sum, prices.values())) // sum(map(len, prices.values()))
+    params = urllib.parse.urlencode({
+        "dateStart": "2022-05-01T00:00:00.000Z", "dateEnd": "2022-05-02T00:00:00.000Z"
+    })
+    for shop_unit_id, price in expected.items():
+        status, response = request(f"/nodes/{shop_unit_id}?depth=0", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        assert response["price"] == price, f"Expected price {price}, got {response['price']}"
+
+        status, response = request(f"/node/{shop_unit_id}/statistic?{params}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        assert response["stats"] == [{"update_date": date, "price": price}], response["stats"]
+
+    status, _ = request(f"/delete/{root_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test prices rounding passed.")
+
+
 def test_nodes():
     start = datetime.datetime.now()
     status, response = request(f"/nodes/{ROOT_ID}", json_response=True)
@@ -345,6 +655,17 @@ def test_nodes():
 
     print("Nodes sucsess request time: %s" % (datetime.datetime.now() - start))
 
+    start = datetime.datetime.now()
+    # товар без дочерних элементов тоже отдается как дерево из одного узла
+    offer = EXPECTED_TREE["children"][0]["children"][0]
+    status, response = request(f"/nodes/{offer['id']}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    if response != offer:
+        print_diff(offer, response)
+        print("Response tree doesn't match expected tree.")
+        sys.exit(1)
+    print("Nodes sucsess request time: %s" % (datetime.datetime.now() - start))
+
     start = datetime.datetime.now()
     # мой тест на заведомо неверный id
     status, response = request("/nodes/bla_bla_bla", json_response=True)
@@ -355,6 +676,118 @@ def test_nodes():
     print("Test nodes passed.")
 
 
+def truncate_tree(node, depth):
+    node = dict(node)
+    if depth == 0 or not node["children"]:
+        node["children"] = None
+    else:
+        node["children"] = [truncate_tree(child, depth - 1) for child in node["children"]]
+    return node
+
+
+def test_nodes_page():
+    start = datetime.datetime.now()
+    deep_sort_children(EXPECTED_TREE)
+    for depth in (0, 1, 2):
+        status, response = request(f"/nodes/{ROOT_ID}?depth={depth}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        deep_sort_children(response)
+        expected = truncate_tree(EXPECTED_TREE, depth)
+        if response != expected:
+            print_diff(expected, response)
+            print("Response tree doesn't match expected tree.")
+            sys.exit(1)
+
+    # прямые дети корня по одному на страницу
+    children, cursor = [], None
+    while True:
+        params = {"depth": 1, "childrenLimit": 1, **({"cursor": cursor} if cursor else {})}
+        status, response = request(f"/nodes/{ROOT_ID}?{urllib.parse.urlencode(params)}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        children.extend(response["children"] or [])
+        cursor = response["nextCursor"]
+        if cursor is None:
+            break
+    # порядок страниц задает сортировка бд (collation), сравниваем без учета порядка
+    children.sort(key=lambda x: x["id"])
+    assert children == truncate_tree(EXPECTED_TREE, 1)["children"], children
+
+    status, _ = request(f"/nodes/{ROOT_ID}?depth=-1", json_response=True)
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+    print("Nodes page request time: %s" % (datetime.datetime.now() - start))
+
+    print("Test nodes page passed.")
+
+
+def test_nodes_batch():
+    start = datetime.datetime.now()
+    child = EXPECTED_TREE["children"][0]
+    ides = [ROOT_ID, child["id"], "bla_bla_bla"]
+    for status, response in (
+        request(f"/nodes?ids={','.join(ides)}", json_response=True),
+        request("/nodes", method="POST", data={"ids": ides}, json_response=True),
+    ):
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        assert list(response) == ides, list(response)
+        assert response["bla_bla_bla"] is None, response["bla_bla_bla"]
+        for shop_unit_id, expected in ((ROOT_ID, EXPECTED_TREE), (child["id"], child)):
+            deep_sort_children(response[shop_unit_id])
+            deep_sort_children(expected)
+            if response[shop_unit_id] != expected:
+                print_diff(expected, response[shop_unit_id])
+                print("Response tree doesn't match expected tree.")
+                sys.exit(1)
+
+    status, _ = request("/nodes", method="POST", data={"ids": []})
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    # цепочка глубже 254 уровней (предел вложенности orjson), дети - в том же порядке, что и в /nodes/{id}
+    chain = [f"7e1a9c3d-chain-{index:03}" for index in range(300)]
+    batch = {
+        "items": [
+            {"type": "CATEGORY", "name": shop_unit_id, "id": shop_unit_id,
+             "parentId": chain[index - 1] if index else None}
+            for index, shop_unit_id in enumerate(chain)
+        ] + [
+            {"type": "OFFER", "name": name, "id": f"{chain[0]}-{name}", "parentId": chain[0], "price": 1}
+            for name in ("c", "a", "b")
+        ],
+        "updateDate": "2022-02-08T12:00:00.000Z"
+    }
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, response = request(f"/nodes?ids={chain[0]}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    status, expected = request(f"/nodes/{chain[0]}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response[chain[0]] == expected, "Batch tree doesn't match /nodes tree"
+
+    status, _ = request(f"/delete/{chain[0]}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    print("Nodes batch request time: %s" % (datetime.datetime.now() - start))
+
+    print("Test nodes batch passed.")
+
+
+def test_compression():
+    start = datetime.datetime.now()
+    req = urllib.request.Request(f"{API_BASEURL}/nodes/{ROOT_ID}", headers={"Accept-Encoding": "gzip"})
+    with urllib.request.urlopen(req) as res:
+        assert res.headers["Content-Encoding"] == "gzip", res.headers["Content-Encoding"]
+        response = json.loads(gzip.decompress(res.read()).decode("utf-8"))
+
+    deep_sort_children(response)
+    deep_sort_children(EXPECTED_TREE)
+    if response != EXPECTED_TREE:
+        print_diff(EXPECTED_TREE, response)
+        print("Response tree doesn't match expected tree.")
+        sys.exit(1)
+    print("Compression request time: %s" % (datetime.datetime.now() - start))
+
+    print("Test compression passed.")
+
+
 def test_sales():
     start = datetime.datetime.now()
 
@@ -373,6 +806,28 @@ def test_sales():
     print("Sales request time: %s" % (datetime.datetime.now() - start))
     start = datetime.datetime.now()
 
+    # постранично (по возрастанию id) - те же товары
+    pages, after = [], None
+    while True:
+        query = {"date": "2022-02-04T00:00:00.000Z", "limit": 2}
+        if after is not None:
+            query["after"] = after
+        status, response = request(f"/sales?{urllib.parse.urlencode(query)}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        pages.extend(response)
+        if len(response) < 2:
+            break
+        after = response[-1]["id"]
+
+    sort_sales(pages)
+    if pages != SALES_EXAMPLE:
+        print_diff(SALES_EXAMPLE, pages)
+        print("Response tree doesn't match expected tree.")
+        sys.exit(1)
+
+    print("Sales pages request time: %s" % (datetime.datetime.now() - start))
+    start = datetime.datetime.now()
+
     params = urllib.parse.urlencode({"date": "2022-01-04T00:00:00.000Z"})
     status, response = request(f"/sales?{params}", json_response=True)
     assert status == 200, f"Expected HTTP status code 200, got {status}"
@@ -396,6 +851,25 @@ def test_sales():
     assert status == 400, f"Expected HTTP status code 400, got {status}"
 
     print("Sales request time: %s" % (datetime.datetime.now() - start))
+
+    # выгрузка задним числом меняет цену, но не сдвигает дату изменения цены назад
+    offer_id = "5e8b2d4f-7a1c-4e3b-9d6f-1c3e5a7b9d01"
+    for price, date in ((100, "2022-03-10T12:00:00.000Z"), (90, "2022-03-05T12:00:00.000Z")):
+        batch = {
+            "items": [{"type": "OFFER", "name": "backdated offer", "id": offer_id, "parentId": None, "price": price}],
+            "updateDate": date
+        }
+        status, _ = request("/imports", method="POST", data=batch)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, response = request(f"/sales?{urllib.parse.urlencode({'date': '2022-03-10T12:00:00.000Z'})}",
+                               json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert [item["id"] for item in response] == [offer_id], response
+
+    status, _ = request(f"/delete/{offer_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
     print("Test sales passed.")
 
 
@@ -418,6 +892,33 @@ def test_stats():
     print("Stats request time: %s" % (datetime.datetime.now() - start))
     start = datetime.datetime.now()
 
+    # по одной записи на день: последняя цена, минимум, максимум, среднее и кол-во
+    params = urllib.parse.urlencode({
+        "dateStart": "2022-02-01T00:00:00.000Z", "dateEnd": "2022-02-04T00:00:00.000Z", "bucket": "day"
+    })
+    status, response = request(f"/node/{ROOT_ID}/statistic?{params}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    expected = [
+        {'update_date': '2022-02-02T00:00:00.000Z', 'price': 69999,
+         'min': 69999, 'max': 69999, 'avg': 69999, 'count': 1},
+        {'update_date': '2022-02-03T00:00:00.000Z', 'price': 58599,
+         'min': 55749, 'max': 58599, 'avg': 57174, 'count': 2},
+    ]
+    if response["stats"] != expected or response["price"] != 58599:
+        print_diff(expected, response["stats"])
+        print("Response tree doesn't match expected tree.")
+        sys.exit(1)
+
+    params = urllib.parse.urlencode({
+        "dateStart": "2022-02-01T00:00:00.000Z", "dateEnd": "2022-02-04T00:00:00.000Z", "bucket": "year"
+    })
+    status, _ = request(f"/node/{ROOT_ID}/statistic?{params}")
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    print("Stats buckets request time: %s" % (datetime.datetime.now() - start))
+    start = datetime.datetime.now()
+
     params = urllib.parse.urlencode({
         "dateStart": "2022-02-daada:00:00.000Z", "dateEnd": "2022-02-04T00:00:00.000Z"
     })
@@ -435,6 +936,150 @@ def test_stats():
     print("Test stats passed.")
 
 
+def test_stats_batch():
+    start = datetime.datetime.now()
+    offer_id = "863e1a7a-1304-42ae-943b-179184c077e3"
+    dates = {"dateStart": "2022-02-01T00:00:00.000Z", "dateEnd": "2022-02-04T00:00:00.000Z"}
+    ides = [ROOT_ID, offer_id, "bla_bla_bla"]
+    expected = {
+        ROOT_ID: STATS_EXAMPLE,
+        offer_id: {
+            "id": offer_id, "name": "jPhone 13", "parentId": "d515e43f-f3f6-4471-bb77-6b455017a2d2",
+            "type": "OFFER", "price": 79999, "stats": [{"update_date": "2022-02-02T12:00:00.000Z", "price": 79999}]
+        },
+    }
+
+    for status, response in (
+        request(f"/statistic?{urllib.parse.urlencode({'ids': ','.join(ides), **dates})}", json_response=True),
+        request("/statistic", method="POST", data={"ids": ides, **dates}, json_response=True),
+    ):
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        assert response["notFound"] == ["bla_bla_bla"], response["notFound"]
+
+        items = {item["id"]: item for item in response["items"]}
+        if items != expected:
+            print_diff(expected, items)
+            print("Response tree doesn't match expected tree.")
+            sys.exit(1)
+
+    status, _ = request(f"/statistic?{urllib.parse.urlencode({'ids': ROOT_ID})}")
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    print("Stats batch request time: %s" % (datetime.datetime.now() - start))
+    print("Test stats batch passed.")
+
+
+def test_stats_out_of_order():
+    # выгрузки задним числом: цена сравнивается с записью на свою дату, лишние записи не остаются
+    category_id = "8a2c4e6f-1b3d-4f5a-8c7e-9d1f3b5a7c01"
+    offer_id = "8a2c4e6f-1b3d-4f5a-8c7e-9d1f3b5a7c02"
+    for price, date in ((100, "2022-04-10T12:00:00.000Z"), (50, "2022-04-05T12:00:00.000Z"),
+                        (100, "2022-04-08T12:00:00.000Z")):
+        batch = {
+            "items": [
+                {"type": "CATEGORY", "name": "backdated", "id": category_id, "parentId": None},
+                {"type": "OFFER", "name": "backdated offer", "id": offer_id, "parentId": category_id, "price": price},
+            ],
+            "updateDate": date
+        }
+        status, _ = request("/imports", method="POST", data=batch)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    expected = [
+        {"update_date": "2022-04-05T12:00:00.000Z", "price": 50},
+        {"update_date": "2022-04-08T12:00:00.000Z", "price": 100},
+    ]
+    params = urllib.parse.urlencode({
+        "dateStart": "2022-04-01T00:00:00.000Z", "dateEnd": "2022-04-30T00:00:00.000Z"
+    })
+    for shop_unit_id in (offer_id, category_id):
+        status, response = request(f"/node/{shop_unit_id}/statistic?{params}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        sort_stats(response)
+        if response["stats"] != expected:
+            print_diff(expected, response["stats"])
+            print("Response stats don't match expected stats.")
+            sys.exit(1)
+
+    status, _ = request(f"/delete/{category_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test stats out of order passed.")
+
+
+def test_stats_lazy():
+    # история категорий одинакова в обоих режимах: --history-mode snapshot пишет ее при импорте,
+    # --history-mode lazy собирает из истории товаров при чтении (и кэширует до изменения версии),
+    # поэтому тест проверяет тот режим, в котором запущен сервис
+    category_id, sub_id, o1_id, o2_id, o3_id = (f"9c1e3a5b-7d9f-4b1d-a3c5-{index:012}" for index in range(5))
+
+    def offer(shop_unit_id, parent_id, price):
+        return {"type": "OFFER", "name": "lazy offer", "id": shop_unit_id, "parentId": parent_id, "price": price}
+
+    imports = [
+        ("2022-07-01T12:00:00.000Z", [
+            {"type": "CATEGORY", "name": "lazy", "id": category_id, "parentId": None},
+            {"type": "CATEGORY", "name": "lazy sub", "id": sub_id, "parentId": category_id},
+            offer(o1_id, category_id, 100), offer(o2_id, sub_id, 200),
+        ]),
+        ("2022-07-02T12:00:00.000Z", [offer(o3_id, sub_id, 300)]),
+        # цена o1 не меняется
+        ("2022-07-03T12:00:00.000Z", [offer(o1_id, category_id, 100), offer(o2_id, sub_id, 230)]),
+        # цена категории не меняется, подкатегории - меняется
+        ("2022-07-04T12:00:00.000Z", [offer(o1_id, category_id, 130), offer(o2_id, sub_id, 200)]),
+    ]
+    for date, items in imports:
+        status, _ = request("/imports", method="POST", data={"items": items, "updateDate": date})
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    def check_stats(shop_unit_id, date_start, date_end, expected, bucket=None):
+        query = {"dateStart": date_start, "dateEnd": date_end}
+        if bucket is not None:
+            query["bucket"] = bucket
+        status, response = request(f"/node/{shop_unit_id}/statistic?{urllib.parse.urlencode(query)}",
+                                    json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        if response["stats"] != expected or response["price"] != (expected[-1]["price"] if expected else None):
+            print_diff(expected, response)
+            print("Response stats don't match expected stats.")
+            sys.exit(1)
+
+    start, end = "2022-07-01T00:00:00.000Z", "2022-07-06T00:00:00.000Z"
+    category_stats = [
+        {"update_date": "2022-07-01T12:00:00.000Z", "price": 150},
+        {"update_date": "2022-07-02T12:00:00.000Z", "price": 200},
+        {"update_date": "2022-07-03T12:00:00.000Z", "price": 210},
+    ]
+    # повторный запрос - из кэша (в режиме lazy)
+    for _ in range(2):
+        check_stats(category_id, start, end, category_stats)
+    check_stats(sub_id, start, end, [
+        {"update_date": "2022-07-01T12:00:00.000Z", "price": 200},
+        {"update_date": "2022-07-02T12:00:00.000Z", "price": 250},
+        {"update_date": "2022-07-03T12:00:00.000Z", "price": 265},
+        {"update_date": "2022-07-04T12:00:00.000Z", "price": 250},
+    ])
+    # период начинается после первых изменений: цена на его начало берется из истории до него
+    check_stats(category_id, "2022-07-02T00:00:00.000Z", end, category_stats[1:])
+    check_stats(category_id, start, end, [
+        {"update_date": f"2022-07-0{day}T00:00:00.000Z", "price": price,
+         "min": price, "max": price, "avg": price, "count": 1}
+        for day, price in ((1, 150), (2, 200), (3, 210))
+    ], bucket="day")
+
+    # новая выгрузка меняет версию категории, закэшированная история не используется
+    status, _ = request("/imports", method="POST", data={
+        "items": [offer(o3_id, sub_id, 330)], "updateDate": "2022-07-05T12:00:00.000Z"
+    })
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_stats(category_id, start, end, category_stats + [{"update_date": "2022-07-05T12:00:00.000Z", "price": 220}])
+
+    status, _ = request(f"/delete/{category_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test stats lazy passed.")
+
+
 def test_delete():
     start = datetime.datetime.now()
     status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
@@ -449,15 +1094,122 @@ def test_delete():
     print("Test delete passed.")
 
 
+def test_names():
+    # названия, совпадающие с типами элементов, не должны меняться в ответах
+    root_id = "5c4a3a6e-8a8e-4d1c-9d0b-6f5a6c0f3b11"
+    offer_id = "0f9e6d1b-3e2a-4c0f-8f55-2a8f1f6d7c42"
+    batch = {
+        "items": [
+            {"type": "CATEGORY", "name": "category of offers", "id": root_id, "parentId": None},
+            {"type": "OFFER", "name": "offer in category", "id": offer_id, "parentId": root_id, "price": 10},
+        ],
+        "updateDate": "2022-02-05T12:00:00.000Z"
+    }
+
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, response = request(f"/nodes/{root_id}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["name"] == "category of offers", response["name"]
+    assert response["children"][0]["name"] == "offer in category", response["children"][0]["name"]
+
+    status, _ = request(f"/delete/{root_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test names passed.")
+
+
+def test_conditional():
+    # ETag и Last-Modified меняются при любом изменении поддерева, в т.ч. при удалении (дата при этом не меняется)
+    root_id = "9b1e2f4c-6a3d-4e8b-a1c7-3d5f7e9b2c10"
+    offer_id = "2d4f6a8c-1b3e-4f5a-9c7d-8e0a2b4c6d21"
+    batch = {
+        "items": [
+            {"type": "CATEGORY", "name": "conditional", "id": root_id, "parentId": None},
+            {"type": "OFFER", "name": "conditional offer", "id": offer_id, "parentId": root_id, "price": 10},
+        ],
+        "updateDate": "2022-02-06T12:00:00.000Z"
+    }
+    params = urllib.parse.urlencode({
+        "dateStart": "2022-02-01T00:00:00.000Z",
+        "dateEnd": "2022-02-07T00:00:00.000Z"
+    })
+
+    status, _ = request("/imports", method="POST", data=batch)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    for path in (f"/nodes/{root_id}", f"/node/{root_id}/statistic?{params}"):
+        status, headers = request_headers(path)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        etag, last_modified = headers["ETag"], headers["Last-Modified"]
+        assert etag and last_modified, headers
+
+        status, _ = request_headers(path, {"If-None-Match": etag})
+        assert status == 304, f"Expected HTTP status code 304, got {status}"
+        status, _ = request_headers(path, {"If-Modified-Since": last_modified})
+        assert status == 304, f"Expected HTTP status code 304, got {status}"
+
+    status, headers = request_headers(f"/nodes/{root_id}")
+    etag, last_modified = headers["ETag"], headers["Last-Modified"]
+    # Last-Modified передается с точностью до секунды
+    time.sleep(1)
+    status, _ = request(f"/delete/{offer_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    status, headers = request_headers(f"/nodes/{root_id}", {"If-None-Match": etag})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert headers["ETag"] != etag, headers["ETag"]
+    status, headers = request_headers(f"/nodes/{root_id}", {"If-Modified-Since": last_modified})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert headers["Last-Modified"] != last_modified, headers["Last-Modified"]
+
+    status, _ = request(f"/delete/{root_id}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test conditional passed.")
+
+
 def test_all():
     test_import()
     print()
     print()
 
+    test_import_async()
+    print()
+    print()
+
+    test_import_chunks()
+    print()
+    print()
+
+    test_prices_rounding()
+    print()
+    print()
+
+    test_moves()
+    print()
+    print()
+
+    test_delete_reimport()
+    print()
+    print()
+
     test_nodes()
     print()
     print()
 
+    test_nodes_page()
+    print()
+    print()
+
+    test_nodes_batch()
+    print()
+    print()
+
+    test_compression()
+    print()
+    print()
+
     test_sales()
     print()
     print()
@@ -466,6 +1218,26 @@ def test_all():
     print()
     print()
 
+    test_stats_batch()
+    print()
+    print()
+
+    test_stats_out_of_order()
+    print()
+    print()
+
+    test_stats_lazy()
+    print()
+    print()
+
+    test_names()
+    print()
+    print()
+
+    test_conditional()
+    print()
+    print()
+
     # test_delete()
 
 